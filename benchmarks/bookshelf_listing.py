@@ -0,0 +1,78 @@
+"""Compare listing bookshelves with a `note_count` subquery and the column.
+
+Creates a user owning thousands of notes in the database configured in the
+settings, then measures the latency of the first page of `get_bookshelves` with
+the correlated `SELECT count(*)` subquery per bookshelf it used to run, and with
+the denormalized `bookshelf.note_count` column it reads now:
+
+    pdm run python benchmarks/bookshelf_listing.py --bookshelves 50 --notes 200
+
+The data is deleted afterwards.
+"""
+
+import argparse
+import asyncio
+
+from fixtures import create_notes, create_user, delete_user
+from sqlalchemy import func
+from sqlmodel import select
+from timing import measure
+
+from notice_api.bookshelves.routes import select_bookshelves_page
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.db import AsyncSessionFactory, engine, migrate_database
+from notice_api.notes.schema import Note
+
+PAGE_SIZE = 10
+
+
+async def benchmark(bookshelves: int, notes: int, rounds: int):
+    await migrate_database()
+
+    async with AsyncSessionFactory() as db:
+        user = await create_user(db)
+        try:
+            await create_notes(db, user, bookshelves, notes)
+            print(f"{bookshelves} bookshelves, {bookshelves * notes} notes")
+
+            note_count_subquery = (
+                select(func.count())
+                .select_from(Note)
+                .where(Note.bookshelf_id == Bookshelf.id)
+                .scalar_subquery()
+                .label("note_count")
+            )
+            column_page = select_bookshelves_page(
+                user.id, PAGE_SIZE, "desc", "created_at"
+            )
+            subquery_page = column_page.add_columns(note_count_subquery)
+
+            conn = await db.connection()
+
+            async def list_with_subquery():
+                return (await conn.execute(subquery_page)).all()
+
+            async def list_with_column():
+                return (await conn.execute(column_page)).all()
+
+            print(f"  subquery: {await measure(rounds, list_with_subquery)}")
+            print(f"    column: {await measure(rounds, list_with_column)}")
+        finally:
+            await delete_user(db, user)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare listing bookshelves with a subquery and the column."
+    )
+    parser.add_argument("--bookshelves", type=int, default=50)
+    parser.add_argument("--notes", type=int, default=200, help="per bookshelf")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.bookshelves, args.notes, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Synthetic data shared by the benchmarks, deleted once they are done."""
+
+from datetime import datetime
+from uuid import UUID, uuid4
+
+from sqlalchemy import delete, insert
+from sqlmodel import col
+
+from notice_api.auth.schema import User
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.db import AsyncSession
+from notice_api.notes.note_content import DEFAULT_NOTE_CONTENT
+from notice_api.notes.schema import Note
+
+INSERT_CHUNK = 1000
+
+
+async def create_user(db: AsyncSession) -> User:
+    user = User(
+        id=f"benchmark-{uuid4()}",
+        email="benchmark@example.com",
+        email_verified=datetime.now(),
+    )
+    db.add(user)
+    await db.commit()
+    return user
+
+
+async def create_notes(
+    db: AsyncSession, user: User, bookshelves: int, notes: int
+) -> list[UUID]:
+    """Create `bookshelves` bookshelves of `notes` notes each for `user`."""
+
+    conn = await db.connection()
+    bookshelf_ids = [uuid4() for _ in range(bookshelves)]
+    await conn.execute(
+        insert(Bookshelf),
+        [
+            {
+                "id": bookshelf_id,
+                "title": f"benchmark {i}",
+                "user_id": user.id,
+                "note_count": notes,
+            }
+            for i, bookshelf_id in enumerate(bookshelf_ids)
+        ],
+    )
+    rows = [
+        {
+            "id": uuid4(),
+            "title": f"benchmark {i}",
+            "content": DEFAULT_NOTE_CONTENT,
+            "bookshelf_id": bookshelf_id,
+            "user_id": user.id,
+        }
+        for bookshelf_id in bookshelf_ids
+        for i in range(notes)
+    ]
+    for start in range(0, len(rows), INSERT_CHUNK):
+        await conn.execute(insert(Note), rows[start : start + INSERT_CHUNK])
+    await db.commit()
+    return bookshelf_ids
+
+
+async def delete_user(db: AsyncSession, user: User):
+    """Delete the user with all of their bookshelves and notes."""
+
+    # The rollback expires `user`, which can't be loaded again outside of a query.
+    user_id = user.id
+    await db.rollback()
+    conn = await db.connection()
+    await conn.execute(delete(Note).where(col(Note.user_id) == user_id))
+    await conn.execute(delete(Bookshelf).where(col(Bookshelf.user_id) == user_id))
+    await conn.execute(delete(User).where(col(User.id) == user_id))
+    await db.commit()
@@ -0,0 +1,113 @@
+"""Compare serializing a page of a listing with pydantic and with msgspec.
+
+Measures the time spent turning the rows of a page of `get_notes` and
+`get_bookshelves` into the body of the response, without a database:
+
+    pdm run python benchmarks/listing_serialization.py --limit 50
+
+- `pydantic`: what the routes used to do, validating every row into a
+  `NoteRead`/`BookshelfRead`, then letting FastAPI validate and serialize the
+  response model again.
+- `msgspec`: what the routes do now, encoding dicts of the rows in one pass, see
+  `notice_api.utils.responses`.
+"""
+
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from timing import measure
+
+from notice_api.bookshelves.routes import GetBookshelvesResponse
+from notice_api.bookshelves.schema import BookshelfRead
+from notice_api.notes.routes import GetNotesResponse
+from notice_api.notes.schema import NoteRead
+from notice_api.utils.responses import MsgspecJSONResponse
+
+
+def make_rows(limit: int) -> list[tuple]:
+    """Make the rows of a page, `(id, title, created_at, note_count)`."""
+
+    rng = random.Random(0)
+    start = datetime(2024, 2, 19, 9, 0)
+    return [
+        (
+            uuid4(),
+            f"Lecture {index}: " + "".join(rng.choices("abcdefgh ", k=24)),
+            start + timedelta(seconds=rng.randint(0, 10_000_000), microseconds=index),
+            rng.randint(0, 200),
+        )
+        for index in range(limit)
+    ]
+
+
+async def benchmark(limit: int, rounds: int):
+    rows = make_rows(limit)
+    note_field = create_response_field(name="get_notes", type_=GetNotesResponse)
+    bookshelf_field = create_response_field(
+        name="get_bookshelves", type_=GetBookshelvesResponse
+    )
+
+    async def notes_with_pydantic():
+        notes = [
+            NoteRead.model_validate({"id": id, "title": title, "created_at": created})
+            for id, title, created, _ in rows
+        ]
+        content = await serialize_response(
+            field=note_field,
+            response_content=GetNotesResponse(data=notes, next_cursor=None),
+        )
+        return JSONResponse(content).body
+
+    async def notes_with_msgspec():
+        notes = [
+            {"id": id, "title": title, "created_at": created}
+            for id, title, created, _ in rows
+        ]
+        return MsgspecJSONResponse({"data": notes, "next_cursor": None}).body
+
+    async def bookshelves_with_pydantic():
+        bookshelves = [
+            BookshelfRead.model_validate(
+                {"id": id, "title": title, "created_at": created, "count": count}
+            )
+            for id, title, created, count in rows
+        ]
+        content = await serialize_response(
+            field=bookshelf_field,
+            response_content=GetBookshelvesResponse(data=bookshelves, next_cursor=None),
+        )
+        return JSONResponse(content).body
+
+    async def bookshelves_with_msgspec():
+        bookshelves = [
+            {"id": id, "title": title, "created_at": created, "count": count}
+            for id, title, created, count in rows
+        ]
+        return MsgspecJSONResponse({"data": bookshelves, "next_cursor": None}).body
+
+    print(f"pages of {limit} rows")
+    print(f"      notes pydantic: {await measure(rounds, notes_with_pydantic)}")
+    print(f"      notes  msgspec: {await measure(rounds, notes_with_msgspec)}")
+    print(f"bookshelves pydantic: {await measure(rounds, bookshelves_with_pydantic)}")
+    print(f"bookshelves  msgspec: {await measure(rounds, bookshelves_with_msgspec)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare serializing a listing page with pydantic and msgspec."
+    )
+    parser.add_argument("--limit", type=int, default=50, help="rows per page")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.limit, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Compare the `json` and `compressed` note storage engines.
+
+Measures the read and write latency of `NoteRepository` and the storage size of
+a synthetic lecture note, against the database configured in the settings:
+
+    pdm install -G compression
+    pdm run python benchmarks/note_storage.py --blocks 300 --rounds 50
+
+With `--offline`, only the size and the encoding time of the content are
+measured, without a database.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import text
+from timing import measure
+
+from notice_api.auth.schema import User
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.db import AsyncSessionFactory, migrate_database
+from notice_api.db import engine as database_engine
+from notice_api.notes.compression import decode_content, encode_content
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import CompressedNoteRepository, NoteRepository
+from notice_api.notes.schema import Note
+
+WORDS = [
+    *("the", "lecture", "covers", "gradient", "descent", "learning", "rate"),
+    *("convergence", "loss", "function", "optimization", "stochastic", "batch"),
+    *("momentum", "example", "theorem", "proof", "definition", "matrix"),
+    *("vector", "eigenvalue", "professor", "exam", "homework", "chapter"),
+]
+
+
+def make_content(blocks: int, seed: int = 0) -> list[NoteContent]:
+    """Build a note with about `blocks` nodes, nested up to three levels."""
+
+    rng = random.Random(seed)
+    content: list[NoteContent] = []
+    count = 0
+    while count < blocks:
+        heading: NoteContent = {
+            "id": str(uuid4()),
+            "type": "HeadingNode",
+            "value": " ".join(rng.choices(WORDS, k=4)),
+            "children": [],
+            "level": 2,
+        }
+        count += 1
+        for _ in range(rng.randint(3, 8)):
+            item: NoteContent = {
+                "id": str(uuid4()),
+                "type": "ListItemNode",
+                "value": " ".join(rng.choices(WORDS, k=rng.randint(5, 20))),
+                "children": [],
+            }
+            for _ in range(rng.randint(0, 3)):
+                item["children"].append(
+                    {
+                        "id": str(uuid4()),
+                        "type": "ListItemNode",
+                        "value": " ".join(rng.choices(WORDS, k=rng.randint(3, 12))),
+                        "children": [],
+                    }
+                )
+            heading["children"].append(item)
+            count += 1 + len(item["children"])
+        content.append(heading)
+    return content
+
+
+def benchmark_codec(content: list[NoteContent], rounds: int):
+    plain = json.dumps(content).encode()
+    encoding, data, _ = encode_content(content)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode_content(content)
+    encode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode_content(encoding, data)
+    decode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    print(f"JSON:    {len(plain):8} bytes")
+    print(f"{encoding}:    {len(data):8} bytes ({len(data) / len(plain):.1%})")
+    print(f"encode:  {encode_ms:8.3f} ms, decode: {decode_ms:.3f} ms")
+
+
+async def benchmark_database(content: list[NoteContent], rounds: int):
+    await migrate_database()
+
+    async with AsyncSessionFactory() as db:
+        user = User(
+            id=f"benchmark-{uuid4()}",
+            email="benchmark@example.com",
+            email_verified=datetime.now(),
+        )
+        db.add(user)
+        await db.flush()
+        bookshelf = Bookshelf(title="benchmark", user_id=user.id)
+        db.add(bookshelf)
+        await db.flush()
+        await db.refresh(bookshelf)
+        assert bookshelf.id is not None
+
+        notes = {
+            engine: Note(
+                title=f"benchmark {engine}",
+                bookshelf_id=bookshelf.id,
+                user_id=user.id,
+            )
+            for engine in ("json", "compressed")
+        }
+        db.add_all(notes.values())
+        await db.commit()
+        for note in notes.values():
+            await db.refresh(note)
+
+        repositories = {
+            "json": NoteRepository(db),
+            "compressed": CompressedNoteRepository(db),
+        }
+        try:
+            for engine, repo in repositories.items():
+                note_id = notes[engine].id
+                assert note_id is not None
+                await repo.update_note_content(note_id, content)
+
+                write = await measure(
+                    rounds,
+                    lambda repo=repo, note_id=note_id: repo.update_note_content(
+                        note_id, content
+                    ),
+                )
+                read = await measure(
+                    rounds,
+                    lambda repo=repo, note_id=note_id: repo.get_note_content(note_id),
+                )
+                print(f"{engine:>10} write: {write}")
+                print(f"{engine:>10}  read: {read}")
+
+            conn = await db.connection()
+            size = "JSON_STORAGE_SIZE(content)"
+            if conn.dialect.name == "sqlite":
+                size = "LENGTH(content)"
+            result = await conn.execute(
+                text(f"SELECT {size} FROM note WHERE id = :id"),
+                {"id": notes["json"].id.hex},  # type: ignore[union-attr]
+            )
+            print(f"{'json':>10} stored: {result.scalar_one()} bytes")
+            result = await conn.execute(
+                text("SELECT LENGTH(data) FROM note_content_blob WHERE note_id = :id"),
+                {"id": notes["compressed"].id.hex},  # type: ignore[union-attr]
+            )
+            print(f"{'compressed':>10} stored: {result.scalar_one()} bytes")
+        finally:
+            await repositories["compressed"].delete_note_storage(
+                notes["compressed"].id  # type: ignore[arg-type]
+            )
+            for note in notes.values():
+                await db.delete(note)
+            await db.delete(bookshelf)
+            await db.delete(user)
+            await db.commit()
+    await database_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the json and compressed note storage engines."
+    )
+    parser.add_argument("--blocks", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+
+    content = make_content(args.blocks)
+    benchmark_codec(content, args.rounds)
+    if not args.offline:
+        asyncio.run(benchmark_database(content, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Check that the pagination queries are served by an index, without a filesort.
+
+Runs `EXPLAIN` on every page query of `get_bookshelves` and `get_notes`, for
+each sort column and order, with and without a cursor, against the MySQL
+database configured in the settings. A user owning a few thousand notes is
+created first, so the optimizer sees realistic tables, and deleted afterwards:
+
+    pdm run python benchmarks/query_plans.py
+
+Exits with status 1 if any of the queries does not use one of the pagination
+indexes or needs a filesort. The same queries are checked on SQLite by
+`tests/test_query_plans.py`, which runs with the other tests.
+"""
+
+import asyncio
+import itertools
+import sys
+from datetime import datetime
+from typing import Any, Literal
+from uuid import uuid4
+
+from fixtures import create_notes, create_user, delete_user
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from notice_api.bookshelves.routes import BookshelfCursor, select_bookshelves_page
+from notice_api.db import AsyncSessionFactory, migrate_database
+from notice_api.notes.routes import NoteCursor, select_notes_page
+
+INDEXES = {
+    "bookshelf": {
+        "created_at": "ix_bookshelf_user_id_created_at_id",
+        "title": "ix_bookshelf_user_id_title_id",
+    },
+    "note": {
+        "created_at": "ix_note_bookshelf_id_user_id_created_at_id",
+        "title": "ix_note_bookshelf_id_user_id_title_id",
+    },
+}
+
+
+async def explain(conn: AsyncConnection, statement: Any) -> list[dict[str, Any]]:
+    sql = statement.compile(
+        dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+    )
+    result = await conn.execute(text(f"EXPLAIN {sql}"))
+    return [dict(row) for row in result.mappings()]
+
+
+async def check() -> bool:
+    await migrate_database()
+
+    ok = True
+    async with AsyncSessionFactory() as db:
+        user = await create_user(db)
+        try:
+            bookshelf_ids = await create_notes(db, user, bookshelves=20, notes=200)
+            conn = await db.connection()
+            await conn.execute(text("ANALYZE TABLE bookshelf, note"))
+
+            sorts: list[Literal["title", "created_at"]] = ["title", "created_at"]
+            orders: list[Literal["asc", "desc"]] = ["asc", "desc"]
+            for sort, order, paged in itertools.product(sorts, orders, [False, True]):
+                position = {"id": uuid4(), "title": "benchmark 1"}
+                position["created_at"] = datetime.now()
+                queries = {
+                    "bookshelf": select_bookshelves_page(
+                        user.id,
+                        10,
+                        order,
+                        sort,
+                        BookshelfCursor.model_validate(position) if paged else None,
+                    ),
+                    "note": select_notes_page(
+                        user.id,
+                        bookshelf_ids[0],
+                        10,
+                        order,
+                        sort,
+                        NoteCursor.model_validate(position) if paged else None,
+                    ),
+                }
+                for table, statement in queries.items():
+                    (plan,) = await explain(conn, statement)
+                    extra = plan.get("Extra") or ""
+                    passed = (
+                        plan["key"] == INDEXES[table][sort] and "filesort" not in extra
+                    )
+                    ok = ok and passed
+                    print(
+                        f"{'ok' if passed else 'FAIL':4} {table:9} {sort:10} "
+                        f"{order:4} {'cursor' if paged else 'first':6} "
+                        f"key={plan['key']} extra={extra}"
+                    )
+        finally:
+            await delete_user(db, user)
+    return ok
+
+
+def main():
+    if not asyncio.run(check()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""Helpers shared by the benchmarks."""
+
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+
+
+async def measure(rounds: int, run: Callable[[], Awaitable[object]]) -> str:
+    """Run `run` `rounds` times and summarize its latency."""
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await run()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    median = statistics.median(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    return f"median {median:7.2f} ms, p95 {p95:7.2f} ms"
@@ -0,0 +1,36 @@
+"""Gunicorn settings, loaded from the working directory by `pdm run start`.
+
+The workers and the address are set on the command line of the script.
+"""
+
+import os
+import shutil
+from typing import Any
+
+from prometheus_client import multiprocess
+
+# The workers write their metrics to this directory, see `notice_api.utils.metrics`.
+METRICS_DIRECTORY = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/notice-api-metrics"
+)
+
+# The workers cache notes and sessions in memory, and keep each other's caches
+# up to date over the message bus, which the `local` transport doesn't reach.
+MESSAGE_BUS = os.environ.setdefault("MESSAGE_BUS", "unix")
+
+
+def on_starting(server: Any):
+    # The files of a previous run would be added to the new metrics.
+    shutil.rmtree(METRICS_DIRECTORY, ignore_errors=True)
+    os.makedirs(METRICS_DIRECTORY)
+
+    if MESSAGE_BUS == "local" and server.cfg.workers > 1:
+        server.log.warning(
+            "MESSAGE_BUS=local with %d workers, the workers will serve stale notes "
+            "and sessions, see notice_api.utils.bus",
+            server.cfg.workers,
+        )
+
+
+def child_exit(server: Any, worker: Any):
+    multiprocess.mark_process_dead(worker.pid)
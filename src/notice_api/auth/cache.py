@@ -0,0 +1,264 @@
+"""Per-worker cache of the sessions looked up by `get_current_user`.
+
+Every authenticated request and websocket resolves its session token to a user.
+Sessions rarely change, so the result of the lookup is cached for
+`SESSION_CACHE_TTL_SECONDS`, and never beyond the expiry of the session. Tokens
+which don't match a valid session are cached too, for the shorter
+`SESSION_CACHE_NEGATIVE_TTL_SECONDS`, so bad tokens don't hit the database on
+every request either.
+
+Sessions are created and deleted by the frontend, directly in the database, so
+the TTL bounds how long a deleted session keeps working. The API has no route
+which ends a session, so the TTL is capped at `MAX_TTL_SECONDS` whatever the
+settings. Code which ends a session must call `invalidate`, which also drops it
+from the other workers over the message bus.
+
+The cache also remembers the sessions which wrote recently, on every worker, so
+their requests read from the primary until the replicas have their writes, see
+`install_session_writes_middleware` and `notice_api.db.use_primary`.
+
+Entries are keyed by a digest of the token, so the tokens themselves are not
+kept in memory or sent over the bus.
+"""
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import structlog
+from fastapi import FastAPI, Request, Response
+
+from notice_api.auth.schema import User
+from notice_api.core.config import settings
+from notice_api.utils.bus import RESYNC_CHANNEL, Message, MessageBus, message_bus
+
+INVALIDATION_CHANNEL = "session-invalidated"
+WRITES_CHANNEL = "session-wrote"
+
+MAX_TTL_SECONDS = 60.0
+"""The longest a lookup is cached, i.e. a deleted session keeps working."""
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+"""The HTTP methods of requests which don't write."""
+
+
+@dataclass
+class CachedSession:
+    user: Optional[User]
+    """The user of the session, `None` if the token is not a valid session."""
+    deadline: float
+    """The `time.monotonic()` after which the entry is stale."""
+
+
+@dataclass
+class RecentWrite:
+    deadline: float
+    """The `time.monotonic()` until which the session reads from the primary."""
+    announced: float = 0.0
+    """The deadline which this worker last sent to the other workers."""
+
+
+def _key(session_token: str) -> str:
+    return hashlib.blake2b(session_token.encode(), digest_size=16).hexdigest()
+
+
+class SessionCache:
+    """TTL and LRU cache of session tokens and their users.
+
+    Args:
+        bus: Used to notify the other workers of ended sessions.
+        max_entries: The maximum number of cached tokens.
+        ttl: How long a valid session is cached, in seconds, at most
+            `MAX_TTL_SECONDS`.
+        negative_ttl: How long an invalid token is cached, in seconds, at most
+            `MAX_TTL_SECONDS`.
+        replica_lag: How long a session reads from the primary after it wrote,
+            in seconds, 0 without replicas.
+    """
+
+    def __init__(
+        self,
+        bus: MessageBus,
+        max_entries: int,
+        ttl: float,
+        negative_ttl: float,
+        replica_lag: float = 0.0,
+    ):
+        self.bus = bus
+        self.max_entries = max_entries
+        self.ttl = min(ttl, MAX_TTL_SECONDS)
+        self.negative_ttl = min(negative_ttl, MAX_TTL_SECONDS)
+        self.replica_lag = replica_lag
+        self._entries: OrderedDict[str, CachedSession] = OrderedDict()
+        self._generation = 0
+        self._wrote: OrderedDict[str, RecentWrite] = OrderedDict()
+        self._logger = structlog.get_logger("session_cache")
+        bus.subscribe(INVALIDATION_CHANNEL, self._on_invalidated)
+        bus.subscribe(WRITES_CHANNEL, self._on_wrote)
+        bus.subscribe(RESYNC_CHANNEL, self._on_resync)
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every invalidation.
+
+        Read before looking a session up, and passed to `put`, so a lookup which
+        raced with an invalidation is not cached.
+        """
+
+        return self._generation
+
+    def get(self, session_token: str) -> Optional[CachedSession]:
+        """Return the cached lookup of the token, unless it is missing or stale."""
+
+        key = _key(session_token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.deadline <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        session_token: str,
+        user: Optional[User],
+        generation: int,
+        expires_in: float = math.inf,
+    ):
+        """Cache the lookup of a token.
+
+        Args:
+            user: The user of the session, `None` if the token is not valid.
+            generation: The `generation` when the lookup started.
+            expires_in: The time left until the session expires, in seconds.
+        """
+
+        if generation != self._generation:
+            return
+        ttl = self.ttl if user is not None else self.negative_ttl
+        key = _key(session_token)
+        self._entries[key] = CachedSession(
+            user=user, deadline=time.monotonic() + min(ttl, expires_in)
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def reads_primary(self, session_token: str) -> bool:
+        """Whether the session wrote recently, so it must read from the primary."""
+
+        key = _key(session_token)
+        entry = self._wrote.get(key)
+        if entry is None:
+            return False
+        if entry.deadline <= time.monotonic():
+            del self._wrote[key]
+            return False
+        return True
+
+    async def wrote(self, session_token: str, delay: float = 0.0):
+        """Send the reads of the session to the primary on every worker, until
+        the replicas have its writes.
+
+        Args:
+            delay: How long until the writes are committed, in seconds, e.g. for
+                writes which are buffered.
+        """
+
+        if not self.replica_lag:
+            return
+        key = _key(session_token)
+        seconds = delay + self.replica_lag
+        deadline = time.monotonic() + seconds
+        entry = self._mark_wrote(key, deadline)
+        # A session which keeps writing only tells the other workers again once
+        # half of the time it told them has passed.
+        if deadline - entry.announced > self.replica_lag / 2:
+            entry.announced = deadline
+            await self.bus.publish(WRITES_CHANNEL, {"key": key, "seconds": seconds})
+
+    def _mark_wrote(self, key: str, deadline: float) -> RecentWrite:
+        entry = self._wrote.get(key)
+        if entry is None:
+            entry = self._wrote[key] = RecentWrite(deadline=deadline)
+        else:
+            entry.deadline = max(entry.deadline, deadline)
+            self._wrote.move_to_end(key)
+        while len(self._wrote) > self.max_entries:
+            self._wrote.popitem(last=False)
+        return entry
+
+    async def invalidate(self, session_token: str):
+        """Drop the token from the cache of every worker, e.g. on logout."""
+
+        key = _key(session_token)
+        self._evict(key)
+        await self.bus.publish(INVALIDATION_CHANNEL, {"key": key})
+
+    def _evict(self, key: str):
+        self._entries.pop(key, None)
+        self._generation += 1
+
+    def _on_invalidated(self, message: Message):
+        key = message.get("key")
+        if not isinstance(key, str):
+            self._logger.warning("Received invalid invalidation", message=message)
+            return
+        self._evict(key)
+
+    def _on_wrote(self, message: Message):
+        key, seconds = message.get("key"), message.get("seconds")
+        if not isinstance(key, str) or not isinstance(seconds, (int, float)):
+            self._logger.warning("Received invalid session write", message=message)
+            return
+        self._mark_wrote(key, time.monotonic() + seconds)
+
+    def _on_resync(self, message: Message):
+        # Any of the sessions may have missed its invalidation.
+        self._entries.clear()
+        self._generation += 1
+        self._logger.info("Dropped the cached sessions after missed messages")
+
+
+session_cache = SessionCache(
+    bus=message_bus,
+    max_entries=settings.SESSION_CACHE_MAX_ENTRIES,
+    ttl=settings.SESSION_CACHE_TTL_SECONDS,
+    negative_ttl=settings.SESSION_CACHE_NEGATIVE_TTL_SECONDS,
+    replica_lag=(
+        settings.DATABASE_REPLICA_LAG_SECONDS if settings.DATABASE_REPLICA_URLS else 0
+    ),
+)
+"""The session cache of this worker."""
+
+
+def install_session_writes_middleware(app: FastAPI) -> FastAPI:
+    """Install a middleware which sends the reads of a session to the primary
+    after its HTTP requests which may write, see `SessionCache.wrote`.
+
+    Only valid sessions are recorded, which `get_current_user` cached while
+    handling the request.
+    """
+
+    @app.middleware("http")
+    async def record_session_writes(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        response = await call_next(request)
+        session_token = request.headers.get("x-session-token")
+        if (
+            request.method not in SAFE_METHODS
+            and session_token is not None
+            and (cached := session_cache.get(session_token)) is not None
+            and cached.user is not None
+        ):
+            await session_cache.wrote(session_token)
+        return response
+
+    return app
@@ -4,8 +4,42 @@ from typing import Annotated, Optional
 from fastapi import Depends, Header, HTTPException, status
 from sqlmodel import select
 
+from notice_api.auth.cache import session_cache
 from notice_api.auth.schema import Session, User
-from notice_api.db import AsyncSession, get_async_session
+from notice_api.db import (
+    REPLICA,
+    AsyncSession,
+    get_async_session,
+    has_replicas,
+    use_primary,
+)
+
+
+def not_logged_in() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="You are not logged in.",
+    )
+
+
+def utcnow() -> datetime:
+    """The current time, comparable with the naive UTC `Session.expires`."""
+
+    return datetime.utcnow()
+
+
+def cache_session_user(
+    session_token: str, user: User, expires: datetime, now: datetime, generation: int
+) -> User:
+    """Cache the user of a session found at `now`, see `session_cache.put`.
+
+    Returns the cached copy of the user, which outlives the database session.
+    """
+
+    user = User.model_validate(user)
+    expires_in = (expires - now).total_seconds()
+    session_cache.put(session_token, user, generation, expires_in)
+    return user
 
 
 async def get_current_user(
@@ -17,20 +51,39 @@ async def get_current_user(
     This function is used as a dependency for FastAPI endpoints. It will return
     the current user if the session token is valid and the session has not
     expired. Otherwise, it will raise an HTTPException with status code 401.
+
+    Lookups are cached, see `notice_api.auth.cache`, and read from a replica
+    when there are any. The reads of a session which wrote recently all go to
+    the primary.
     """
 
+    if session_token is None:
+        raise not_logged_in()
+    if session_cache.reads_primary(session_token):
+        use_primary(db)
+
+    if (cached := session_cache.get(session_token)) is not None:
+        if cached.user is None:
+            raise not_logged_in()
+        return cached.user
+
+    generation = session_cache.generation
+    now = utcnow()
     statement = (
         select(Session, User)
         .join(User)
         .where(Session.session_token == session_token)
-        .where(Session.expires > datetime.utcnow())
+        .where(Session.expires > now)
     )
-    result = await db.exec(statement)
+    result = await db.exec(statement, bind_arguments=REPLICA)
     data = result.first()
+    if data is None and has_replicas():
+        # The session may have just been created, and not be replicated yet.
+        result = await db.exec(statement)
+        data = result.first()
     if data is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="You are not logged in.",
-        )
+        session_cache.put(session_token, None, generation)
+        raise not_logged_in()
 
-    return data[1]
+    session, user = data
+    return cache_session_user(session_token, user, session.expires, now, generation)
@@ -3,9 +3,9 @@ from datetime import datetime
 from typing import Annotated, Literal, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, update
 from sqlmodel import col, select
 
 from notice_api.auth.deps import get_current_user
@@ -16,8 +16,14 @@ from notice_api.bookshelves.schema import (
     BookshelfRead,
     BookshelfUpdate,
 )
-from notice_api.db import AsyncSession, get_async_session
-from notice_api.notes.schema import Note
+from notice_api.bookshelves.versions import (
+    bump_bookshelves_version,
+    get_bookshelves_version,
+)
+from notice_api.db import REPLICA, AsyncSession, get_async_session
+from notice_api.notes.hub import note_hubs
+from notice_api.utils.etag import check_not_modified, make_etag
+from notice_api.utils.responses import MsgspecJSONResponse
 
 router = APIRouter(prefix="/bookshelves", tags=["bookshelves"])
 
@@ -40,91 +46,110 @@ class GetBookshelvesResponse(BaseModel):
     next_cursor: Optional[str] = None
 
 
-@router.get("/")
-async def get_bookshelves(
-    user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_async_session)],
-    cursor: Optional[str] = None,
-    limit: Annotated[int, Query(ge=1, le=50)] = 10,
-    order: Literal["asc", "desc"] = "desc",
-    sort: Literal["title", "created_at"] = "created_at",
-) -> GetBookshelvesResponse:
-    note_count_subquery = (
-        select(func.count())
-        .select_from(Note)
-        .where(Note.bookshelf_id == Bookshelf.id)
-        .scalar_subquery()
-        .label("note_count")
-    )
+def select_bookshelves_page(
+    user_id: str,
+    limit: int,
+    order: Literal["asc", "desc"],
+    sort: Literal["title", "created_at"],
+    cursor: Optional[BookshelfCursor] = None,
+):
+    """Select a page of the bookshelves of a user, starting after `cursor`.
+
+    Bookshelves are sorted by `sort`, then by `id` in the same direction, so the
+    `(user_id, <sort>, id)` indexes serve the page in either order.
+    """
+
     # Intentionally select one more than the limit to determine if there are
     # more results.
     statement = (
-        select(Bookshelf, note_count_subquery)
-        .where(Bookshelf.user_id == user.id)
+        select(
+            col(Bookshelf.id),
+            col(Bookshelf.title),
+            col(Bookshelf.created_at),
+            col(Bookshelf.note_count),
+        )
+        .where(Bookshelf.user_id == user_id, col(Bookshelf.deleted_at).is_(None))
         .limit(limit + 1)
     )
 
     # First sort by the `sort` parameter, then by the `id` column
     # (`id`: to achieve deterministic ordering).
-    sort_order = (
-        col(getattr(Bookshelf, sort)).desc()
-        if order == "desc"
-        else col(getattr(Bookshelf, sort)).asc()
-    )
-    id_order = col(Bookshelf.id).asc()
-    statement = statement.order_by(sort_order, id_order)
+    sort_column = col(getattr(Bookshelf, sort))
+    id_column = col(Bookshelf.id)
+    if order == "desc":
+        statement = statement.order_by(sort_column.desc(), id_column.desc())
+    else:
+        statement = statement.order_by(sort_column.asc(), id_column.asc())
+
+    if cursor is not None:
+        # Skip the rows that have already been returned.
+        #
+        # Example: sort = "title", order = "desc", sort_value = "B"
+        #   - sort_eq = Bookshelf.title = "B"
+        #   - id_after = Bookshelf.id < cursor.id
+        #   - sort_filter = Bookshelf.title < "B"
+        #
+        # The final statement will be:
+        #   (Bookshelf.title = "B" AND Bookshelf.id < cursor.id)
+        #   OR Bookshelf.title < "B"
+        sort_value = getattr(cursor, sort)
+        sort_eq = sort_column == sort_value
+        if order == "desc":
+            id_after = id_column < cursor.id
+            sort_filter = sort_column < sort_value
+        else:
+            id_after = id_column > cursor.id
+            sort_filter = sort_column > sort_value
+        statement = statement.where((sort_eq & id_after) | sort_filter)
+
+    return statement
+
 
+@router.get("/", response_model=GetBookshelvesResponse)
+async def get_bookshelves(
+    user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=50)] = 10,
+    order: Literal["asc", "desc"] = "desc",
+    sort: Literal["title", "created_at"] = "created_at",
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> MsgspecJSONResponse:
+    version = await get_bookshelves_version(db, user.id)
+    etag = make_etag("bookshelves", user.id, version, cursor, limit, order, sort)
+    check_not_modified(if_none_match, etag)
+
+    cursor_obj = None
     if cursor:
-        # Decode the cursor and use it to skip the rows that have already been
-        # returned.
         cursor_obj = BookshelfCursor.decode(cursor)
-        sort_value = getattr(cursor_obj, sort)
-        if sort_value is None:
+        if getattr(cursor_obj, sort) is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid cursor: {cursor}",
             )
 
-        # Example: sort = "title", order = "desc", sort_value = "B"
-        #   - sort_eq = Bookshelf.title = "B"
-        #   - id_gt = Bookshelf.id > bookshelf_cursor.id
-        #   - sort_filter = Bookshelf.title < "B"
-        #
-        # The final statement will be:
-        #   (Bookshelf.title = "B" AND Bookshelf.id > bookshelf_cursor.id)
-        #   OR Bookshelf.title < "B"
-        sort_eq = col(getattr(Bookshelf, sort)) == sort_value
-        id_gt = col(Bookshelf.id) > cursor_obj.id
-        sort_filter = (
-            col(getattr(Bookshelf, sort)) < sort_value
-            if order == "desc"
-            else col(getattr(Bookshelf, sort)) > sort_value
-        )
-        statement = statement.where((sort_eq & id_gt) | sort_filter)
-
-    result = await db.exec(statement)
+    statement = select_bookshelves_page(user.id, limit, order, sort, cursor_obj)
+    result = await db.exec(statement, bind_arguments=REPLICA)
     bookshelves = [
-        BookshelfRead.model_validate(
-            {
-                **bookshelf.model_dump(),
-                "count": count,
-            }
-        )
-        for bookshelf, count in result
+        {"id": id, "title": title, "created_at": created_at, "count": note_count}
+        for id, title, created_at, note_count in result
     ]
 
     next_cursor = None
     if len(bookshelves) > limit:
         last_bookshelf = bookshelves[-2]
         next_cursor = BookshelfCursor(
-            id=last_bookshelf.id,
-            title=last_bookshelf.title,
-            created_at=last_bookshelf.created_at,
+            id=last_bookshelf["id"],
+            title=last_bookshelf["title"],
+            created_at=last_bookshelf["created_at"],
         ).encode()
 
-    return GetBookshelvesResponse(
-        data=bookshelves[:limit],
-        next_cursor=next_cursor,
+    # The rows already have the types of `BookshelfRead`, so they are encoded as
+    # they are instead of being validated into models, see
+    # `notice_api.utils.responses`.
+    return MsgspecJSONResponse(
+        {"data": bookshelves[:limit], "next_cursor": next_cursor},
+        headers={"ETag": etag},
     )
 
 
@@ -140,6 +165,7 @@ async def create_bookshelf(
 ) -> CreateBookshelfResponse:
     bookshelf = Bookshelf(title=bookshelf_create.title, user_id=user.id)
     db.add(bookshelf)
+    await bump_bookshelves_version(db, user.id)
     await db.commit()
     await db.refresh(bookshelf)
     return CreateBookshelfResponse(
@@ -159,7 +185,11 @@ async def update_bookshelf(
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ) -> UpdateBookshelfResponse:
     bookshelf = await db.get(Bookshelf, bookshelf_id)
-    if bookshelf is None or bookshelf.user_id != user.id:
+    if (
+        bookshelf is None
+        or bookshelf.user_id != user.id
+        or bookshelf.deleted_at is not None
+    ):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Bookshelf {bookshelf_id} not found",
@@ -168,10 +198,13 @@ async def update_bookshelf(
     if bookshelf_update.title is not None:
         bookshelf.title = bookshelf_update.title
 
+    await bump_bookshelves_version(db, user.id)
     await db.commit()
     await db.refresh(bookshelf)
     return UpdateBookshelfResponse(
-        data=BookshelfRead.model_validate({**bookshelf.model_dump(), "count": 0})
+        data=BookshelfRead.model_validate(
+            {**bookshelf.model_dump(), "count": bookshelf.note_count}
+        )
     )
 
 
@@ -181,12 +214,24 @@ async def delete_bookshelf(
     user: Annotated[User, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ) -> None:
-    bookshelf = await db.get(Bookshelf, bookshelf_id)
-    if bookshelf is None or bookshelf.user_id != user.id:
+    # The notes of the bookshelf are removed later by the reaper, see
+    # `notice_api.notes.reaper`.
+    conn = await db.connection()
+    result = await conn.execute(
+        update(Bookshelf)
+        .where(
+            col(Bookshelf.id) == bookshelf_id,
+            col(Bookshelf.user_id) == user.id,
+            col(Bookshelf.deleted_at).is_(None),
+        )
+        .values(deleted_at=func.now())
+    )
+    if result.rowcount == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Bookshelf {bookshelf_id} not found",
         )
 
-    await db.delete(bookshelf)
+    await bump_bookshelves_version(db, user.id)
     await db.commit()
+    await note_hubs.bookshelf_deleted(bookshelf_id)
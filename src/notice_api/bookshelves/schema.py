@@ -1,9 +1,9 @@
 from datetime import datetime
 from typing import Optional
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from pydantic import ConfigDict
-from sqlalchemy import func
+from sqlalchemy import Index, func
 from sqlmodel import Field, SQLModel
 
 
@@ -17,16 +17,43 @@ class Bookshelf(BookshelfBase, table=True):
     """A bookshelf for the associated user."""
 
     __tablename__ = "bookshelf"  # pyright: ignore[reportGeneralTypeIssues]
+    __table_args__ = (
+        # The pages of `get_bookshelves`, sorted by each of the sort columns.
+        Index("ix_bookshelf_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_bookshelf_user_id_title_id", "user_id", "title", "id"),
+    )
 
     id: Optional[UUID] = Field(
         default=None,
         primary_key=True,
-        sa_column_kwargs={"default": func.uuid()},
+        sa_column_kwargs={"default": uuid4},
     )
     created_at: Optional[datetime] = Field(
         default=None, sa_column_kwargs={"server_default": func.now()}
     )
     user_id: str = Field(foreign_key="user.id", index=True)
+    note_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """The number of notes in the bookshelf, maintained with the notes."""
+    notes_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """Bumped whenever the notes listed in the bookshelf change."""
+    deleted_at: Optional[datetime] = Field(default=None, index=True)
+    """When the bookshelf was deleted, its rows are removed later by the reaper.
+
+    See `notice_api.notes.reaper`.
+    """
+
+
+class BookshelfListingVersion(SQLModel, table=True):
+    """The version of the listing of the bookshelves of a user.
+
+    Bumped whenever one of the bookshelves of the user, or its note count,
+    changes. See `notice_api.bookshelves.versions`.
+    """
+
+    __tablename__ = "bookshelf_listing_version"  # pyright: ignore[reportGeneralTypeIssues]
+
+    user_id: str = Field(foreign_key="user.id", primary_key=True)
+    version: int = 0
 
 
 class BookshelfCreate(BookshelfBase):
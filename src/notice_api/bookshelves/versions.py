@@ -0,0 +1,86 @@
+"""Version counters of the bookshelf and note listings.
+
+The counters are bumped in the transaction of every write which changes a
+listing, so the ETag of a listing (see `notice_api.utils.etag`) can be computed
+from its counter without running the listing query.
+
+Listings are read from a replica along with their counter, so the ETag always
+matches the listing, even when the replica lags behind.
+"""
+
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlmodel import col, select
+
+from notice_api.bookshelves.schema import Bookshelf, BookshelfListingVersion
+from notice_api.db import AsyncSession, has_replicas, replica_connection
+
+
+async def bump_bookshelves_version(db: AsyncSession, user_id: str):
+    """Record a change of the bookshelves listed for a user."""
+
+    conn = await db.connection()
+    version = col(BookshelfListingVersion.version) + 1
+    if conn.dialect.name == "sqlite":
+        statement = sqlite.insert(BookshelfListingVersion).values(
+            user_id=user_id, version=1
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[col(BookshelfListingVersion.user_id)],
+            set_={"version": version},
+        )
+    else:
+        statement = mysql.insert(BookshelfListingVersion).values(
+            user_id=user_id, version=1
+        )
+        statement = statement.on_duplicate_key_update(version=version)
+    await conn.execute(statement)
+
+
+async def bump_notes_version(db: AsyncSession, bookshelf_id: UUID):
+    """Record a change of the notes listed in a bookshelf."""
+
+    conn = await db.connection()
+    await conn.execute(
+        update(Bookshelf)
+        .where(col(Bookshelf.id) == bookshelf_id)
+        .values(notes_version=col(Bookshelf.notes_version) + 1)
+    )
+
+
+async def get_bookshelves_version(db: AsyncSession, user_id: str) -> int:
+    conn = await replica_connection(db)
+    result = await conn.execute(
+        select(col(BookshelfListingVersion.version)).where(
+            col(BookshelfListingVersion.user_id) == user_id
+        )
+    )
+    return result.scalar_one_or_none() or 0
+
+
+async def get_notes_version(
+    db: AsyncSession, user_id: str, bookshelf_id: UUID
+) -> Optional[int]:
+    """Get the version of the notes of a bookshelf.
+
+    Returns `None` if the bookshelf does not exist, was deleted or does not
+    belong to the user.
+    """
+
+    statement = select(col(Bookshelf.notes_version)).where(
+        col(Bookshelf.id) == bookshelf_id,
+        col(Bookshelf.user_id) == user_id,
+        col(Bookshelf.deleted_at).is_(None),
+    )
+    conn = await replica_connection(db)
+    result = await conn.execute(statement)
+    version = result.scalar_one_or_none()
+    if version is None and has_replicas():
+        # The bookshelf may have just been created, and not be replicated yet.
+        conn = await db.connection()
+        result = await conn.execute(statement)
+        version = result.scalar_one_or_none()
+    return version
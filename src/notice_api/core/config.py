@@ -26,9 +26,57 @@ class Settings(BaseSettings):
 
     LOG_JSON_FORMAT: bool = False
     LOG_LEVEL: str = "INFO"
+    LOG_SAMPLE_RATES: dict[str, float] = {}
+    """Fraction of the debug and info events kept, by logger name, as a JSON object.
+
+    See `notice_api.utils.logging.core.LogSampler`.
+    """
+    LOG_RATE_LIMITS: dict[str, float] = {
+        "audio_saver": 1.0,
+        "live_transcription.route": 5.0,
+        "handle_note_generation": 5.0,
+    }
+    """Maximum debug and info events per second, by logger name, as a JSON object.
+
+    The defaults limit the loggers of the audio and note generation loops.
+    """
 
     SESSION_SECRET_KEY: str = "secret"
 
+    SESSION_CACHE_TTL_SECONDS: float = 60.0
+    """How long a session is cached by each worker, at most 60 seconds.
+
+    A deleted session keeps working for that long, see `notice_api.auth.cache`.
+    """
+    SESSION_CACHE_NEGATIVE_TTL_SECONDS: float = 5.0
+    """How long a token which is not a valid session is cached."""
+    SESSION_CACHE_MAX_ENTRIES: int = 10000
+    """Maximum number of session tokens cached by each worker."""
+
+    RATE_LIMIT_REQUESTS_PER_SECOND: float = 20.0
+    """HTTP requests and websocket connections per second of each session.
+
+    See `notice_api.utils.ratelimit`.
+    """
+    RATE_LIMIT_REQUESTS_BURST: int = 100
+    """HTTP requests and websocket connections a session can make at once."""
+    RATE_LIMIT_WEBSOCKETS_PER_USER: int = 10
+    """Maximum number of open note and transcription websockets of each user."""
+    RATE_LIMIT_GENERATIONS_PER_MINUTE: float = 6.0
+    """Note generations per minute of each user."""
+    RATE_LIMIT_GENERATIONS_BURST: int = 3
+    """Note generations a user can start at once."""
+    RATE_LIMIT_CONCURRENT_GENERATIONS: int = 2
+    """Maximum number of running note generations of each user."""
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    """Maximum number of clients whose rates are tracked by each worker."""
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []
+    """Addresses of the reverse proxies in front of the server, as a JSON list.
+
+    The clients of the requests sent by these proxies are identified by the
+    `X-Forwarded-For` header instead of the address of the proxy.
+    """
+
     DEEPGRAM_SECRET_KEY: str = ""
     OPENAI_API_KEY: str = ""
 
@@ -38,21 +86,109 @@ class Settings(BaseSettings):
     MYSQL_HOST: str = "localhost"
     MYSQL_PORT: int = 3306
 
-    @property
-    def DATABASE_URL(self) -> str:
-        """Return the database URL as a string."""
+    DATABASE_URL: str = ""
+    """SQLAlchemy URL of the primary database, built from the `MYSQL_*` settings
+    when empty.
+
+    Both MySQL (`mysql+asyncmy://...`) and SQLite (`sqlite+aiosqlite:///...`,
+    with the `sqlite` extra) are supported, see `notice_api.notes.json_content`.
+    """
+
+    @validator("DATABASE_URL", always=True)
+    def assemble_database_url(cls, v: str, values: dict[str, Any]) -> str:
+        """Build the MySQL URL from the `MYSQL_*` settings, unless one is set."""
+
+        if v:
+            return v
 
         dsn = MySQLDsn.build(
             scheme="mysql+asyncmy",
-            username=self.MYSQL_USER,
-            password=self.MYSQL_PASSWORD,
-            host=self.MYSQL_HOST,
-            port=self.MYSQL_PORT,
-            path=self.MYSQL_DATABASE,
+            username=values["MYSQL_USER"],
+            password=values["MYSQL_PASSWORD"],
+            host=values["MYSQL_HOST"],
+            port=values["MYSQL_PORT"],
+            path=values["MYSQL_DATABASE"],
         )
 
         return str(dsn)
 
+    DATABASE_REPLICA_URLS: list[str] = []
+    """Database URLs of read replicas of the primary, as a JSON list.
+
+    Listings, version histories, transcripts and session lookups are read from
+    the replicas, see `notice_api.db.RoutingSession`.
+    """
+    DATABASE_REPLICA_LAG_SECONDS: float = 5.0
+    """How long the reads of a session go to the primary after it wrote, so it
+    reads its own writes even though the replicas lag behind the primary."""
+
+    DATABASE_POOL_SIZE: int = 10
+    """Connections kept open by each pool of each worker."""
+    DATABASE_POOL_MAX_OVERFLOW: int = 10
+    """Connections opened beyond `DATABASE_POOL_SIZE` when the pool is exhausted."""
+    DATABASE_POOL_TIMEOUT_SECONDS: float = 30.0
+    """How long a checkout waits for a connection before failing."""
+    DATABASE_POOL_RECYCLE_SECONDS: int = 3600
+    """Connections older than this are replaced, before MySQL's `wait_timeout`."""
+    DATABASE_POOL_PRE_PING: bool = True
+    """Test every connection on checkout, replacing the ones which were closed."""
+
+    NOTE_STORAGE_ENGINE: Literal["json", "blocks", "compressed"] = "json"
+    """How note content is stored.
+
+    - `json`: the whole content tree in the `note.content` JSON column.
+    - `blocks`: one `note_block` row per node, notes are migrated on first read.
+    - `compressed`: the content tree as zstd-compressed JSON in the
+      `note_content_blob` table, notes are migrated on first read. Requires the
+      `compression` extra.
+
+    Switching from `json` is one-way: `note.content` keeps the content of a
+    note as it was when the note was migrated.
+    """
+    NOTE_COMPRESSION_THRESHOLD_BYTES: int = 1024
+    """Content smaller than this is stored as plain JSON by the `compressed` engine."""
+    NOTE_COMPRESSION_LEVEL: int = 3
+    """The zstd compression level of the `compressed` engine."""
+
+    NOTE_WRITE_DEBOUNCE_SECONDS: float = 0.5
+    """Persist buffered note updates once a note is idle for this long."""
+    NOTE_WRITE_MAX_DELAY_SECONDS: float = 3.0
+    """Persist buffered note updates at least this often while a user is typing."""
+
+    NOTE_GENERATION_BATCH_BLOCKS: int = 20
+    """Persist generated blocks in batches of at least this many blocks."""
+
+    NOTE_CACHE_MAX_ENTRIES: int = 1024
+    """Maximum number of note contents cached in memory by each worker."""
+    NOTE_HUB_MAX_PENDING_FRAMES: int = 64
+    """Frames queued for a slow session before it is sent the whole note instead."""
+
+    NOTE_HISTORY_SNAPSHOT_INTERVAL: int = 50
+    """Store the whole content of a note at least every this many versions."""
+    NOTE_HISTORY_RETENTION_DAYS: int = 30
+    """Versions of a note older than this many days are compacted away."""
+    NOTE_HISTORY_MAX_VERSIONS: int = 1000
+    """Maximum number of versions kept for each note."""
+
+    NOTE_REAPER_INTERVAL_SECONDS: float = 60.0
+    """How often the reaper looks for deleted bookshelves and notes to remove."""
+    NOTE_REAPER_BATCH_NOTES: int = 20
+    """Maximum number of deleted notes removed in one transaction."""
+    NOTE_REAPER_BATCH_TRANSCRIPTS: int = 1000
+    """Maximum number of transcript rows of deleted notes removed in one transaction."""
+
+    METRICS_EVENT_LOOP_INTERVAL_SECONDS: float = 0.5
+    """How often each worker measures the lag of its event loop."""
+
+    MESSAGE_BUS: Literal["local", "unix"] = "local"
+    """Transport used to notify the other workers, see `notice_api.utils.bus`.
+
+    `local` is only correct with a single worker, `gunicorn.conf.py` defaults to
+    `unix`.
+    """
+    MESSAGE_BUS_DIRECTORY: str = "/tmp/notice-api-bus"
+    """Directory of the worker sockets for the `unix` message bus."""
+
 
 # Ignore the issue of "Argument missing for parameter ..." for the Settings class
 # because the argument is loaded from the environment variables by pydantic-settings.
@@ -1,30 +1,196 @@
 from __future__ import annotations
 
-from typing import AsyncGenerator
+import random
+import time
+from typing import Any, AsyncGenerator, Optional, Union
 
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import ClauseElement, Connection, Engine, event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlmodel import SQLModel
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection
+from sqlmodel import Session
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 import notice_api.auth.schema as auth_schema  # noqa: F401
 import notice_api.bookshelves.schema as bookshelves_schema  # noqa: F401
 import notice_api.notes.schema as notes_schema  # noqa: F401
+import notice_api.transcript.schema as transcript_schema  # noqa: F401
 from notice_api.core.config import settings
+from notice_api.migrations import pending_migrations, run_migrations
+from notice_api.utils.metrics import (
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_CHECKOUT_SECONDS,
+    DB_QUERY_SECONDS,
+)
+
+STATEMENT_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+"""The kinds of statements in `DB_QUERY_SECONDS`, the others are `OTHER`."""
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """The default pool of the async engine, which records how long every
+    checkout waited for a connection in `DB_POOL_CHECKOUT_SECONDS`."""
+
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def _count_checkout(*args: Any):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+def _count_checkin(*args: Any):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+def _start_query_timer(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+):
+    context.query_start = time.perf_counter()
+
+
+def _record_query_time(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+):
+    """Record the latency of a statement in `DB_QUERY_SECONDS`, labelled by its
+    first keyword, e.g. `SELECT`."""
+
+    words = statement.split(None, 1)
+    kind = words[0].upper() if words else "OTHER"
+    if kind not in STATEMENT_KINDS:
+        kind = "OTHER"
+    DB_QUERY_SECONDS.labels(kind).observe(time.perf_counter() - context.query_start)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        future=True,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_POOL_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+    )
+    event.listen(engine.sync_engine, "checkout", _count_checkout)
+    event.listen(engine.sync_engine, "checkin", _count_checkin)
+    event.listen(engine.sync_engine, "before_cursor_execute", _start_query_timer)
+    event.listen(engine.sync_engine, "after_cursor_execute", _record_query_time)
+    return engine
+
+
+engine = _create_engine(settings.DATABASE_URL)
+replica_engines = [_create_engine(url) for url in settings.DATABASE_REPLICA_URLS]
+
+REPLICA: dict[str, Any] = {"replica": True}
+"""The `bind_arguments` of a read which may be sent to a replica.
+
+Only for reads which can be slightly stale: replicas lag behind the primary.
+"""
+
+
+class RoutingSession(Session):
+    """Send the reads which allow it to a replica, see `REPLICA`.
+
+    A session reads from a single replica, so its reads are consistent with
+    each other. Once a session used the primary, all of its reads go to the
+    primary as well, so it reads its own writes. The later requests of a client
+    which wrote are sent to the primary as well, see `use_primary`.
+    """
+
+    def get_bind(
+        self,
+        mapper: Optional[Any] = None,
+        *,
+        clause: Optional[ClauseElement] = None,
+        replica: bool = False,
+        **kw: Any,
+    ) -> Union[Engine, Connection]:
+        if replica and replica_engines and not self.info.get("primary"):
+            if "replica" not in self.info:
+                self.info["replica"] = random.choice(replica_engines).sync_engine
+            return self.info["replica"]
+        self.info["primary"] = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
 
-engine = create_async_engine(settings.DATABASE_URL, future=True)
 AsyncSessionFactory = sessionmaker[AsyncSession](  # pyright: ignore[reportGeneralTypeIssues]
     engine,  # pyright: ignore[reportGeneralTypeIssues]
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False,
 )
 
 
-async def create_db_and_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+async def migrate_database():
+    """Apply the pending migrations, see `notice_api.migrations`."""
+
+    async with engine.connect() as conn:
+        await conn.run_sync(run_migrations)
+
+
+async def get_pending_migrations() -> list[str]:
+    """The names of the migrations which were not applied yet."""
+
+    async with engine.connect() as conn:
+        pending = await conn.run_sync(pending_migrations)
+    return [migration.__name__ for _, migration in pending]
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionFactory() as session:
         yield session
+
+
+async def replica_connection(session: AsyncSession) -> AsyncConnection:
+    """The connection of the session for reads which may go to a replica."""
+
+    return await session.connection(bind_arguments=REPLICA)
+
+
+def use_primary(session: AsyncSession):
+    """Send all the reads of the session to the primary.
+
+    Used for the requests of a client which wrote within the last
+    `DATABASE_REPLICA_LAG_SECONDS`, see `notice_api.auth.cache`, since the
+    replicas may not have its writes yet.
+    """
+
+    session.info["primary"] = True
+
+
+def has_replicas() -> bool:
+    """Whether reads may go to replicas, which may not have the latest writes.
+
+    Reads which must find a row that was just written, like a session or a
+    bookshelf which was just created, confirm their misses on the primary.
+    """
+
+    return bool(replica_engines)
+
+
+async def release_connection(session: AsyncSession):
+    """End the transaction of a long-lived session, returning its connection.
+
+    A session holds a connection of the pool from its first query until the end
+    of its transaction. The sessions of websockets live as long as the socket,
+    so they release their connection after every message or flush which used
+    it, instead of holding it for hours.
+    """
+
+    await session.commit()
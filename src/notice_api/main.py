@@ -11,15 +11,26 @@ from starlette.middleware.sessions import SessionMiddleware
 import notice_api.utils.logging.core as logging_core
 import notice_api.utils.logging.middlewares as logging_middlewares
 from notice_api import db
+from notice_api.auth.cache import install_session_writes_middleware
 from notice_api.bookshelves.routes import router as bookshelves_router
 from notice_api.core.config import settings
+from notice_api.notes.reaper import note_reaper
 from notice_api.notes.routes import router as notes_router
 from notice_api.playback.routes import router as playback_router
 from notice_api.transcript.routes import router as transcribe_router
+from notice_api.utils.bus import message_bus
+from notice_api.utils.metrics import (
+    MetricsMiddleware,
+    event_loop_monitor,
+    make_metrics_app,
+)
+from notice_api.utils.ratelimit import install_rate_limit_middleware
 
 logging_core.setup_logging(
     json_logs=settings.LOG_JSON_FORMAT,
     log_level=settings.LOG_LEVEL,
+    sample_rates=settings.LOG_SAMPLE_RATES,
+    rate_limits=settings.LOG_RATE_LIMITS,
 )
 
 
@@ -28,9 +39,18 @@ async def lifespan(app: FastAPI):
     """Lifespan event handler for the application."""
 
     logger = structlog.get_logger("lifespan")
-    await db.create_db_and_tables()
-    logger.info("Finished creating database tables.")
+    # The schema is migrated once per deploy, see `notice_api.migrate`.
+    if pending := await db.get_pending_migrations():
+        logger.error("The database has pending migrations.", migrations=pending)
+    await message_bus.start()
+    await note_reaper.start()
+    await event_loop_monitor.start()
     yield
+    await event_loop_monitor.stop()
+    await note_reaper.stop()
+    await message_bus.stop()
+    # SQLite connections each run in a thread, which would keep the process alive.
+    await db.engine.dispose()
 
 
 app = FastAPI(
@@ -40,6 +60,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Innermost, it only records the requests which reached a route.
+install_session_writes_middleware(app)
+# Installed early, so rejected requests are still logged.
+install_rate_limit_middleware(app)
 logging_middlewares.install_logging_middleware(app)
 app.add_middleware(SessionMiddleware, secret_key=settings.SESSION_SECRET_KEY)
 app.add_middleware(CorrelationIdMiddleware)
@@ -49,7 +73,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # The listings are revalidated with their ETag (`If-None-Match`).
+    expose_headers=["ETag"],
 )
+# Added last, so it is the outermost middleware and times the whole request.
+app.add_middleware(MetricsMiddleware)
 
 
 class PingResponse(BaseModel):
@@ -69,3 +97,4 @@ app.include_router(bookshelves_router)
 app.include_router(notes_router)
 app.include_router(playback_router)
 app.include_router(transcribe_router)
+app.mount("/metrics", make_metrics_app())
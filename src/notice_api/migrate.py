@@ -0,0 +1,50 @@
+"""Migrate the database schema, once per deploy before the workers start.
+
+    pdm run migrate           # apply the pending migrations
+    pdm run migrate --status  # list the migrations which were not applied yet
+
+See `notice_api.migrations`.
+"""
+
+import argparse
+import asyncio
+
+import notice_api.utils.logging.core as logging_core
+from notice_api import db
+from notice_api.core.config import settings
+
+
+async def migrate(status: bool):
+    try:
+        if status:
+            pending = await db.get_pending_migrations()
+            for name in pending:
+                print(name)
+            if not pending:
+                print("The database is up to date.")
+        else:
+            await db.migrate_database()
+    finally:
+        await db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the database schema.")
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="list the pending migrations instead of applying them",
+    )
+    args = parser.parse_args()
+
+    logging_core.setup_logging(
+        json_logs=settings.LOG_JSON_FORMAT,
+        log_level=settings.LOG_LEVEL,
+        sample_rates=settings.LOG_SAMPLE_RATES,
+        rate_limits=settings.LOG_RATE_LIMITS,
+    )
+    asyncio.run(migrate(args.status))
+
+
+if __name__ == "__main__":
+    main()
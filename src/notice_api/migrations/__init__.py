@@ -0,0 +1,270 @@
+"""Versioned migrations of the database schema.
+
+The migrations run once per deploy, before the workers start, with
+`pdm run migrate` (see `notice_api.migrate`), instead of at the startup of every
+worker. The applied migrations are recorded in the `schema_migration` table.
+The version of a migration is its position in `MIGRATIONS`, so new migrations
+are only ever appended.
+
+The first migration creates the tables of the models, which then already have
+the columns and indexes added by the later ones. Every migration checks whether
+its change was already made, which also lets the databases created before the
+version table adopt it.
+"""
+
+from collections.abc import Callable
+
+import structlog
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+Migration = Callable[[Connection], bool]
+"""Apply a change if needed, returning whether it was applied."""
+
+schema_migration = Table(
+    "schema_migration",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now()),
+)
+"""The migrations applied to the database, see `run_migrations`."""
+
+LOCK_NAME = "notice_api_migrations"
+"""The MySQL named lock held while migrating, see `run_migrations`."""
+LOCK_TIMEOUT_SECONDS = 60
+
+
+class MigrationLockError(Exception):
+    """The migration lock is held by another deploy."""
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def create_tables(conn: Connection) -> bool:
+    """Create the tables of the models which don't exist yet."""
+
+    existing = set(inspect(conn).get_table_names())
+    missing = [t for t in SQLModel.metadata.sorted_tables if t.name not in existing]
+    SQLModel.metadata.create_all(conn, tables=missing)
+    return bool(missing)
+
+
+def add_bookshelf_note_count(conn: Connection) -> bool:
+    """Add the denormalized `bookshelf.note_count`, counting the existing notes."""
+
+    if _has_column(conn, "bookshelf", "note_count"):
+        return False
+    conn.execute(
+        text("ALTER TABLE bookshelf ADD COLUMN note_count INTEGER NOT NULL DEFAULT 0")
+    )
+    conn.execute(
+        text(
+            "UPDATE bookshelf SET note_count = "
+            "(SELECT COUNT(*) FROM note WHERE note.bookshelf_id = bookshelf.id)"
+        )
+    )
+    return True
+
+
+def add_bookshelf_notes_version(conn: Connection) -> bool:
+    """Add `bookshelf.notes_version`, the version of the notes listing."""
+
+    if _has_column(conn, "bookshelf", "notes_version"):
+        return False
+    conn.execute(
+        text(
+            "ALTER TABLE bookshelf ADD COLUMN notes_version INTEGER NOT NULL DEFAULT 0"
+        )
+    )
+    return True
+
+
+def add_deleted_at(conn: Connection) -> bool:
+    """Add `deleted_at` to the bookshelves and the notes, for soft deletes."""
+
+    applied = False
+    for table in ("bookshelf", "note"):
+        if not _has_column(conn, table, "deleted_at"):
+            conn.execute(
+                text(f"ALTER TABLE {table} ADD COLUMN deleted_at DATETIME NULL")
+            )
+            applied = True
+    return applied
+
+
+def add_missing_indexes(conn: Connection) -> bool:
+    """Create the indexes declared on the models which don't exist yet."""
+
+    applied = False
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                applied = True
+    return applied
+
+
+def _rebuild_sqlite_table(conn: Connection, name: str):
+    """Recreate a table as its model declares it, keeping its rows.
+
+    SQLite can't alter the constraints of a table, so a new table is created,
+    filled and renamed, following https://www.sqlite.org/lang_altertable.html.
+    """
+
+    table = SQLModel.metadata.tables[name]
+    rebuilt = table.to_metadata(SQLModel.metadata, name=f"{name}_rebuilt")
+    try:
+        # The indexes are dropped with the old table, and created again after.
+        conn.execute(CreateTable(rebuilt))
+        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+        conn.execute(
+            text(
+                f'INSERT INTO "{rebuilt.name}" ({columns}) '
+                f'SELECT {columns} FROM "{name}"'
+            )
+        )
+        conn.execute(text(f'DROP TABLE "{name}"'))
+        conn.execute(text(f'ALTER TABLE "{rebuilt.name}" RENAME TO "{name}"'))
+        for index in table.indexes:
+            index.create(conn)
+    finally:
+        SQLModel.metadata.remove(rebuilt)
+
+
+def make_transcript_id_primary_key(conn: Connection) -> bool:
+    """Make `transcript.id` the whole primary key, instead of `(id, note_id)`.
+
+    `id` is unique on its own, and SQLite can't autoincrement a column of a
+    composite primary key.
+    """
+
+    primary_key = inspect(conn).get_pk_constraint("transcript")
+    if primary_key["constrained_columns"] == ["id"]:
+        return False
+    if conn.dialect.name == "sqlite":
+        _rebuild_sqlite_table(conn, "transcript")
+    elif conn.dialect.name == "mysql":
+        conn.execute(
+            text("ALTER TABLE transcript DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+        )
+    else:
+        raise NotImplementedError(
+            f"Changing the primary key of transcript on {conn.dialect.name}"
+        )
+    return True
+
+
+def make_block_position_case_sensitive(conn: Connection) -> bool:
+    """Compare `note_block.position` byte by byte on MySQL.
+
+    The position keys mix upper and lower case digits, which the default
+    collation of MySQL compares as equal, so siblings came back out of order.
+    SQLite already compares strings byte by byte.
+    """
+
+    if conn.dialect.name != "mysql":
+        return False
+    columns = inspect(conn).get_columns("note_block")
+    position = next(c for c in columns if c["name"] == "position")
+    if getattr(position["type"], "collation", None) == "utf8mb4_bin":
+        return False
+    conn.execute(
+        text(
+            "ALTER TABLE note_block MODIFY `position` VARCHAR(255) "
+            "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL"
+        )
+    )
+    return True
+
+
+MIGRATIONS: list[Migration] = [
+    create_tables,
+    add_bookshelf_note_count,
+    add_bookshelf_notes_version,
+    add_deleted_at,
+    add_missing_indexes,
+    make_transcript_id_primary_key,
+    make_block_position_case_sensitive,
+]
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    """The versions of the migrations applied to the database."""
+
+    if not inspect(conn).has_table(schema_migration.name):
+        return set()
+    return set(conn.execute(select(schema_migration.c.version)).scalars())
+
+
+def pending_migrations(conn: Connection) -> list[tuple[int, Migration]]:
+    """The migrations which were not applied yet, with their version, in order."""
+
+    applied = applied_versions(conn)
+    return [
+        (version, migration)
+        for version, migration in enumerate(MIGRATIONS, start=1)
+        if version not in applied
+    ]
+
+
+def run_migrations(conn: Connection):
+    """Apply the migrations which were not applied yet, in order.
+
+    On MySQL, the migrations run under a named lock, so concurrent deploys
+    don't apply them twice.
+
+    Raises:
+        MigrationLockError: Another deploy held the lock for too long.
+    """
+
+    logger = structlog.get_logger("migrations")
+    locked = conn.dialect.name == "mysql"
+    if locked:
+        acquired = conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": LOCK_NAME, "timeout": LOCK_TIMEOUT_SECONDS},
+        ).scalar()
+        if acquired != 1:
+            raise MigrationLockError(
+                f"Could not acquire {LOCK_NAME} in {LOCK_TIMEOUT_SECONDS} seconds"
+            )
+    try:
+        schema_migration.create(conn, checkfirst=True)
+        for version, migration in pending_migrations(conn):
+            changed = migration(conn)
+            conn.execute(
+                insert(schema_migration).values(
+                    version=version, name=migration.__name__
+                )
+            )
+            # MySQL commits the schema changes right away, so the version is
+            # committed with them.
+            conn.commit()
+            logger.info(
+                "Applied migration",
+                version=version,
+                migration=migration.__name__,
+                changed=changed,
+            )
+    finally:
+        if locked:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
@@ -0,0 +1,244 @@
+"""Create, rename, move and delete many notes of a bookshelf at once.
+
+The operations of a batch are checked in order against the notes and the
+bookshelves of the user, which are loaded with one query each, and the valid
+ones are then written with a few set-based statements in a single transaction.
+Every operation gets its own result, so an invalid operation does not fail the
+others.
+"""
+
+from collections import Counter
+from typing import Annotated, Literal, Optional, Union
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, Field
+from sqlalchemy import bindparam, func, insert, update
+from sqlmodel import col, select
+
+from notice_api.auth.schema import User
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.bookshelves.versions import bump_bookshelves_version
+from notice_api.db import AsyncSession
+from notice_api.notes.note_content import DEFAULT_NOTE_CONTENT
+from notice_api.notes.schema import Note, NoteRead
+
+MAX_OPERATIONS = 100
+
+
+class CreateNoteOperation(BaseModel):
+    op: Literal["create"]
+    title: str
+
+
+class RenameNoteOperation(BaseModel):
+    op: Literal["rename"]
+    id: UUID
+    title: str
+
+
+class MoveNoteOperation(BaseModel):
+    op: Literal["move"]
+    id: UUID
+    bookshelf_id: UUID
+    """The bookshelf the note is moved to."""
+
+
+class DeleteNoteOperation(BaseModel):
+    op: Literal["delete"]
+    id: UUID
+
+
+NoteOperation = Annotated[
+    Union[
+        CreateNoteOperation,
+        RenameNoteOperation,
+        MoveNoteOperation,
+        DeleteNoteOperation,
+    ],
+    Field(discriminator="op"),
+]
+
+
+class NoteOperationResult(BaseModel):
+    status: int
+    """The status code the operation would have had as a single request."""
+    data: Optional[NoteRead] = None
+    """The note after the operation, except for deleted notes."""
+    detail: Optional[str] = None
+
+
+def _not_found(detail: str) -> NoteOperationResult:
+    return NoteOperationResult(status=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+async def apply_note_operations(
+    db: AsyncSession,
+    user: User,
+    bookshelf_id: UUID,
+    operations: list[NoteOperation],
+) -> tuple[list[NoteOperationResult], list[UUID]]:
+    """Apply the operations to the notes of a bookshelf, without committing.
+
+    Returns the result of every operation and the ids of the deleted notes.
+
+    Raises:
+        HTTPException: 404 if the bookshelf does not belong to the user.
+    """
+
+    conn = await db.connection()
+
+    note_ids = {op.id for op in operations if not isinstance(op, CreateNoteOperation)}
+    result = await conn.execute(
+        select(col(Note.id), col(Note.title), col(Note.created_at)).where(
+            col(Note.id).in_(note_ids),
+            col(Note.user_id) == user.id,
+            col(Note.bookshelf_id) == bookshelf_id,
+            col(Note.deleted_at).is_(None),
+        )
+    )
+    notes = {
+        id: NoteRead(id=id, title=title, created_at=created_at)
+        for id, title, created_at in result
+    }
+
+    bookshelf_ids = {bookshelf_id} | {
+        op.bookshelf_id for op in operations if isinstance(op, MoveNoteOperation)
+    }
+    result = await conn.execute(
+        select(col(Bookshelf.id)).where(
+            col(Bookshelf.id).in_(bookshelf_ids),
+            col(Bookshelf.user_id) == user.id,
+            col(Bookshelf.deleted_at).is_(None),
+        )
+    )
+    owned_bookshelves = set(result.scalars())
+    if bookshelf_id not in owned_bookshelves:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Bookshelf {bookshelf_id} not found",
+        )
+
+    # Check the operations in order, tracking where every note ends up.
+    results: list[NoteOperationResult] = []
+    created: list[tuple[int, UUID, str]] = []
+    titles: dict[UUID, str] = {}
+    location = dict.fromkeys(notes, bookshelf_id)
+    deleted: list[UUID] = []
+    for op in operations:
+        if isinstance(op, CreateNoteOperation):
+            note_id = uuid4()
+            created.append((len(results), note_id, op.title))
+            results.append(NoteOperationResult(status=status.HTTP_201_CREATED))
+            continue
+
+        if op.id not in location:
+            results.append(_not_found(f"Note {op.id} not found"))
+            continue
+
+        if isinstance(op, RenameNoteOperation):
+            titles[op.id] = op.title
+            notes[op.id] = notes[op.id].model_copy(update={"title": op.title})
+            results.append(
+                NoteOperationResult(status=status.HTTP_200_OK, data=notes[op.id])
+            )
+        elif isinstance(op, MoveNoteOperation):
+            if op.bookshelf_id not in owned_bookshelves:
+                results.append(_not_found(f"Bookshelf {op.bookshelf_id} not found"))
+                continue
+            location[op.id] = op.bookshelf_id
+            results.append(
+                NoteOperationResult(status=status.HTTP_200_OK, data=notes[op.id])
+            )
+        else:
+            del location[op.id]
+            deleted.append(op.id)
+            results.append(NoteOperationResult(status=status.HTTP_204_NO_CONTENT))
+
+    # Deleted notes don't need to be renamed or moved first.
+    titles = {
+        note_id: title for note_id, title in titles.items() if note_id in location
+    }
+    moved = {
+        note_id: target
+        for note_id, target in location.items()
+        if target != bookshelf_id
+    }
+    counts: Counter[UUID] = Counter()
+    counts[bookshelf_id] += len(created) - len(deleted)
+    for target in moved.values():
+        counts[bookshelf_id] -= 1
+        counts[target] += 1
+
+    if created:
+        await conn.execute(
+            insert(Note),
+            [
+                {
+                    "id": note_id,
+                    "title": title,
+                    "content": DEFAULT_NOTE_CONTENT,
+                    "bookshelf_id": bookshelf_id,
+                    "user_id": user.id,
+                }
+                for _, note_id, title in created
+            ],
+        )
+        result = await conn.execute(
+            select(col(Note.id), col(Note.created_at)).where(
+                col(Note.id).in_([note_id for _, note_id, _ in created])
+            )
+        )
+        created_at = {row.id: row.created_at for row in result}
+        for index, note_id, title in created:
+            results[index].data = NoteRead(
+                id=note_id, title=title, created_at=created_at[note_id]
+            )
+
+    if titles:
+        await conn.execute(
+            update(Note)
+            .where(col(Note.id) == bindparam("note_id"))
+            .values(title=bindparam("new_title")),
+            [
+                {"note_id": note_id, "new_title": title}
+                for note_id, title in titles.items()
+            ],
+        )
+
+    if moved:
+        await conn.execute(
+            update(Note)
+            .where(col(Note.id) == bindparam("note_id"))
+            .values(bookshelf_id=bindparam("target_id")),
+            [
+                {"note_id": note_id, "target_id": target}
+                for note_id, target in moved.items()
+            ],
+        )
+
+    # The content of deleted notes is removed later by the reaper.
+    if deleted:
+        await conn.execute(
+            update(Note).where(col(Note.id).in_(deleted)).values(deleted_at=func.now())
+        )
+
+    # Renamed notes only change the listing of the bookshelf.
+    changed = set(counts) | ({bookshelf_id} if titles else set())
+    if changed:
+        await conn.execute(
+            update(Bookshelf)
+            .where(col(Bookshelf.id) == bindparam("changed_id"))
+            .values(
+                note_count=col(Bookshelf.note_count) + bindparam("delta"),
+                notes_version=col(Bookshelf.notes_version) + 1,
+            ),
+            [
+                {"changed_id": changed_id, "delta": counts[changed_id]}
+                for changed_id in changed
+            ],
+        )
+    if any(counts.values()):
+        await bump_bookshelves_version(db, user.id)
+
+    return results, deleted
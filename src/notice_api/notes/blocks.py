@@ -0,0 +1,245 @@
+"""Helpers for storing a note's content tree as one row per node.
+
+The tree is flattened into `NoteBlock` rows which reference their parent by id
+and are ordered among their siblings by a fractional `position` key. Keys are
+strings which sort lexicographically, so a node can always be inserted between
+two siblings without renumbering the others.
+"""
+
+from collections import defaultdict
+from typing import Any, Iterable, Optional, Protocol, cast
+from uuid import UUID
+
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.tree import ROOT_NODE_ID
+
+POSITION_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+_NODE_KEYS = frozenset(("id", "type", "value", "children"))
+
+
+class BlockRow(Protocol):
+    """A row of the `note_block` table, see `notice_api.notes.schema.NoteBlock`."""
+
+    id: str
+    parent_id: Optional[str]
+    position: str
+    type: str
+    value: str
+    attributes: Optional[dict[str, Any]]
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """Return a key strictly between `a` and `b` (`b = None` means unbounded).
+
+    Both keys must not end with the zero digit, which guarantees that a key
+    between them always exists.
+    """
+
+    if b is not None:
+        # Skip the common prefix of both keys (`a` is padded with zeros).
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = POSITION_DIGITS.index(a[0]) if a else 0
+    digit_b = POSITION_DIGITS.index(b[0]) if b is not None else len(POSITION_DIGITS)
+    if digit_b - digit_a > 1:
+        return POSITION_DIGITS[(digit_a + digit_b + 1) // 2]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return POSITION_DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def key_between(a: Optional[str], b: Optional[str]) -> str:
+    """Generate a position key which sorts between `a` and `b`.
+
+    Args:
+        a: The key of the previous sibling, or None if inserting at the start.
+        b: The key of the next sibling, or None if inserting at the end.
+    """
+
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f"Invalid key range: {a!r} >= {b!r}")
+    return _midpoint(a or "", b)
+
+
+def keys_between(a: Optional[str], b: Optional[str], n: int) -> list[str]:
+    """Generate `n` ordered position keys between `a` and `b`.
+
+    The range is bisected recursively, so the keys stay short even for a large
+    number of siblings.
+    """
+
+    if n <= 0:
+        return []
+    if n == 1:
+        return [key_between(a, b)]
+
+    mid = key_between(a, b)
+    left = (n - 1) // 2
+    return [*keys_between(a, mid, left), mid, *keys_between(mid, b, n - 1 - left)]
+
+
+def block_fields(content: NoteContent) -> dict[str, Any]:
+    """Return the columns of a single node, without its position in the tree."""
+
+    attributes = {key: value for key, value in content.items() if key not in _NODE_KEYS}
+    return {
+        "type": content["type"],
+        "value": content.get("value", ""),
+        "attributes": attributes or None,
+    }
+
+
+def flatten_content(
+    note_id: UUID,
+    children: Iterable[NoteContent],
+    parent_id: str = ROOT_NODE_ID,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    """Flatten a list of sibling subtrees into `note_block` rows.
+
+    The top-level nodes get positions between `after` and `before`, their
+    descendants get fresh positions under their own parents.
+    """
+
+    children = list(children)
+    rows: list[dict[str, Any]] = []
+    for child, position in zip(
+        children, keys_between(after, before, len(children)), strict=True
+    ):
+        rows.append(
+            {
+                "note_id": note_id,
+                "id": child["id"],
+                "parent_id": parent_id,
+                "position": position,
+                **block_fields(child),
+            }
+        )
+        rows.extend(flatten_content(note_id, child.get("children", []), child["id"]))
+    return rows
+
+
+def block_to_content(block: BlockRow) -> NoteContent:
+    """Convert a row back into a node without children."""
+
+    content: dict[str, Any] = {
+        "id": block.id,
+        "type": block.type,
+        "value": block.value,
+        "children": [],
+    }
+    content.update(block.attributes or {})
+    return cast(NoteContent, content)
+
+
+def assemble_content(
+    blocks: Iterable[BlockRow], root_id: str = ROOT_NODE_ID
+) -> list[NoteContent]:
+    """Assemble the rows of a note back into the children of `root_id`."""
+
+    children_of: defaultdict[Optional[str], list[BlockRow]] = defaultdict(list)
+    for block in blocks:
+        children_of[block.parent_id].append(block)
+
+    def build(parent_id: str) -> list[NoteContent]:
+        siblings = sorted(children_of.get(parent_id, []), key=lambda b: b.position)
+        result = []
+        for block in siblings:
+            content = block_to_content(block)
+            content["children"] = build(block.id)
+            result.append(content)
+        return result
+
+    return build(root_id)
+
+
+def descendant_ids(
+    parents: Iterable[tuple[str, Optional[str]]], node_id: str
+) -> list[str]:
+    """Return the ids of `node_id` and all of its descendants.
+
+    Args:
+        parents: `(id, parent_id)` pairs of every row of the note.
+        node_id: The id of the subtree root.
+    """
+
+    children_of: defaultdict[Optional[str], list[str]] = defaultdict(list)
+    for id, parent_id in parents:
+        children_of[parent_id].append(id)
+
+    result = [node_id]
+    i = 0
+    while i < len(result):
+        result.extend(children_of.get(result[i], []))
+        i += 1
+    return result
+
+
+def _longest_increasing(positions: list[str]) -> set[int]:
+    """Return the indices of a longest strictly increasing subsequence."""
+
+    tails: list[int] = []  # index of the smallest tail of each subsequence length
+    previous: list[Optional[int]] = [None] * len(positions)
+    for i, position in enumerate(positions):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if positions[tails[mid]] < position:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = tails[lo - 1] if lo > 0 else None
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+
+    result: set[int] = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+
+def assign_positions(order: list[str], current: dict[str, str]) -> dict[str, str]:
+    """Assign positions to siblings so they sort in the given order.
+
+    Siblings keep their current position where possible, so only the nodes
+    which actually moved (or are new) need to be written.
+
+    Args:
+        order: The ids of the siblings in their new order.
+        current: The current positions of the siblings which already exist
+            under this parent.
+
+    Returns:
+        The new positions of the siblings whose position has to change.
+    """
+
+    existing = [i for i, id in enumerate(order) if id in current]
+    kept = {
+        existing[i] for i in _longest_increasing([current[order[i]] for i in existing])
+    }
+
+    result: dict[str, str] = {}
+    run: list[str] = []
+    previous: Optional[str] = None
+    for i, id in enumerate([*order, None]):
+        if id is not None and i not in kept:
+            run.append(id)
+            continue
+
+        following = current[id] if id is not None else None
+        result.update(
+            zip(run, keys_between(previous, following, len(run)), strict=True)
+        )
+        run = []
+        previous = following
+    return result
@@ -0,0 +1,139 @@
+"""Per-worker cache of note contents, shared by all sessions of the worker.
+
+The cache is write-through: the write buffer stores the content it persisted,
+and the other workers are told to drop their copy over the message bus. Cached
+notes have a version which is bumped on each change or invalidation, so a load
+that raced with an invalidation never stores stale content.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from uuid import UUID
+
+import structlog
+
+from notice_api.core.config import settings
+from notice_api.notes.note_content import NoteContent
+from notice_api.utils.bus import RESYNC_CHANNEL, Message, MessageBus, message_bus
+
+INVALIDATION_CHANNEL = "note-content-invalidated"
+
+
+@dataclass
+class CachedNoteContent:
+    content: list[NoteContent]
+    """The children of the root node. Must not be modified."""
+    version: int
+
+
+class NoteContentCache:
+    """LRU cache of the content of the notes which were recently opened.
+
+    Args:
+        bus: Used to notify the other workers of changed notes.
+        max_entries: The maximum number of cached notes.
+    """
+
+    def __init__(self, bus: MessageBus, max_entries: int):
+        self.bus = bus
+        self.max_entries = max_entries
+        self._entries: OrderedDict[UUID, CachedNoteContent] = OrderedDict()
+        self._versions: dict[UUID, int] = {}
+        self._loading: dict[UUID, int] = {}
+        self._logger = structlog.get_logger("note_content_cache")
+        bus.subscribe(INVALIDATION_CHANNEL, self._on_invalidated)
+        bus.subscribe(RESYNC_CHANNEL, self._on_resync)
+
+    def version(self, note_id: UUID) -> int:
+        """The version of the note as known by this worker."""
+
+        return self._versions.get(note_id, 0)
+
+    def get(self, note_id: UUID) -> Optional[CachedNoteContent]:
+        if (entry := self._entries.get(note_id)) is not None:
+            self._entries.move_to_end(note_id)
+        return entry
+
+    async def get_or_load(
+        self,
+        note_id: UUID,
+        load: Callable[[], Awaitable[list[NoteContent]]],
+    ) -> CachedNoteContent:
+        """Return the cached content of the note, loading it on a miss."""
+
+        if (entry := self.get(note_id)) is not None:
+            return entry
+
+        version = self.version(note_id)
+        self._loading[note_id] = self._loading.get(note_id, 0) + 1
+        try:
+            content = await load()
+        finally:
+            self._loading[note_id] -= 1
+            if self._loading[note_id] == 0:
+                del self._loading[note_id]
+
+        entry = CachedNoteContent(content=content, version=version)
+        # Only cache the content if the note did not change while loading.
+        if self.version(note_id) == version:
+            self._put(note_id, entry)
+        return entry
+
+    async def store(self, note_id: UUID, content: list[NoteContent]) -> int:
+        """Store content which was just persisted and invalidate other workers.
+
+        Returns the new version of the note.
+        """
+
+        version = self._bump(note_id)
+        self._put(note_id, CachedNoteContent(content=content, version=version))
+        await self.bus.publish(INVALIDATION_CHANNEL, {"note_id": note_id.hex})
+        return version
+
+    async def invalidate(self, note_id: UUID):
+        """Drop the note from the cache of every worker."""
+
+        self._evict(note_id)
+        await self.bus.publish(INVALIDATION_CHANNEL, {"note_id": note_id.hex})
+
+    def _put(self, note_id: UUID, entry: CachedNoteContent):
+        self._entries[note_id] = entry
+        self._entries.move_to_end(note_id)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if evicted not in self._loading:
+                self._versions.pop(evicted, None)
+
+    def _bump(self, note_id: UUID) -> int:
+        self._versions[note_id] = self.version(note_id) + 1
+        return self._versions[note_id]
+
+    def _evict(self, note_id: UUID):
+        self._entries.pop(note_id, None)
+        # A version is only needed to detect loads racing with the change.
+        if note_id in self._loading:
+            self._bump(note_id)
+        else:
+            self._versions.pop(note_id, None)
+
+    def _on_invalidated(self, message: Message):
+        try:
+            note_id = UUID(hex=message["note_id"])
+        except (KeyError, ValueError):
+            self._logger.warning("Received invalid invalidation", message=message)
+            return
+        self._evict(note_id)
+        self._logger.debug("Note invalidated by another worker", note_id=note_id)
+
+    def _on_resync(self, message: Message):
+        # Any of the notes may have missed its invalidation.
+        for note_id in {*self._entries, *self._loading}:
+            self._evict(note_id)
+        self._logger.info("Dropped the cached notes after missed messages")
+
+
+note_content_cache = NoteContentCache(
+    bus=message_bus, max_entries=settings.NOTE_CACHE_MAX_ENTRIES
+)
+"""The note content cache of this worker."""
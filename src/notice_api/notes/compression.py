@@ -0,0 +1,62 @@
+"""Encoding of note content for the `compressed` storage engine.
+
+Content is serialized as canonical JSON (sorted keys, no whitespace), and
+compressed with zstd once it is larger than `NOTE_COMPRESSION_THRESHOLD_BYTES`.
+Smaller content is stored as plain JSON, where compression does not pay off.
+
+zstd support is an optional dependency: `pdm install -G compression`.
+"""
+
+import json
+from functools import cache
+from typing import Any, Literal
+
+from notice_api.core.config import settings
+from notice_api.notes.note_content import NoteContent
+
+Encoding = Literal["json", "zstd"]
+
+
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "The compressed note storage requires the `compression` extra: "
+            "pdm install -G compression"
+        ) from e
+    return zstandard
+
+
+@cache
+def _compressor() -> Any:
+    return _zstandard().ZstdCompressor(level=settings.NOTE_COMPRESSION_LEVEL)
+
+
+@cache
+def _decompressor() -> Any:
+    return _zstandard().ZstdDecompressor()
+
+
+def canonical_json(content: list[NoteContent]) -> bytes:
+    return json.dumps(
+        content, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+
+def encode_content(content: list[NoteContent]) -> tuple[Encoding, bytes, int]:
+    """Encode the children of a root node.
+
+    Returns the encoding, the encoded data and the size of the JSON in bytes.
+    """
+
+    data = canonical_json(content)
+    if len(data) < settings.NOTE_COMPRESSION_THRESHOLD_BYTES:
+        return "json", data, len(data)
+    return "zstd", _compressor().compress(data), len(data)
+
+
+def decode_content(encoding: str, data: bytes) -> list[NoteContent]:
+    if encoding == "zstd":
+        data = _decompressor().decompress(data)
+    return json.loads(data)
@@ -1,12 +1,22 @@
-from typing import Annotated
+from typing import Annotated, Any, Optional
 from uuid import UUID
 
 from fastapi import Depends, HTTPException, status
 from sqlmodel import col, select
 
-from notice_api.auth.deps import get_current_user
-from notice_api.auth.schema import User
-from notice_api.db import AsyncSession, get_async_session
+from notice_api.auth.cache import session_cache
+from notice_api.auth.deps import (
+    cache_session_user,
+    get_current_user,
+    not_logged_in,
+    utcnow,
+)
+from notice_api.auth.schema import Session, User
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.core.config import settings
+from notice_api.db import REPLICA, AsyncSession, get_async_session, has_replicas
+from notice_api.notes.cache import note_content_cache
+from notice_api.notes.note_content import NoteContent
 from notice_api.notes.schema import Note
 
 
@@ -24,13 +34,24 @@ async def get_current_note(
     a 404 error is raised.
     """
 
-    statement = select(Note.id, Note.title, Note.created_at).where(
-        col(Note.id) == note_id,
-        col(Note.user_id) == user.id,
-        col(Note.bookshelf_id) == bookshelf_id,
+    # The notes of a deleted bookshelf are hidden until they are reaped.
+    statement = (
+        select(Note.id, Note.title, Note.created_at)
+        .join(Bookshelf, col(Bookshelf.id) == Note.bookshelf_id)
+        .where(
+            col(Note.id) == note_id,
+            col(Note.user_id) == user.id,
+            col(Note.bookshelf_id) == bookshelf_id,
+            col(Note.deleted_at).is_(None),
+            col(Bookshelf.deleted_at).is_(None),
+        )
     )
-    result = await db.exec(statement)
+    result = await db.exec(statement, bind_arguments=REPLICA)
     note = result.first()
+    if note is None and has_replicas():
+        # The note may have just been created, and not be replicated yet.
+        result = await db.exec(statement)
+        note = result.first()
     if note is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -45,3 +66,103 @@ async def get_current_note(
         user_id=user.id,
         bookshelf_id=bookshelf_id,
     )
+
+
+async def resolve_note_session(
+    db: AsyncSession,
+    session_token: Optional[str],
+    bookshelf_id: UUID,
+    note_id: UUID,
+    load_content: bool = False,
+) -> tuple[User, Note]:
+    """Get the current user and note of a websocket session in one query.
+
+    Does the checks of `get_current_user` and `get_current_note` with a single
+    round trip to the database, which skips the session when it is cached.
+
+    With `load_content`, the content of the note is loaded by the same query
+    into `note_content_cache`, unless it is cached already, so opening the hub
+    of the note doesn't query it again. Only the `json` storage engine keeps the
+    content in the row of the note, the other engines still load it with the
+    hub.
+
+    Raises:
+        HTTPException: 401 if the session is not valid, 404 if the note is not
+            found or does not belong to the user.
+    """
+
+    if session_token is None:
+        raise not_logged_in()
+    cached = session_cache.get(session_token)
+    if cached is not None and cached.user is None:
+        raise not_logged_in()
+
+    user = cached.user if cached is not None else None
+    generation = session_cache.generation
+    now = utcnow()
+    found: Optional[Any] = None
+
+    async def select_note(with_content: bool) -> list[NoteContent]:
+        nonlocal found
+
+        statement = (
+            select(col(Note.title), col(Note.created_at))
+            .join(Bookshelf, col(Bookshelf.id) == Note.bookshelf_id)
+            .where(
+                col(Note.id) == note_id,
+                col(Note.bookshelf_id) == bookshelf_id,
+                col(Note.deleted_at).is_(None),
+                col(Bookshelf.deleted_at).is_(None),
+            )
+        )
+        if with_content:
+            statement = statement.add_columns(col(Note.content))
+        if user is not None:
+            statement = statement.where(col(Note.user_id) == user.id)
+        else:
+            statement = (
+                statement.add_columns(User, col(Session.expires))
+                .join(User, col(User.id) == Note.user_id)
+                .join(Session, col(Session.user_id) == User.id)
+                .where(
+                    col(Session.session_token) == session_token,
+                    col(Session.expires) > now,
+                )
+            )
+
+        # Read from the primary: the content is cached, and edited by the hub.
+        # `exec` runs the plain SQLAlchemy select returned by `add_columns` too.
+        result = await db.exec(
+            statement  # pyright: ignore[reportCallIssue, reportArgumentType]
+        )
+        found = result.first()
+        if found is None:
+            # Tell an invalid session from a missing note, like the dependencies.
+            if user is None:
+                await get_current_user(db, session_token)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Note {note_id} not found",
+            )
+        return found.content["children"] if with_content and found.content else []
+
+    if load_content and settings.NOTE_STORAGE_ENGINE == "json":
+        await note_content_cache.get_or_load(
+            note_id, lambda: select_note(with_content=True)
+        )
+    if found is None:
+        await select_note(with_content=False)
+    assert found is not None
+
+    if user is None:
+        user = cache_session_user(
+            session_token, found.User, found.expires, now, generation
+        )
+    note = Note(
+        id=note_id,
+        title=found.title,
+        created_at=found.created_at,
+        user_id=user.id,
+        bookshelf_id=bookshelf_id,
+    )
+    return user, note
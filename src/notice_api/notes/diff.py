@@ -0,0 +1,133 @@
+"""Structural diff between two versions of a note's content tree.
+
+Nodes are matched by their `id`, so a full update of the note can be persisted
+by writing only the nodes which were created, edited, moved or removed.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.tree import ROOT_NODE_ID
+
+
+@dataclass
+class NodeChange:
+    """A node of the new tree which has to be written."""
+
+    node: NoteContent
+    """The node in the new tree. Its children are described by other changes."""
+    parent_id: str
+    created: bool
+    """Whether the node does not exist in the old tree."""
+    moved: bool
+    """Whether the parent or the previous sibling of the node changed."""
+    edited: bool
+    """Whether the fields of the node itself changed."""
+
+
+@dataclass
+class NoteDiff:
+    """The changes needed to turn one content tree into another."""
+
+    changes: list[NodeChange] = field(default_factory=list)
+    """Created, edited and moved nodes, parents before their children."""
+    removed: list[str] = field(default_factory=list)
+    """Ids of the nodes which no longer exist, at any depth."""
+    siblings: dict[str, list[str]] = field(default_factory=dict)
+    """The new order of the children of every parent with moved children."""
+    root_reordered: bool = False
+    """Whether the sequence of top-level node ids changed."""
+    dirty_top_level: set[int] = field(default_factory=set)
+    """Indices of the top-level subtrees which contain any change."""
+
+    @property
+    def empty(self) -> bool:
+        return not self.changes and not self.removed
+
+
+@dataclass
+class _FlatNode:
+    node: NoteContent
+    parent_id: str
+    after_id: Optional[str]
+    top_index: int
+
+
+def node_fields(node: NoteContent) -> dict[str, Any]:
+    """Return the fields of a node without its children."""
+
+    return {key: value for key, value in node.items() if key != "children"}
+
+
+def _flatten(children: list[NoteContent]) -> Optional[dict[str, _FlatNode]]:
+    """Index a tree by node id, in pre-order. Returns None on duplicate ids."""
+
+    flat: dict[str, _FlatNode] = {}
+
+    def visit(siblings: list[NoteContent], parent_id: str, top_index: int) -> bool:
+        after_id = None
+        for index, node in enumerate(siblings):
+            if node["id"] in flat or node["id"] == ROOT_NODE_ID:
+                return False
+            top = index if parent_id == ROOT_NODE_ID else top_index
+            flat[node["id"]] = _FlatNode(node, parent_id, after_id, top)
+            if not visit(node.get("children", []), node["id"], top):
+                return False
+            after_id = node["id"]
+        return True
+
+    if not visit(children, ROOT_NODE_ID, 0):
+        return None
+    return flat
+
+
+def diff_content(old: list[NoteContent], new: list[NoteContent]) -> Optional[NoteDiff]:
+    """Compute the changes which turn the children `old` into `new`.
+
+    Returns None if either tree contains duplicate node ids, in which case the
+    nodes can't be matched and the whole tree has to be rewritten.
+    """
+
+    old_flat = _flatten(old)
+    new_flat = _flatten(new)
+    if old_flat is None or new_flat is None:
+        return None
+
+    diff = NoteDiff(
+        root_reordered=[node["id"] for node in old] != [node["id"] for node in new]
+    )
+    for node_id, entry in new_flat.items():
+        previous = old_flat.get(node_id)
+        created = previous is None
+        moved = created or (
+            (previous.parent_id, previous.after_id) != (entry.parent_id, entry.after_id)
+        )
+        edited = created or node_fields(previous.node) != node_fields(entry.node)
+        if not (moved or edited):
+            continue
+
+        diff.changes.append(
+            NodeChange(
+                node=entry.node,
+                parent_id=entry.parent_id,
+                created=created,
+                moved=moved,
+                edited=edited,
+            )
+        )
+        diff.dirty_top_level.add(entry.top_index)
+        if moved and previous is not None:
+            # The subtree the node left has to be rewritten without it.
+            diff.dirty_top_level.add(previous.top_index)
+        if moved and entry.parent_id not in diff.siblings:
+            parent = new_flat.get(entry.parent_id)
+            siblings = parent.node["children"] if parent is not None else new
+            diff.siblings[entry.parent_id] = [sibling["id"] for sibling in siblings]
+
+    for node_id, entry in old_flat.items():
+        if node_id not in new_flat:
+            diff.removed.append(node_id)
+            diff.dirty_top_level.add(entry.top_index)
+
+    return diff
@@ -0,0 +1,382 @@
+"""Version history of the content of the notes.
+
+Every flush of a note's write buffer records a new version of its content in the
+`note_version` table. Most versions are stored as a delta from the previous
+version, holding only the nodes which changed. The whole content is stored as a
+snapshot instead every `NOTE_HISTORY_SNAPSHOT_INTERVAL` versions, or once the
+deltas since the last snapshot outweigh it, so any version is rebuilt from the
+snapshot before it and a bounded number of deltas.
+
+Whenever a snapshot is stored, the versions older than the retention window or
+beyond the maximum number of versions are compacted: the oldest kept version is
+turned into a snapshot, and the versions before it are deleted.
+"""
+
+import json
+from datetime import datetime
+from typing import Annotated, Any, Optional, cast
+from uuid import UUID
+
+import structlog
+from fastapi import Depends
+from sqlalchemy import ColumnElement, case, delete, func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import col
+from typing_extensions import TypedDict
+
+from notice_api.core.config import settings
+from notice_api.db import AsyncSession, get_async_session, replica_connection
+from notice_api.notes.diff import NoteDiff, node_fields
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.schema import NoteVersion
+from notice_api.notes.tree import ROOT_NODE_ID
+
+
+class NoteDelta(TypedDict):
+    """The changes from one version of a content tree to the next."""
+
+    removed: list[str]
+    """Ids of the removed nodes, at any depth."""
+    nodes: dict[str, dict[str, Any]]
+    """The fields of the created and edited nodes, without `id` and `children`."""
+    children: dict[str, list[str]]
+    """The new child ids of every parent whose children were moved or created."""
+
+
+def make_delta(diff: NoteDiff) -> NoteDelta:
+    return NoteDelta(
+        removed=diff.removed,
+        nodes={
+            change.node["id"]: {
+                key: value
+                for key, value in node_fields(change.node).items()
+                if key != "id"
+            }
+            for change in diff.changes
+            if change.edited
+        },
+        children=diff.siblings,
+    )
+
+
+def apply_delta(children: list[NoteContent], delta: NoteDelta) -> list[NoteContent]:
+    """Return the content tree `children` with the changes of `delta` applied."""
+
+    fields: dict[str, dict[str, Any]] = {}
+    child_ids: dict[str, list[str]] = {}
+    parents: dict[str, str] = {}
+
+    def index(siblings: list[NoteContent], parent_id: str):
+        child_ids[parent_id] = [node["id"] for node in siblings]
+        for node in siblings:
+            fields[node["id"]] = node_fields(node)
+            parents[node["id"]] = parent_id
+            index(node.get("children", []), node["id"])
+
+    index(children, ROOT_NODE_ID)
+
+    for node_id in delta["removed"]:
+        fields.pop(node_id, None)
+        child_ids.pop(node_id, None)
+        parent_id = parents.pop(node_id, None)
+        if parent_id in child_ids and node_id in child_ids[parent_id]:
+            child_ids[parent_id].remove(node_id)
+
+    for node_id, node in delta["nodes"].items():
+        fields[node_id] = {"id": node_id, **node}
+
+    for parent_id, ids in delta["children"].items():
+        for node_id in ids:
+            # A node moved from a parent whose children are not in the delta.
+            previous = parents.get(node_id)
+            if previous is not None and previous != parent_id:
+                siblings = child_ids.get(previous, [])
+                if node_id in siblings:
+                    siblings.remove(node_id)
+            parents[node_id] = parent_id
+        child_ids[parent_id] = list(ids)
+
+    built: set[str] = set()
+
+    def build(parent_id: str) -> list[NoteContent]:
+        nodes: list[NoteContent] = []
+        for node_id in child_ids.get(parent_id, []):
+            if node_id in built or node_id not in fields:
+                continue
+            built.add(node_id)
+            node = {**fields[node_id], "children": build(node_id)}
+            nodes.append(cast(NoteContent, node))
+        return nodes
+
+    return build(ROOT_NODE_ID)
+
+
+def _encode(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _retention_cutoff(dialect: str) -> ColumnElement[Any]:
+    """The oldest `created_at` within `NOTE_HISTORY_RETENTION_DAYS`.
+
+    `created_at` is filled in by the clock of the database, in its timezone, so
+    the cutoff is computed by the database as well.
+    """
+
+    days = settings.NOTE_HISTORY_RETENTION_DAYS
+    if dialect == "sqlite":
+        return func.datetime("now", f"-{days} days")
+    return func.date_sub(func.now(), text(f"INTERVAL {days} DAY"))
+
+
+class NoteHistory:
+    """Records and rebuilds the versions of the content of the notes.
+
+    Args:
+        db: The session used to read and write the versions. Versions are
+            recorded in the transaction of the write they belong to.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._logger = structlog.get_logger("note_history")
+
+    async def record(
+        self,
+        note_id: UUID,
+        old: list[NoteContent],
+        new: list[NoteContent],
+        diff: Optional[NoteDiff],
+    ) -> Optional[int]:
+        """Record `new` as the latest version of the note's content.
+
+        The first recorded version of a note is the `old` content, so the state
+        before the first change can always be restored.
+
+        Args:
+            note_id: The note which was changed.
+            old: The children of the root node before the change.
+            new: The children of the root node after the change.
+            diff: The diff from `old` to `new`, or None if they can't be diffed.
+
+        Returns:
+            The new version, or None if the content did not change.
+        """
+
+        if diff is not None and diff.empty:
+            return None
+
+        conn = await self.db.connection()
+        # Locking the latest version serializes the writers of the same note.
+        result = await conn.execute(
+            select(
+                col(NoteVersion.version),
+                col(NoteVersion.base),
+                col(NoteVersion.base_size),
+                col(NoteVersion.chain_size),
+            )
+            .where(col(NoteVersion.note_id) == note_id)
+            .order_by(col(NoteVersion.version).desc())
+            .limit(1)
+            .with_for_update()
+        )
+
+        rows: list[dict[str, Any]] = []
+        if (latest := result.first()) is not None:
+            version, base, base_size, chain_size = latest
+        else:
+            data = _encode(old)
+            version, base, base_size, chain_size = 1, 1, len(data), 0
+            rows.append(
+                {
+                    "note_id": note_id,
+                    "version": version,
+                    "base": base,
+                    "base_size": base_size,
+                    "chain_size": chain_size,
+                    "data": data,
+                }
+            )
+
+        version += 1
+        delta = None if diff is None else _encode(make_delta(diff))
+        snapshot = (
+            delta is None
+            or version - base >= settings.NOTE_HISTORY_SNAPSHOT_INTERVAL
+            or chain_size + len(delta) > base_size
+        )
+        if delta is None or snapshot:
+            data = _encode(new)
+            base, base_size, chain_size = version, len(data), 0
+        else:
+            data = delta
+            chain_size += len(delta)
+        rows.append(
+            {
+                "note_id": note_id,
+                "version": version,
+                "base": base,
+                "base_size": base_size,
+                "chain_size": chain_size,
+                "data": data,
+            }
+        )
+        await conn.execute(insert(NoteVersion), rows)
+
+        if snapshot:
+            await self.compact(note_id, latest=version)
+        return version
+
+    async def get_versions(
+        self, note_id: UUID, limit: int, before: Optional[int] = None
+    ) -> list[tuple[int, datetime]]:
+        """Return the `(version, created_at)` of the latest versions of a note."""
+
+        statement = select(col(NoteVersion.version), col(NoteVersion.created_at)).where(
+            col(NoteVersion.note_id) == note_id
+        )
+        if before is not None:
+            statement = statement.where(col(NoteVersion.version) < before)
+
+        conn = await replica_connection(self.db)
+        result = await conn.execute(
+            statement.order_by(col(NoteVersion.version).desc()).limit(limit)
+        )
+        return [(version, created_at) for version, created_at in result]
+
+    async def get_content(
+        self, note_id: UUID, version: int
+    ) -> Optional[tuple[list[NoteContent], datetime]]:
+        """Rebuild a version of a note's content.
+
+        Returns the children of the root node at that version and the time the
+        version was recorded, or None if the version does not exist.
+        """
+
+        # A replica may only miss the latest versions.
+        conn = await replica_connection(self.db)
+        return await self._rebuild(conn, note_id, version)
+
+    async def _rebuild(
+        self, conn: AsyncConnection, note_id: UUID, version: int
+    ) -> Optional[tuple[list[NoteContent], datetime]]:
+        base = (
+            select(col(NoteVersion.base))
+            .where(
+                col(NoteVersion.note_id) == note_id,
+                col(NoteVersion.version) == version,
+            )
+            .scalar_subquery()
+        )
+        result = await conn.execute(
+            select(col(NoteVersion.data), col(NoteVersion.created_at))
+            .where(
+                col(NoteVersion.note_id) == note_id,
+                col(NoteVersion.version) >= base,
+                col(NoteVersion.version) <= version,
+            )
+            .order_by(col(NoteVersion.version))
+        )
+        rows = list(result)
+        if not rows:
+            return None
+
+        content: list[NoteContent] = json.loads(rows[0][0])
+        for data, _ in rows[1:]:
+            content = apply_delta(content, json.loads(data))
+        return content, rows[-1][1]
+
+    async def compact(self, note_id: UUID, latest: int):
+        """Delete the versions which are not retained anymore.
+
+        The versions recorded within `NOTE_HISTORY_RETENTION_DAYS` are kept, up
+        to `NOTE_HISTORY_MAX_VERSIONS` versions. The oldest kept version is
+        turned into a snapshot, so it can still be rebuilt.
+        """
+
+        conn = await self.db.connection()
+        cutoff = _retention_cutoff(conn.dialect.name)
+        result = await conn.execute(
+            select(
+                func.min(col(NoteVersion.version)),
+                func.min(
+                    case(
+                        (
+                            col(NoteVersion.created_at) >= cutoff,
+                            col(NoteVersion.version),
+                        )
+                    )
+                ),
+            ).where(col(NoteVersion.note_id) == note_id)
+        )
+        first, first_retained = result.one()
+        oldest = max(
+            latest - settings.NOTE_HISTORY_MAX_VERSIONS + 1,
+            first_retained if first_retained is not None else latest,
+        )
+        if first is None or oldest <= first:
+            return
+
+        version_of = (
+            col(NoteVersion.note_id) == note_id,
+            col(NoteVersion.version) == oldest,
+        )
+        result = await conn.execute(
+            select(col(NoteVersion.base), col(NoteVersion.chain_size)).where(
+                *version_of
+            )
+        )
+        base, folded_size = result.one()
+        if base != oldest:
+            # Rebuilt within the write transaction, which holds the latest deltas.
+            rebuilt = await self._rebuild(conn, note_id, oldest)
+            assert rebuilt is not None
+            data = _encode(rebuilt[0])
+            await conn.execute(
+                update(NoteVersion)
+                .where(*version_of)
+                .values(base=oldest, base_size=len(data), chain_size=0, data=data)
+            )
+            # The deltas after the new snapshot are now rebuilt from it, and their
+            # chain does not include the deltas folded into it anymore.
+            await conn.execute(
+                update(NoteVersion)
+                .where(
+                    col(NoteVersion.note_id) == note_id,
+                    col(NoteVersion.base) == base,
+                    col(NoteVersion.version) > oldest,
+                )
+                .values(
+                    base=oldest,
+                    base_size=len(data),
+                    chain_size=col(NoteVersion.chain_size) - folded_size,
+                )
+            )
+
+        await conn.execute(
+            delete(NoteVersion).where(
+                col(NoteVersion.note_id) == note_id,
+                col(NoteVersion.version) < oldest,
+            )
+        )
+        self._logger.info(
+            "Compacted note history", note_id=note_id, oldest=oldest, latest=latest
+        )
+
+    async def delete_versions(self, note_id: UUID):
+        """Delete the whole history of a note."""
+
+        await self.delete_notes_versions([note_id])
+
+    async def delete_notes_versions(self, note_ids: list[UUID]):
+        """Delete the whole history of many notes."""
+
+        conn = await self.db.connection()
+        await conn.execute(
+            delete(NoteVersion).where(col(NoteVersion.note_id).in_(note_ids))
+        )
+
+
+def get_note_history(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+) -> NoteHistory:
+    return NoteHistory(db=db)
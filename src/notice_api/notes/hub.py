@@ -0,0 +1,580 @@
+"""Share a note between all of its `take_note` sessions.
+
+The same note can be open on several devices at once. Every session of a note
+joins the note's hub, which owns the single write buffer of the note on this
+worker, and the hub broadcasts the accepted updates, including the generated
+blocks persisted by the server, to the other sessions. Broadcasts are batched
+per event loop tick, so a burst of updates costs a single frame per subscriber,
+encoded once per wire format (see `notice_api.utils.websocket`) for all of them.
+
+Updates accepted by this worker are relayed to the hubs of the note on the other
+workers over the message bus. Those apply them without writing them again, since
+the worker which accepted an update is the one persisting it. A hub which is
+still opening applies them once it has loaded the note. Updates relayed before
+the hub existed are not, so a hub reloads the note whenever another worker
+persisted it, which also covers relays dropped by the bus.
+
+Deleting a note closes its hubs on every worker, with the sessions of the note,
+and drops the updates they did not persist yet.
+
+Frames sent to the sessions:
+    - `{"type": "note", "payload": <root node>, "seq": <seq>}`: the whole note,
+      when joining and whenever a session fell too far behind.
+    - `{"type": "updates", "payload": [<update>, ...]}`: the updates of other
+      sessions, as sent by their clients, with the `seq` of the update added.
+      Generated blocks are sent as `insert contents` updates once persisted.
+    - `{"type": "ack", "payload": {"version": <version>}}`: the number of updates
+      of this session which have been persisted.
+"""
+
+import asyncio
+from collections import deque
+from typing import Optional
+from uuid import UUID
+
+import structlog
+from fastapi import WebSocket, status
+from sqlmodel import col, select
+
+from notice_api.core.config import settings
+from notice_api.db import AsyncSession, AsyncSessionFactory, release_connection
+from notice_api.notes import tree
+from notice_api.notes.cache import INVALIDATION_CHANNEL, note_content_cache
+from notice_api.notes.history import NoteHistory
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import NoteRepository, get_note_repository
+from notice_api.notes.schema import Note
+from notice_api.notes.write_buffer import NoteWriteBuffer, Operation
+from notice_api.utils.bus import (
+    RESYNC_CHANNEL,
+    Message,
+    MessageBus,
+    MessageTooLargeError,
+    message_bus,
+)
+from notice_api.utils.websocket import Codec, Frame, send_frame
+
+UPDATES_CHANNEL = "note-updates"
+DELETED_CHANNEL = "notes-deleted"
+
+
+def _encode_updates(codec: Codec, entries: list[Message]) -> Frame:
+    return codec.encode({"type": "updates", "payload": entries})
+
+
+def _remote_operation(update: Message) -> Optional[Operation]:
+    """Return the change of the content tree made by an update of another worker.
+
+    Every application of the operation inserts its own copy of the nodes, so the
+    copies of the content tree never share mutable nodes.
+    """
+
+    def copy(content: NoteContent) -> NoteContent:
+        return tree.copy_tree([content])[0]
+
+    match update:
+        case {"type": "update", "payload": {"index": index, "content": content}}:
+
+            def replace(children: list[NoteContent]) -> bool:
+                tree.replace_top_level(children, index, copy(content))
+                return True
+
+            return replace
+        case {"type": "update all", "payload": new_children}:
+
+            def replace_all(children: list[NoteContent]) -> bool:
+                children[:] = tree.copy_tree(new_children)
+                return True
+
+            return replace_all
+        case {
+            "type": "insert contents",
+            "payload": {"index": index, "contents": contents},
+        }:
+
+            def insert(children: list[NoteContent]) -> bool:
+                tree.insert_top_level(children, index, tree.copy_tree(contents))
+                return True
+
+            return insert
+        case {"type": "update node", "payload": {"content": content}}:
+            return lambda children: tree.update_node(children, content)
+        case {
+            "type": "insert node",
+            "payload": {"parent": parent_id, "after": after_id, "content": content},
+        }:
+            return lambda children: tree.insert_node(
+                children, parent_id, after_id, copy(content)
+            )
+        case {
+            "type": "move node",
+            "payload": {"id": node_id, "parent": parent_id, "after": after_id},
+        }:
+            return lambda children: tree.move_node(
+                children, node_id, parent_id, after_id
+            )
+        case {"type": "delete node", "payload": node_id}:
+            return lambda children: tree.delete_node(children, node_id)
+        case _:
+            return None
+
+
+class NoteSubscriber:
+    """A session of a note, receiving the broadcasts of the note's hub.
+
+    Frames are queued and sent by a separate task, so a slow client never holds
+    up the session which produced an update. A client which falls too far
+    behind is sent the whole note instead of the frames it missed.
+    """
+
+    def __init__(self, hub: "NoteHub", websocket: WebSocket, codec: Codec):
+        self.hub = hub
+        self.websocket = websocket
+        self.codec = codec
+        self.version = 0
+        """The number of updates accepted from this session."""
+        self.acked = 0
+        """The number of updates of this session which have been persisted."""
+
+        self._accepted: deque[tuple[int, int]] = deque()
+        self._queue: asyncio.Queue[Optional[Frame]] = asyncio.Queue(
+            maxsize=settings.NOTE_HUB_MAX_PENDING_FRAMES
+        )
+        self._sender = asyncio.create_task(self._send_frames())
+        self._logger = structlog.get_logger("note_subscriber", note_id=str(hub.note_id))
+
+    def accepted(self, buffer_version: int) -> int:
+        """Record an update of this session, returning its session version."""
+
+        self.version += 1
+        self._accepted.append((buffer_version, self.version))
+        return self.version
+
+    def persisted(self, buffer_version: int):
+        """Acknowledge the updates of this session persisted up to the version."""
+
+        acked = None
+        while self._accepted and self._accepted[0][0] <= buffer_version:
+            _, acked = self._accepted.popleft()
+        if acked is not None:
+            self.acked = acked
+            self.send(self._ack_frame())
+
+    def send(self, frame: Frame):
+        try:
+            self._queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.resync()
+
+    def resync(self):
+        """Drop the pending frames and send the whole note instead."""
+
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        # None stands for the whole note, encoded when it is sent.
+        self._queue.put_nowait(None)
+
+    async def close(self):
+        self._sender.cancel()
+
+    async def end(self, reason: str):
+        """Close the socket of the session, which then leaves the hub."""
+
+        try:
+            await self.websocket.close(
+                code=status.WS_1000_NORMAL_CLOSURE, reason=reason
+            )
+        except RuntimeError:
+            self._logger.debug("Session was already closed")
+
+    def _ack_frame(self) -> Frame:
+        return self.codec.encode({"type": "ack", "payload": {"version": self.acked}})
+
+    async def _send_frames(self):
+        while True:
+            frame = await self._queue.get()
+            try:
+                if frame is not None:
+                    await send_frame(self.websocket, frame)
+                else:
+                    await send_frame(self.websocket, self.hub.snapshot(self.codec))
+                    if self.acked:
+                        await send_frame(self.websocket, self._ack_frame())
+            except Exception:
+                # The session ends once its receiving side notices the closed socket.
+                self._logger.debug("Stopped sending to closed session", exc_info=True)
+                return
+
+
+class NoteHub:
+    """The shared state of a note on this worker, see the module docstring.
+
+    Args:
+        note_id: The note shared by the sessions.
+        title: The current title of the note.
+        content: The children of the root node, as currently persisted.
+        db: A session owned by the hub, closed with it. It only holds a
+            connection while it persists or loads the note, see
+            `release_connection`.
+        bus: Used to relay the updates to the other workers.
+    """
+
+    def __init__(
+        self,
+        note_id: UUID,
+        title: str,
+        content: list[NoteContent],
+        db: AsyncSession,
+        bus: MessageBus,
+    ):
+        self.note_id = note_id
+        self.title = title
+        self.db = db
+        self.bus = bus
+        self.repo: NoteRepository = get_note_repository(db)
+        self.buffer = NoteWriteBuffer(
+            repo=self.repo,
+            note_id=note_id,
+            content=content,
+            on_persisted=self._persisted,
+            cache=note_content_cache,
+            history=NoteHistory(db),
+        )
+        self.subscribers: list[NoteSubscriber] = []
+        self.holders = 0
+        """The number of sessions and requests using the hub."""
+        self.seq = 0
+        """The sequence number of the latest update broadcast by the hub."""
+
+        self._pending: list[tuple[Optional[NoteSubscriber], Message, bool]] = []
+        self._broadcast_handle: Optional[asyncio.Handle] = None
+        self._remote_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._logger = structlog.get_logger("note_hub", note_id=str(note_id))
+
+    def subscribe(self, websocket: WebSocket, codec: Codec) -> NoteSubscriber:
+        """Add a session, which is sent the whole note first."""
+
+        subscriber = NoteSubscriber(self, websocket, codec)
+        subscriber.send(self.snapshot(codec))
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    async def unsubscribe(self, subscriber: NoteSubscriber):
+        self.subscribers.remove(subscriber)
+        await subscriber.close()
+
+    def snapshot(self, codec: Codec) -> Frame:
+        """Encode the whole note, including the pending updates."""
+
+        root = NoteContent(
+            id=tree.ROOT_NODE_ID,
+            type="RootNode",
+            value=self.title,
+            children=self.buffer.content,
+        )
+        return codec.encode({"type": "note", "payload": root, "seq": self.seq})
+
+    def accepted(
+        self, subscriber: Optional[NoteSubscriber], version: int, update: Message
+    ):
+        """Broadcast an update accepted by the write buffer.
+
+        Args:
+            subscriber: The session which sent the update, if any.
+            version: The version of the update in the write buffer.
+            update: The update as sent by the client.
+        """
+
+        if subscriber is not None:
+            subscriber.accepted(version)
+        self.broadcast(subscriber, update)
+
+    def broadcast(self, origin: Optional[NoteSubscriber], update: Message):
+        """Broadcast a persisted or accepted update to all sessions but `origin`."""
+
+        self.seq += 1
+        self._publish(origin, {**update, "seq": self.seq}, relay=True)
+
+    async def apply_remote(self, message: Message):
+        """Apply and broadcast the updates relayed by another worker."""
+
+        async with self._remote_lock:
+            if message.get("reload"):
+                await self._reload()
+            else:
+                self._apply_remote_entries(message["entries"])
+
+    def _apply_remote_entries(self, entries: list[Message]):
+        for entry in entries:
+            if entry["type"] == "update title":
+                self.title = entry["payload"]
+            elif (operation := _remote_operation(entry)) is None or (
+                not self.buffer.apply_remote(operation)
+            ):
+                self._logger.warning("Ignored remote update", type=entry["type"])
+                continue
+            self.seq += 1
+            self._publish(None, {**entry, "seq": self.seq}, relay=False)
+
+    async def delete(self):
+        """Drop the pending updates of the deleted note, and end its sessions."""
+
+        self.buffer.discard()
+        for subscriber in list(self.subscribers):
+            await subscriber.end("The note was deleted.")
+        self._logger.info("Closed the sessions of the deleted note")
+
+    async def close(self):
+        """Persist the pending updates and release the resources of the hub."""
+
+        if self._broadcast_handle is not None:
+            self._broadcast_handle.cancel()
+            self._broadcast()
+        try:
+            await self.buffer.close()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            await self.db.close()
+
+    def _publish(self, origin: Optional[NoteSubscriber], entry: Message, relay: bool):
+        self._pending.append((origin, entry, relay))
+        if self._broadcast_handle is None:
+            loop = asyncio.get_running_loop()
+            self._broadcast_handle = loop.call_soon(self._broadcast)
+
+    def _broadcast(self):
+        self._broadcast_handle = None
+        pending, self._pending = self._pending, []
+
+        entries = [entry for _, entry, _ in pending]
+        frames: dict[Codec, Frame] = {}
+        origins = {id(origin) for origin, _, _ in pending if origin is not None}
+        for subscriber in self.subscribers:
+            codec = subscriber.codec
+            if id(subscriber) not in origins:
+                if codec not in frames:
+                    frames[codec] = _encode_updates(codec, entries)
+                subscriber.send(frames[codec])
+            elif others := [
+                entry for origin, entry, _ in pending if origin is not subscriber
+            ]:
+                subscriber.send(_encode_updates(codec, others))
+
+        if relayed := [entry for _, entry, relay in pending if relay]:
+            task = asyncio.create_task(self._relay(relayed))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _relay(self, entries: list[Message]):
+        try:
+            await self.bus.publish(
+                UPDATES_CHANNEL, {"note_id": self.note_id.hex, "entries": entries}
+            )
+        except MessageTooLargeError:
+            # Let the other workers read the updates from the database instead.
+            await self.buffer.flush()
+            await self.bus.publish(
+                UPDATES_CHANNEL, {"note_id": self.note_id.hex, "reload": True}
+            )
+        except Exception:
+            self._logger.exception("Failed to relay note updates")
+
+    async def _reload(self):
+        async def load() -> list[NoteContent]:
+            content = await self.repo.get_note_content(self.note_id)
+            await release_connection(self.db)
+            return content
+
+        if not await self.buffer.reload(load):
+            return
+        self._logger.info("Reloaded note changed by another worker")
+        for subscriber in self.subscribers:
+            subscriber.resync()
+
+    async def _persisted(self, version: int):
+        for subscriber in self.subscribers:
+            subscriber.persisted(version)
+
+
+class NoteHubs:
+    """The hubs of the notes which are open on this worker."""
+
+    def __init__(self, bus: MessageBus):
+        self.bus = bus
+        self._hubs: dict[UUID, asyncio.Task[NoteHub]] = {}
+        self._closing: dict[UUID, asyncio.Task[None]] = {}
+        self._logger = structlog.get_logger("note_hubs")
+        bus.subscribe(UPDATES_CHANNEL, self._on_remote_updates)
+        bus.subscribe(INVALIDATION_CHANNEL, self._on_invalidated)
+        bus.subscribe(DELETED_CHANNEL, self._on_deleted)
+        bus.subscribe(RESYNC_CHANNEL, self._on_resync)
+
+    def is_open(self, note_id: UUID) -> bool:
+        """Whether the note has a hub on this worker, which has its content."""
+
+        return note_id in self._hubs
+
+    async def join(
+        self, note_id: UUID, title: str, websocket: WebSocket, codec: Codec
+    ) -> NoteSubscriber:
+        """Subscribe a session to the hub of the note, opening it if needed."""
+
+        hub = await self._acquire(note_id, title)
+        return hub.subscribe(websocket, codec)
+
+    async def leave(self, subscriber: NoteSubscriber):
+        """Unsubscribe a session, closing the hub after its last session."""
+
+        await subscriber.hub.unsubscribe(subscriber)
+        await self._release(subscriber.hub)
+
+    async def replace_content(
+        self, note_id: UUID, title: str, content: list[NoteContent]
+    ):
+        """Replace the whole content of a note, like an `update all` of a session.
+
+        The sessions of the note are sent the new content, which is persisted
+        before returning.
+        """
+
+        hub = await self._acquire(note_id, title)
+        try:
+            version = hub.buffer.update_all(content)
+            hub.accepted(None, version, {"type": "update all", "payload": content})
+            await hub.buffer.flush()
+        finally:
+            await self._release(hub)
+
+    async def notes_deleted(self, note_ids: list[UUID]):
+        """Close the hubs of the deleted notes on every worker."""
+
+        await self._close_deleted(note_ids)
+        await self.bus.publish(
+            DELETED_CHANNEL, {"note_ids": [note_id.hex for note_id in note_ids]}
+        )
+
+    async def bookshelf_deleted(self, bookshelf_id: UUID):
+        """Close the hubs of the notes of the deleted bookshelf on every worker."""
+
+        await self._close_deleted_bookshelf(bookshelf_id)
+        await self.bus.publish(DELETED_CHANNEL, {"bookshelf_id": bookshelf_id.hex})
+
+    async def _acquire(self, note_id: UUID, title: str) -> NoteHub:
+        if (task := self._hubs.get(note_id)) is None:
+            task = asyncio.create_task(self._open(note_id, title))
+            self._hubs[note_id] = task
+        try:
+            hub = await task
+        except Exception:
+            if self._hubs.get(note_id) is task:
+                del self._hubs[note_id]
+            raise
+        hub.holders += 1
+        return hub
+
+    async def _release(self, hub: NoteHub):
+        hub.holders -= 1
+        if hub.holders:
+            return
+
+        del self._hubs[hub.note_id]
+        closing = asyncio.create_task(hub.close())
+        self._closing[hub.note_id] = closing
+        try:
+            await closing
+        finally:
+            if self._closing.get(hub.note_id) is closing:
+                del self._closing[hub.note_id]
+
+    async def _open(self, note_id: UUID, title: str) -> NoteHub:
+        # A hub which is still closing may not have persisted everything yet.
+        if (closing := self._closing.get(note_id)) is not None:
+            await asyncio.wait([closing])
+
+        db = AsyncSessionFactory()
+        try:
+            repo = get_note_repository(db)
+            cached = await note_content_cache.get_or_load(
+                note_id, lambda: repo.get_note_content(note_id=note_id)
+            )
+            await release_connection(db)
+        except BaseException:
+            await db.close()
+            raise
+        return NoteHub(note_id, title, cached.content, db=db, bus=self.bus)
+
+    async def _on_remote_updates(self, message: Message):
+        try:
+            note_id = UUID(hex=message["note_id"])
+        except (KeyError, ValueError):
+            self._logger.warning("Received invalid note updates", message=message)
+            return
+
+        if (task := self._hubs.get(note_id)) is None:
+            return
+        # A hub which is still opening loads the content without the update, so
+        # the update is applied once it has opened. Waiting for the same task
+        # keeps the relayed updates in order, and unlike awaiting it, a stopping
+        # bus doesn't cancel the opening of the hub.
+        await asyncio.wait([task])
+        if task.cancelled() or task.exception() is not None:
+            return
+        # The hub may have been closed in the meantime.
+        if self._hubs.get(note_id) is task:
+            await task.result().apply_remote(message)
+
+    async def _close_deleted(self, note_ids: list[UUID]):
+        for note_id in note_ids:
+            if (task := self._hubs.get(note_id)) is None:
+                continue
+            await asyncio.wait([task])
+            if task.cancelled() or task.exception() is not None:
+                continue
+            if self._hubs.get(note_id) is task:
+                await task.result().delete()
+
+    async def _close_deleted_bookshelf(self, bookshelf_id: UUID):
+        if not self._hubs:
+            return
+        async with AsyncSessionFactory() as db:
+            result = await db.exec(
+                select(Note.id).where(
+                    col(Note.bookshelf_id) == bookshelf_id,
+                    col(Note.id).in_(list(self._hubs)),
+                )
+            )
+            note_ids = [note_id for note_id in result if note_id is not None]
+        await self._close_deleted(note_ids)
+
+    async def _on_deleted(self, message: Message):
+        bookshelf_id: Optional[UUID] = None
+        note_ids: list[UUID] = []
+        try:
+            if "bookshelf_id" in message:
+                bookshelf_id = UUID(hex=message["bookshelf_id"])
+            else:
+                note_ids = [UUID(hex=note_id) for note_id in message["note_ids"]]
+        except (KeyError, TypeError, ValueError):
+            self._logger.warning("Received invalid deletion", message=message)
+            return
+
+        if bookshelf_id is not None:
+            await self._close_deleted_bookshelf(bookshelf_id)
+        else:
+            await self._close_deleted(note_ids)
+
+    async def _on_invalidated(self, message: Message):
+        # The note was persisted by another worker, maybe with updates which
+        # were relayed before the hub was opened.
+        await self._on_remote_updates({**message, "reload": True})
+
+    async def _on_resync(self, message: Message):
+        # Any of the hubs may have missed updates, reload them all.
+        for note_id in list(self._hubs):
+            await self._on_remote_updates({"note_id": note_id.hex, "reload": True})
+
+
+note_hubs = NoteHubs(bus=message_bus)
+"""The note hubs of this worker."""
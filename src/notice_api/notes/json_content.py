@@ -0,0 +1,216 @@
+"""The SQL of the `json` storage engine, for each supported database.
+
+The `json` engine edits the `note.content` JSON column in place, with the JSON
+functions of the database. Those differ between MySQL and SQLite (JSON1), so
+the statements are written once per dialect, and picked by the dialect of the
+connection, see `get_json_content_backend`. Which one runs is decided by the
+scheme of `DATABASE_URL`.
+
+The backends take and return the children of the root node as JSON text, the
+repository encodes and decodes them.
+"""
+
+from typing import Any, Optional
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+class JsonContentBackend:
+    """The statements of the `json` engine on MySQL, with `%s` parameters."""
+
+    async def get_children(self, conn: AsyncConnection, note_id: UUID) -> Optional[str]:
+        result = await conn.exec_driver_sql(
+            "SELECT `content` ->> '$.children' FROM note WHERE id = %s",
+            (note_id.hex,),
+        )
+        return result.scalar()
+
+    async def get_child(
+        self, conn: AsyncConnection, note_id: UUID, index: int
+    ) -> Optional[str]:
+        result = await conn.exec_driver_sql(
+            "SELECT `content` ->> '$.children[%s]' FROM note WHERE id = %s",
+            (index, note_id.hex),
+        )
+        for (row,) in result:
+            return row
+        return None
+
+    async def set_children(self, conn: AsyncConnection, note_id: UUID, children: str):
+        await conn.exec_driver_sql(
+            """
+            UPDATE
+                note
+            SET
+                `content` = JSON_SET(`content`, '$.children', CAST(%s AS JSON))
+            WHERE
+                id = %s
+            """,
+            (children, note_id.hex),
+        )
+
+    async def set_child_nodes(
+        self, conn: AsyncConnection, note_id: UUID, nodes: dict[int, str]
+    ):
+        """Replace several top-level nodes, appending the ones past the end.
+
+        The indices are applied in ascending order, so indices past the end of
+        the array are appended in the same order as separate updates would.
+        """
+
+        indices = sorted(nodes)
+        paths = ", ".join("'$.children[%s]', CAST(%s AS JSON)" for _ in indices)
+        parameters: list[Any] = []
+        for index in indices:
+            parameters += [index, nodes[index]]
+
+        await conn.exec_driver_sql(
+            f"""
+            UPDATE
+                note
+            SET
+                `content` = JSON_SET(`content`, {paths})
+            WHERE
+                id = %s
+            """,
+            (*parameters, note_id.hex),
+        )
+
+    async def insert_children(
+        self, conn: AsyncConnection, note_id: UUID, index: int, nodes: str
+    ):
+        """Insert the array `nodes` at `index`, appending past the end."""
+
+        # There is nothing before index 0, and `[0 to -1]` is not a valid path.
+        head = "JSON_ARRAY()"
+        parameters: list[Any] = []
+        if index > 0:
+            head = "COALESCE(`content`->>'$.children[0 to %s]', JSON_ARRAY())"
+            parameters.append(index - 1)
+
+        await conn.exec_driver_sql(
+            f"""
+            UPDATE
+                note
+            SET
+                `content` = JSON_SET(
+                    `content`,
+                    '$.children',
+                    JSON_MERGE(
+                        {head},
+                        CAST(%s AS JSON),
+                        COALESCE(`content`->>'$.children[%s to last]', JSON_ARRAY())
+                    )
+                )
+            WHERE
+                id = %s
+            """,
+            (*parameters, nodes, index, note_id.hex),
+        )
+
+
+class SQLiteJsonContentBackend(JsonContentBackend):
+    """The statements of the `json` engine on SQLite, with `?` parameters.
+
+    JSON values are passed through `json()`, so they are stored as JSON instead
+    of as strings. SQLite has no array ranges, so insertions rebuild the array
+    from `json_each`.
+    """
+
+    async def get_children(self, conn: AsyncConnection, note_id: UUID) -> Optional[str]:
+        result = await conn.exec_driver_sql(
+            "SELECT json_extract(content, '$.children') FROM note WHERE id = ?",
+            (note_id.hex,),
+        )
+        return result.scalar()
+
+    async def get_child(
+        self, conn: AsyncConnection, note_id: UUID, index: int
+    ) -> Optional[str]:
+        result = await conn.exec_driver_sql(
+            "SELECT json_extract(content, ?) FROM note WHERE id = ?",
+            (f"$.children[{index}]", note_id.hex),
+        )
+        for (row,) in result:
+            return row
+        return None
+
+    async def set_children(self, conn: AsyncConnection, note_id: UUID, children: str):
+        await conn.exec_driver_sql(
+            "UPDATE note SET content = json_set(content, '$.children', json(?)) "
+            "WHERE id = ?",
+            (children, note_id.hex),
+        )
+
+    async def set_child_nodes(
+        self, conn: AsyncConnection, note_id: UUID, nodes: dict[int, str]
+    ):
+        # `json_set` ignores indices past the end of an array, where MySQL
+        # appends, so those are appended with the `[#]` path instead.
+        path = (
+            "CASE WHEN ? < json_array_length(content, '$.children') "
+            "THEN ? ELSE '$.children[#]' END, json(?)"
+        )
+        paths = ", ".join(path for _ in nodes)
+        parameters: list[Any] = []
+        for index in sorted(nodes):
+            parameters += [index, f"$.children[{index}]", nodes[index]]
+
+        await conn.exec_driver_sql(
+            f"UPDATE note SET content = json_set(content, {paths}) WHERE id = ?",
+            (*parameters, note_id.hex),
+        )
+
+    async def insert_children(
+        self, conn: AsyncConnection, note_id: UUID, index: int, nodes: str
+    ):
+        await conn.exec_driver_sql(
+            """
+            UPDATE
+                note
+            SET
+                content = json_set(
+                    content,
+                    '$.children',
+                    (
+                        SELECT json_group_array(json(value)) FROM (
+                            SELECT 0 AS part, key, value
+                            FROM json_each(note.content, '$.children')
+                            WHERE key < ?
+                            UNION ALL
+                            SELECT 1, key, value FROM json_each(?)
+                            UNION ALL
+                            SELECT 2, key, value
+                            FROM json_each(note.content, '$.children')
+                            WHERE key >= ?
+                            ORDER BY part, key
+                        )
+                    )
+                )
+            WHERE
+                id = ?
+            """,
+            (index, nodes, index, note_id.hex),
+        )
+
+
+BACKENDS: dict[str, JsonContentBackend] = {
+    "mysql": JsonContentBackend(),
+    "sqlite": SQLiteJsonContentBackend(),
+}
+
+
+def get_json_content_backend(conn: AsyncConnection) -> JsonContentBackend:
+    """The backend of the dialect of the connection.
+
+    Raises:
+        NotImplementedError: The database is neither MySQL nor SQLite.
+    """
+
+    backend = BACKENDS.get(conn.dialect.name)
+    if backend is None:
+        raise NotImplementedError(
+            f"The json storage engine does not support {conn.dialect.name}"
+        )
+    return backend
@@ -0,0 +1,140 @@
+"""The messages sent by the clients of `take_note`, after the `init` message.
+
+Every message is `{"type": <type>, "payload": <payload>}`. The nodes in the
+payloads are validated against `NoteContent`, so malformed content is rejected
+before it reaches the write buffer and the database. Fields of the nodes which
+are not part of `NoteContent` are kept, and stored like the others, as long as
+their values can be stored as JSON.
+"""
+
+from typing import TYPE_CHECKING, Annotated, Any, Optional, Union
+
+import msgspec
+from msgspec import Meta
+
+from notice_api.notes.note_content import NoteContent
+from notice_api.utils.websocket import MessageDecoder
+
+Index = Annotated[int, Meta(ge=0)]
+NodeId = Annotated[str, Meta(min_length=1, max_length=64)]
+
+# Decoding into `NoteContent` would drop the fields it doesn't declare, so the
+# nodes are decoded as dicts and validated by the payloads instead.
+if TYPE_CHECKING:
+    Node = NoteContent
+else:
+    Node = dict[str, Any]
+
+
+def _check_json(value: Any):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError("Node fields must have string keys")
+            _check_json(item)
+    elif isinstance(value, list):
+        for item in value:
+            _check_json(item)
+    elif value is not None and not isinstance(value, (str, int, float)):
+        raise TypeError(f"Node fields can't be of type {type(value).__name__}")
+
+
+def _validate_nodes(*nodes: Node):
+    """Validate nodes and their descendants, raising `msgspec.ValidationError`."""
+
+    for node in nodes:
+        msgspec.convert(node, NoteContent)
+        _check_json(node)
+
+
+class UpdatePayload(msgspec.Struct):
+    index: Index
+    content: Node
+
+    def __post_init__(self):
+        _validate_nodes(self.content)
+
+
+class Update(msgspec.Struct, tag="update", tag_field="type"):
+    """Replace the top-level node at `index`."""
+
+    payload: UpdatePayload
+
+
+class UpdateAll(msgspec.Struct, tag="update all", tag_field="type"):
+    """Replace all top-level nodes."""
+
+    payload: list[Node]
+
+    def __post_init__(self):
+        _validate_nodes(*self.payload)
+
+
+class UpdateNodePayload(msgspec.Struct):
+    content: Node
+
+    def __post_init__(self):
+        _validate_nodes(self.content)
+
+
+class UpdateNode(msgspec.Struct, tag="update node", tag_field="type"):
+    """Update the fields of a node at any depth, keeping its children."""
+
+    payload: UpdateNodePayload
+
+
+class InsertNodePayload(msgspec.Struct):
+    parent: NodeId
+    after: Optional[NodeId]
+    content: Node
+
+    def __post_init__(self):
+        _validate_nodes(self.content)
+
+
+class InsertNode(msgspec.Struct, tag="insert node", tag_field="type"):
+    """Insert a subtree under `parent`, right after the sibling `after`."""
+
+    payload: InsertNodePayload
+
+
+class MoveNodePayload(msgspec.Struct):
+    id: NodeId
+    parent: NodeId
+    after: Optional[NodeId]
+
+
+class MoveNode(msgspec.Struct, tag="move node", tag_field="type"):
+    """Move a subtree under `parent`, right after the sibling `after`."""
+
+    payload: MoveNodePayload
+
+
+class DeleteNode(msgspec.Struct, tag="delete node", tag_field="type"):
+    """Delete a node and all of its descendants."""
+
+    payload: NodeId
+
+
+class UpdateTitle(msgspec.Struct, tag="update title", tag_field="type"):
+    payload: str
+
+
+class NoticeMe(msgspec.Struct, tag="notice me", tag_field="type"):
+    """Generate notes from the transcripts, inserted at the top-level `payload`."""
+
+    payload: Index
+
+
+NoteMessage = Union[
+    Update,
+    UpdateAll,
+    UpdateNode,
+    InsertNode,
+    MoveNode,
+    DeleteNode,
+    UpdateTitle,
+    NoticeMe,
+]
+
+note_message_decoder: MessageDecoder[NoteMessage] = MessageDecoder(NoteMessage)
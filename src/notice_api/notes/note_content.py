@@ -1,18 +1,23 @@
-from typing import cast
+from typing import Annotated, cast
 
 import structlog
-from typing_extensions import TypedDict
+from msgspec import Meta
+from typing_extensions import NotRequired, TypedDict
 
 
 class NoteContent(TypedDict):
-    id: str
-    type: str
-    value: str
-    children: list["NoteContent"]
+    """A node of the content tree of a note.
 
+    The constraints are checked when the node is received from a client, see
+    `notice_api.notes.messages`. They match the columns of `NoteBlock`.
+    """
 
-class HeadingContent(NoteContent):
-    level: int
+    id: Annotated[str, Meta(min_length=1, max_length=64)]
+    type: Annotated[str, Meta(min_length=1, max_length=32)]
+    value: str
+    children: list["NoteContent"]
+    level: NotRequired[int]
+    """The level of a `HeadingNode`."""
 
 
 def to_markdown(content: NoteContent, level: int = 0, indent_width: int = 4) -> str:
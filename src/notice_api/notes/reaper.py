@@ -0,0 +1,164 @@
+"""Remove the rows and the audio files of deleted bookshelves and notes.
+
+Deleting a bookshelf or a note only sets its `deleted_at`, which hides it from
+every route, so the request returns at once. The reaper removes them afterwards
+in the background, in small batches with a transaction each, so it never holds
+locks for long:
+
+1. the transcripts of a deleted note, `NOTE_REAPER_BATCH_TRANSCRIPTS` at a time,
+2. then its versions, content and audio files, and the note itself,
+   `NOTE_REAPER_BATCH_NOTES` notes at a time,
+3. and a deleted bookshelf once all of its notes are gone.
+
+The rows of a batch are locked with `SKIP LOCKED`, so the reapers of the other
+workers take another batch instead of waiting.
+"""
+
+import asyncio
+from typing import Optional, cast
+from uuid import UUID
+
+import structlog
+from sqlalchemy import delete
+from sqlmodel import col, select
+
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.core.config import settings
+from notice_api.db import AsyncSession, AsyncSessionFactory
+from notice_api.notes.history import NoteHistory
+from notice_api.notes.repository import NoteRepository
+from notice_api.notes.schema import Note
+from notice_api.transcript.audio_saver import get_path_for
+from notice_api.transcript.schema import Transcript
+
+
+def _delete_audio_files(filenames: list[str]):
+    """Delete the recordings of the notes, named by their `transcript_audio_filename`.
+
+    A note only keeps the name of its latest recording, which replaced the
+    earlier ones in the note, so only that file is deleted.
+    """
+
+    for filename in filenames:
+        get_path_for(filename).unlink(missing_ok=True)
+
+
+async def _select_deleted_notes(db: AsyncSession) -> tuple[list[UUID], Optional[UUID]]:
+    """Select a batch of notes to reap.
+
+    Returns the deleted notes if there are any, else the notes of a deleted
+    bookshelf along with the bookshelf.
+    """
+
+    conn = await db.connection()
+    result = await conn.execute(
+        select(col(Note.id))
+        .where(col(Note.deleted_at).is_not(None))
+        .limit(settings.NOTE_REAPER_BATCH_NOTES)
+        .with_for_update(skip_locked=True)
+    )
+    note_ids = cast(list[UUID], result.scalars().all())
+    if note_ids:
+        return note_ids, None
+
+    result = await conn.execute(
+        select(col(Bookshelf.id))
+        .where(col(Bookshelf.deleted_at).is_not(None))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    bookshelf_id = result.scalar_one_or_none()
+    if bookshelf_id is None:
+        return [], None
+
+    result = await conn.execute(
+        select(col(Note.id))
+        .where(col(Note.bookshelf_id) == bookshelf_id)
+        .limit(settings.NOTE_REAPER_BATCH_NOTES)
+        .with_for_update(skip_locked=True)
+    )
+    return cast(list[UUID], result.scalars().all()), bookshelf_id
+
+
+async def reap_batch(db: AsyncSession) -> int:
+    """Remove one batch of deleted rows and commit, returning how many were removed."""
+
+    note_ids, bookshelf_id = await _select_deleted_notes(db)
+    conn = await db.connection()
+
+    if not note_ids:
+        if bookshelf_id is None:
+            return 0
+        await conn.execute(delete(Bookshelf).where(col(Bookshelf.id) == bookshelf_id))
+        await db.commit()
+        return 1
+
+    result = await conn.execute(
+        select(col(Transcript.id))
+        .where(col(Transcript.note_id).in_(note_ids))
+        .limit(settings.NOTE_REAPER_BATCH_TRANSCRIPTS)
+    )
+    transcript_ids = list(result.scalars())
+    if transcript_ids:
+        await conn.execute(
+            delete(Transcript).where(col(Transcript.id).in_(transcript_ids))
+        )
+        await db.commit()
+        return len(transcript_ids)
+
+    result = await conn.execute(
+        select(col(Note.transcript_audio_filename)).where(
+            col(Note.id).in_(note_ids),
+            col(Note.transcript_audio_filename).is_not(None),
+        )
+    )
+    filenames = cast(list[str], result.scalars().all())
+    await NoteHistory(db).delete_notes_versions(note_ids)
+    await NoteRepository(db).delete_notes_storage(note_ids)
+    await conn.execute(delete(Note).where(col(Note.id).in_(note_ids)))
+    await db.commit()
+
+    # The files go once the rows are gone, so a failed batch keeps its audio.
+    if filenames:
+        await asyncio.to_thread(_delete_audio_files, filenames)
+    return len(note_ids)
+
+
+class NoteReaper:
+    """Run `reap_batch` in the background until there is nothing left to remove."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task[None]] = None
+        self._logger = structlog.get_logger("note_reaper")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def reap(self) -> int:
+        """Remove every deleted row, returning how many were removed."""
+
+        total = 0
+        while True:
+            async with AsyncSessionFactory() as db:
+                removed = await reap_batch(db)
+            if not removed:
+                return total
+            total += removed
+
+    async def _run(self):
+        while True:
+            try:
+                if removed := await self.reap():
+                    self._logger.info("Reaped deleted rows", rows=removed)
+            except Exception:
+                self._logger.exception("Reaping deleted rows failed")
+            await asyncio.sleep(settings.NOTE_REAPER_INTERVAL_SECONDS)
+
+
+note_reaper = NoteReaper()
+"""The reaper of this worker, started with the application."""
@@ -1,30 +1,91 @@
+import math
 from base64 import b64decode, b64encode
 from datetime import datetime
-from typing import Annotated, Literal, Optional, cast
+from typing import Annotated, Any, Awaitable, Callable, Literal, Optional, cast
 from uuid import UUID, uuid4
 
+import msgspec
 import structlog
-from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, status
-from pydantic import BaseModel
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    WebSocket,
+    status,
+)
+from pydantic import BaseModel, Field
+from sqlalchemy import func, update
 from sqlmodel import col, select
 from typing_extensions import TypedDict
 
+from notice_api.auth.cache import session_cache
 from notice_api.auth.deps import get_current_user
 from notice_api.auth.schema import User
-from notice_api.db import AsyncSession, get_async_session
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.bookshelves.versions import (
+    bump_bookshelves_version,
+    bump_notes_version,
+    get_notes_version,
+)
+from notice_api.core.config import settings
+from notice_api.db import REPLICA, AsyncSession, AsyncSessionFactory, get_async_session
 from notice_api.note_completion import model
-from notice_api.notes.deps import get_current_note
-from notice_api.notes.note_content import HeadingContent, to_markdown
-from notice_api.notes.repository import NoteRepository, get_note_repository
+from notice_api.notes.batch import (
+    MAX_OPERATIONS,
+    NoteOperation,
+    NoteOperationResult,
+    apply_note_operations,
+)
+from notice_api.notes.cache import note_content_cache
+from notice_api.notes.deps import get_current_note, resolve_note_session
+from notice_api.notes.history import NoteHistory, get_note_history
+from notice_api.notes.hub import NoteSubscriber, note_hubs
+from notice_api.notes.messages import (
+    DeleteNode,
+    InsertNode,
+    MoveNode,
+    NoticeMe,
+    Update,
+    UpdateAll,
+    UpdateNode,
+    UpdateTitle,
+    note_message_decoder,
+)
+from notice_api.notes.note_content import to_markdown
+from notice_api.notes.repository import get_note_repository
 from notice_api.notes.schema import (
     Note,
     NoteContent,
     NoteCreate,
     NoteRead,
+    NoteVersionContentRead,
+    NoteVersionRead,
+)
+from notice_api.utils.etag import check_not_modified, make_etag
+from notice_api.utils.metrics import WEBSOCKET_MESSAGE_SECONDS
+from notice_api.utils.ratelimit import (
+    client_host,
+    client_key,
+    generation_limiter,
+    generation_rate_limiter,
+    request_limiter,
+    websocket_limiter,
+)
+from notice_api.utils.responses import MsgspecJSONResponse
+from notice_api.utils.websocket import (
+    CODECS,
+    Init,
+    MessageDecoder,
+    receive_frame,
+    send_frame,
 )
 
 router = APIRouter(prefix="/bookshelves/{bookshelf_id}/notes", tags=["notes"])
 
+init_decoder: MessageDecoder[Init] = MessageDecoder(Init)
+
 
 class NoteCursor(BaseModel):
     id: UUID
@@ -44,65 +105,106 @@ class GetNotesResponse(BaseModel):
     next_cursor: Optional[str] = None
 
 
-@router.get("/")
-async def get_notes(
+def select_notes_page(
+    user_id: str,
     bookshelf_id: UUID,
-    user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_async_session)],
-    cursor: Optional[str] = None,
-    limit: Annotated[int, Query(ge=1, le=50)] = 10,
-    order: Literal["asc", "desc"] = "desc",
-    sort: Literal["title", "created_at"] = "created_at",
-) -> GetNotesResponse:
+    limit: int,
+    order: Literal["asc", "desc"],
+    sort: Literal["title", "created_at"],
+    cursor: Optional[NoteCursor] = None,
+):
+    """Select a page of the notes of a bookshelf, starting after `cursor`.
+
+    Notes are sorted by `sort`, then by `id` in the same direction, so the
+    `(bookshelf_id, user_id, <sort>, id)` indexes serve the page in either order.
+    """
+
     statement = (
         select(col(Note.id), col(Note.title), col(Note.created_at))
-        .where(col(Note.user_id) == user.id, col(Note.bookshelf_id) == bookshelf_id)
+        .where(
+            col(Note.user_id) == user_id,
+            col(Note.bookshelf_id) == bookshelf_id,
+            col(Note.deleted_at).is_(None),
+        )
         .limit(limit + 1)
     )
 
     # First sort by the `sort` parameter, then by the `id` column
     # (`id`: to achieve deterministic ordering).
-    sort_order = (
-        col(getattr(Note, sort)).desc()
-        if order == "desc"
-        else col(getattr(Note, sort)).asc()
+    sort_column = col(getattr(Note, sort))
+    id_column = col(Note.id)
+    if order == "desc":
+        statement = statement.order_by(sort_column.desc(), id_column.desc())
+    else:
+        statement = statement.order_by(sort_column.asc(), id_column.asc())
+
+    if cursor is not None:
+        sort_value = getattr(cursor, sort)
+        sort_eq = sort_column == sort_value
+        if order == "desc":
+            id_after = id_column < cursor.id
+            sort_filter = sort_column < sort_value
+        else:
+            id_after = id_column > cursor.id
+            sort_filter = sort_column > sort_value
+        statement = statement.where((sort_eq & id_after) | sort_filter)
+
+    return statement
+
+
+@router.get("/", response_model=GetNotesResponse)
+async def get_notes(
+    bookshelf_id: UUID,
+    user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=50)] = 10,
+    order: Literal["asc", "desc"] = "desc",
+    sort: Literal["title", "created_at"] = "created_at",
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> MsgspecJSONResponse:
+    version = await get_notes_version(db, user.id, bookshelf_id)
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Bookshelf {bookshelf_id} not found",
+        )
+    etag = make_etag(
+        "notes", user.id, bookshelf_id, version, cursor, limit, order, sort
     )
-    id_order = col(Note.id).asc()
-    statement = statement.order_by(sort_order, id_order)
+    check_not_modified(if_none_match, etag)
 
+    cursor_obj = None
     if cursor:
         cursor_obj = NoteCursor.decode(cursor)
-        sort_value = getattr(cursor_obj, sort)
-        if sort_value is None:
+        if getattr(cursor_obj, sort) is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid cursor: {cursor}",
             )
 
-        sort_eq = col(getattr(Note, sort)) == sort_value
-        id_gt = col(Note.id) > cursor_obj.id
-        sort_filter = (
-            col(getattr(Note, sort)) < sort_value
-            if order == "desc"
-            else col(getattr(Note, sort)) > sort_value
-        )
-        statement = statement.where((sort_eq & id_gt) | sort_filter)
-
-    notes = await db.exec(statement)
-    notes = [NoteRead.model_validate(note) for note in notes]
+    statement = select_notes_page(user.id, bookshelf_id, limit, order, sort, cursor_obj)
+    result = await db.exec(statement, bind_arguments=REPLICA)
+    notes = [
+        {"id": id, "title": title, "created_at": created_at}
+        for id, title, created_at in result
+    ]
 
     next_cursor = None
     if len(notes) > limit:
         last_note = notes[-2]
         next_cursor = NoteCursor(
-            id=last_note.id,
-            title=last_note.title,
-            created_at=last_note.created_at,
+            id=last_note["id"],
+            title=last_note["title"],
+            created_at=last_note["created_at"],
         ).encode()
 
-    return GetNotesResponse(
-        data=notes[:limit],
-        next_cursor=next_cursor,
+    # The rows already have the types of `NoteRead`, so they are encoded as
+    # they are instead of being validated into models, see
+    # `notice_api.utils.responses`.
+    return MsgspecJSONResponse(
+        {"data": notes[:limit], "next_cursor": next_cursor},
+        headers={"ETag": etag},
     )
 
 
@@ -117,6 +219,28 @@ async def create_note(
     user: Annotated[User, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ) -> CreateNoteResponse:
+    # The note count is updated in the transaction creating the note, which
+    # also checks that the bookshelf belongs to the user.
+    conn = await db.connection()
+    result = await conn.execute(
+        update(Bookshelf)
+        .where(
+            col(Bookshelf.id) == bookshelf_id,
+            col(Bookshelf.user_id) == user.id,
+            col(Bookshelf.deleted_at).is_(None),
+        )
+        .values(
+            note_count=col(Bookshelf.note_count) + 1,
+            notes_version=col(Bookshelf.notes_version) + 1,
+        )
+    )
+    if result.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Bookshelf {bookshelf_id} not found",
+        )
+    await bump_bookshelves_version(db, user.id)
+
     note = Note(
         title=note_create.title,
         bookshelf_id=bookshelf_id,
@@ -139,6 +263,7 @@ async def update_note(
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ) -> UpdateNoteResponse:
     note.title = note_update.title
+    await bump_notes_version(db, note.bookshelf_id)
     await db.commit()
     await db.refresh(note)
     return UpdateNoteResponse(data=NoteRead.model_validate(note))
@@ -149,8 +274,155 @@ async def delete_note(
     note: Annotated[Note, Depends(get_current_note)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    await db.delete(note)
+    # The content, history and transcripts of the note are removed later by the
+    # reaper, see `notice_api.notes.reaper`.
+    note_id = cast(UUID, note.id)
+    conn = await db.connection()
+    result = await conn.execute(
+        update(Note)
+        .where(col(Note.id) == note_id, col(Note.deleted_at).is_(None))
+        .values(deleted_at=func.now())
+    )
+    if result.rowcount == 0:
+        # Deleted by a concurrent request, which also updated the note count.
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Note {note_id} not found",
+        )
+    await conn.execute(
+        update(Bookshelf)
+        .where(col(Bookshelf.id) == note.bookshelf_id)
+        .values(
+            note_count=col(Bookshelf.note_count) - 1,
+            notes_version=col(Bookshelf.notes_version) + 1,
+        )
+    )
+    await bump_bookshelves_version(db, note.user_id)
     await db.commit()
+    await note_hubs.notes_deleted([note_id])
+    await note_content_cache.invalidate(note_id)
+
+
+class BatchNotesRequest(BaseModel):
+    operations: list[NoteOperation] = Field(max_length=MAX_OPERATIONS)
+
+
+class BatchNotesResponse(BaseModel):
+    data: list[NoteOperationResult]
+    """The result of every operation, in the order of the request."""
+
+
+@router.post("/batch")
+async def batch_notes(
+    bookshelf_id: UUID,
+    batch: BatchNotesRequest,
+    user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+) -> BatchNotesResponse:
+    """Create, rename, move and delete many notes of a bookshelf at once.
+
+    The operations are applied in order in a single transaction. An operation on
+    a note or a bookshelf the user does not own fails with its own 404 result,
+    without failing the others.
+    """
+
+    results, deleted = await apply_note_operations(
+        db, user, bookshelf_id, batch.operations
+    )
+    await db.commit()
+    if deleted:
+        await note_hubs.notes_deleted(deleted)
+    for note_id in deleted:
+        await note_content_cache.invalidate(note_id)
+    return BatchNotesResponse(data=results)
+
+
+class GetNoteVersionsResponse(BaseModel):
+    data: list[NoteVersionRead]
+    next_cursor: Optional[int] = None
+
+
+@router.get("/{note_id}/versions")
+async def get_note_versions(
+    note: Annotated[Note, Depends(get_current_note)],
+    history: Annotated[NoteHistory, Depends(get_note_history)],
+    cursor: Optional[int] = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> GetNoteVersionsResponse:
+    """List the versions of the note's content, latest first.
+
+    `cursor` is the version to continue the list before.
+    """
+
+    versions = await history.get_versions(
+        cast(UUID, note.id), limit=limit + 1, before=cursor
+    )
+
+    next_cursor = None
+    if len(versions) > limit:
+        next_cursor = versions[limit - 1][0]
+
+    return GetNoteVersionsResponse(
+        data=[
+            NoteVersionRead(version=version, created_at=created_at)
+            for version, created_at in versions[:limit]
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+class GetNoteVersionResponse(BaseModel):
+    data: NoteVersionContentRead
+
+
+async def get_note_version_content(
+    note: Note, version: int, history: NoteHistory
+) -> NoteVersionContentRead:
+    rebuilt = await history.get_content(cast(UUID, note.id), version)
+    if rebuilt is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Version {version} of note {note.id} not found",
+        )
+
+    content, created_at = rebuilt
+    return NoteVersionContentRead(
+        version=version,
+        created_at=created_at,
+        content=cast(list[dict[str, Any]], content),
+    )
+
+
+@router.get("/{note_id}/versions/{version}")
+async def get_note_version(
+    version: int,
+    note: Annotated[Note, Depends(get_current_note)],
+    history: Annotated[NoteHistory, Depends(get_note_history)],
+) -> GetNoteVersionResponse:
+    return GetNoteVersionResponse(
+        data=await get_note_version_content(note, version, history)
+    )
+
+
+@router.post(
+    "/{note_id}/versions/{version}/restore", status_code=status.HTTP_204_NO_CONTENT
+)
+async def restore_note_version(
+    version: int,
+    note: Annotated[Note, Depends(get_current_note)],
+    history: Annotated[NoteHistory, Depends(get_note_history)],
+):
+    """Replace the note's content with a previous version.
+
+    The restore is recorded as a new version, so it can be undone as well.
+    """
+
+    restored = await get_note_version_content(note, version, history)
+    await note_hubs.replace_content(
+        cast(UUID, note.id),
+        note.title,
+        cast(list[NoteContent], restored.content),
+    )
 
 
 class UpdateNoteItem(TypedDict):
@@ -166,8 +438,19 @@ class UpdateNoteMessage(TypedDict):
 
 
 async def handle_note_generation(
-    websocket: WebSocket, transcripts: list[str], usernote: str, index: int
+    send: Callable[[dict[str, Any]], Awaitable[None]],
+    persist: Callable[[int, list[NoteContent]], Awaitable[None]],
+    transcripts: list[str],
+    usernote: str,
+    index: int,
 ):
+    """Generate notes from the transcripts, inserted as top-level nodes at `index`.
+
+    Every generated block is sent as soon as it is generated. The blocks are
+    also persisted by the server, in batches of complete top-level subtrees,
+    so the client does not have to send them back.
+    """
+
     logger = structlog.get_logger("handle_note_generation", index=index)
     logger.info("Generating note")
     index -= 1
@@ -175,12 +458,23 @@ async def handle_note_generation(
     generated_note = model.generate_note_openai_async(transcripts, usernote)
     indent_level_ids: list[str] = []
 
+    # The generated nodes by id, and the top-level subtrees not persisted yet.
+    generated: dict[str, NoteContent] = {}
+    batch: list[NoteContent] = []
+    batch_index = index + 1
+    batch_blocks = 0
+
     async for line in generated_note:
         value = line.strip()
         first_not_space = line.find(value)
         indent_level = first_not_space // 4
         if indent_level == 0:
             index += 1
+            # The previous top-level subtrees are complete.
+            if batch_blocks >= settings.NOTE_GENERATION_BATCH_BLOCKS:
+                await persist(batch_index, batch)
+                batch_index += len(batch)
+                batch, batch_blocks = [], 0
 
         id = str(uuid4())
         if indent_level >= len(indent_level_ids):
@@ -205,15 +499,15 @@ async def handle_note_generation(
                 heading_level += 1
                 value = value[1:]
             item["value"] = value.strip()
-            cast(HeadingContent, item)["level"] = heading_level
+            item["level"] = heading_level
 
         update = UpdateNoteMessage(
             index=index,
             path=indent_level_ids[:indent_level],
             item=item,
         )
-        logger.info("Sending update", update=update)
-        await websocket.send_json(
+        logger.debug("Sending update", update=update)
+        await send(
             {
                 "type": "generated",
                 "payload": {
@@ -223,7 +517,41 @@ async def handle_note_generation(
             }
         )
 
-    await websocket.send_json({"type": "generated", "payload": {"finished": True}})
+        parent = generated.get(update["path"][-1]) if update["path"] else None
+        if parent is not None and parent is not item:
+            parent["children"].append(item)
+        else:
+            batch.append(item)
+        generated[id] = item
+        batch_blocks += 1
+
+    if batch:
+        await persist(batch_index, batch)
+    await send({"type": "generated", "payload": {"finished": True}})
+
+
+def admit_generation(user_id: str) -> Optional[dict[str, Any]]:
+    """Start a note generation of the user, unless it is over its budget.
+
+    Returns the message rejecting the generation if it is, else the generation
+    must release `generation_limiter` when it ends.
+    """
+
+    if not generation_limiter.acquire(user_id):
+        detail = "Too many note generations at once."
+    elif (retry_after := generation_rate_limiter.take(user_id)) is not None:
+        generation_limiter.release(user_id)
+        detail = f"Too many note generations, retry in {math.ceil(retry_after)}s."
+    else:
+        return None
+    return {
+        "type": "generated",
+        "payload": {
+            "finished": True,
+            "status": status.HTTP_429_TOO_MANY_REQUESTS,
+            "detail": detail,
+        },
+    }
 
 
 @router.websocket("/{note_id}/ws")
@@ -231,88 +559,183 @@ async def take_note(
     websocket: WebSocket,
     bookshelf_id: UUID,
     note_id: UUID,
-    repo: Annotated[NoteRepository, Depends(get_note_repository)],
-    db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
     logger = structlog.get_logger("take_note", note_id=str(note_id))
     await websocket.accept()
 
-    message = await websocket.receive_json()
-    match message:
-        case {"type": "init", "payload": session_token}:
-            user = await get_current_user(db, session_token=session_token)
-        case _:
-            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
-            return
+    try:
+        init = init_decoder.decode(await receive_frame(websocket))
+    except msgspec.DecodeError as e:
+        logger.warning("Received invalid init message", error=str(e))
+        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+        return
+    if (
+        request_limiter.take(client_key(init.payload, client_host(websocket)))
+        is not None
+    ):
+        logger.warning("Rejected note session over the request rate")
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    # The session lasts for hours, so every message which needs the database
+    # leases its own connection, instead of holding one for the whole session.
+    async with AsyncSessionFactory() as db:
+        # The content is only needed to open the hub of the note.
+        user, note = await resolve_note_session(
+            db,
+            session_token=init.payload,
+            bookshelf_id=bookshelf_id,
+            note_id=note_id,
+            load_content=not note_hubs.is_open(note_id),
+        )
+    if not websocket_limiter.acquire(user.id):
+        logger.warning("Rejected note session over the open websockets")
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    try:
+        # Every session of the note on this worker shares the hub of the note,
+        # which sends the whole note to the new session first.
+        subscriber = await note_hubs.join(
+            note_id, note.title, websocket, CODECS[init.format]
+        )
+        try:
+            await receive_note_updates(websocket, subscriber, user.id, init.payload)
+        finally:
+            await note_hubs.leave(subscriber)
+            logger.info("Note session closed", version=subscriber.acked)
+    finally:
+        websocket_limiter.release(user.id)
 
-    note = await get_current_note(
-        bookshelf_id=bookshelf_id,
-        note_id=note_id,
-        user=user,
-        db=db,
-    )
-    content = await repo.get_note_content(note_id=note_id)
 
-    note_content = NoteContent(
-        id="root",
-        type="RootNode",
-        value=note.title,
-        children=content,
-    )
-    await websocket.send_json({"type": "note", "payload": note_content})
+async def receive_note_updates(
+    websocket: WebSocket,
+    subscriber: NoteSubscriber,
+    user_id: str,
+    session_token: str,
+):
+    hub = subscriber.hub
+    buffer = hub.buffer
+    note_id = hub.note_id
+    logger = structlog.get_logger("take_note", note_id=str(note_id))
 
     while True:
-        message = await websocket.receive_json()
-        match message:
-            case {
-                "type": "update",
-                "payload": {"index": index, "content": content},
-            }:
-                logger.info("Received update", index=index)
-                await repo.update_note_content_partial(
-                    note_id=note_id,
-                    index=index,
-                    content=content,
-                )
-                logger.info("Note updated", index=index)
-            case {"type": "update all", "payload": new_children}:
-                logger.info(
-                    "Received full update",
-                    note_id=note.id,
-                    children_count=len(new_children),
-                )
-                await repo.update_note_content(
-                    note_id=note_id,
-                    content=new_children,
-                )
-                updated_content = await repo.get_note_content(note_id)
-                logger.info(
-                    "Full update complete",
-                    children_count=len(updated_content),
-                )
-            case {"type": "update title", "payload": new_title}:
-                logger.info("Received title update", title=new_title)
-                await repo.update_note_title(note_id=note_id, title=new_title)
-                logger.info("Title updated", title=new_title)
-            case {"type": "notice me", "payload": index}:
-                # get last 140 transcript records
-                transcripts = await repo.get_note_transcriptions(note_id, last_n=140)
-                logger.info("Transcripts fetched", transcripts=transcripts)
-                note_content = await repo.get_note_content(note_id)
-                markdown_content = to_markdown(
-                    {
-                        "id": "root",
-                        "type": "RootNode",
-                        "value": note.title,
-                        "children": note_content,
-                    }
-                )
+        try:
+            message = note_message_decoder.decode(await receive_frame(websocket))
+        except msgspec.DecodeError as e:
+            logger.warning("Received invalid message", error=str(e))
+            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+            return
 
-                await handle_note_generation(
-                    websocket=websocket,
-                    transcripts=transcripts,
-                    usernote=markdown_content,
-                    index=index,
+        # The latency of the handler, by the type of the message.
+        message_type = str(type(message).__struct_config__.tag)
+        with WEBSOCKET_MESSAGE_SECONDS.labels(message_type).time():
+            # The version of the update in the write buffer, if it was accepted.
+            version: Optional[int] = None
+            match message:
+                case Update(payload=payload):
+                    version = buffer.update(payload.index, payload.content)
+                    logger.debug(
+                        "Received update", index=payload.index, version=version
+                    )
+                case UpdateAll(payload=new_children):
+                    version = buffer.update_all(new_children)
+                    logger.info(
+                        "Received full update",
+                        children_count=len(new_children),
+                        version=version,
+                    )
+                case UpdateNode(payload=payload):
+                    version = buffer.update_node(payload.content)
+                    logger.debug(
+                        "Received node update",
+                        node_id=payload.content["id"],
+                        version=version,
+                    )
+                case InsertNode(payload=payload):
+                    version = buffer.insert_node(
+                        payload.parent, payload.after, payload.content
+                    )
+                    logger.info(
+                        "Received node insert",
+                        node_id=payload.content["id"],
+                        version=version,
+                    )
+                case MoveNode(payload=payload):
+                    version = buffer.move_node(
+                        payload.id, payload.parent, payload.after
+                    )
+                    logger.info(
+                        "Received node move", node_id=payload.id, version=version
+                    )
+                case DeleteNode(payload=node_id):
+                    version = buffer.delete_node(node_id)
+                    logger.info(
+                        "Received node delete", node_id=node_id, version=version
+                    )
+                case UpdateTitle(payload=new_title):
+                    version = buffer.update_title(new_title)
+                    hub.title = new_title
+                    logger.info(
+                        "Received title update", title=new_title, version=version
+                    )
+                case NoticeMe(payload=index):
+                    if (rejected := admit_generation(user_id)) is not None:
+                        logger.warning("Rejected note generation", detail=rejected)
+                        await send_frame(websocket, subscriber.codec.encode(rejected))
+                        continue
+                    try:
+                        # get last 140 transcript records
+                        async with AsyncSessionFactory() as db:
+                            repo = get_note_repository(db)
+                            transcripts = await repo.get_note_transcriptions(
+                                note_id, last_n=140
+                            )
+                        logger.info("Transcripts fetched", transcripts=transcripts)
+                        # The buffer holds the latest content, including pending
+                        # updates.
+                        markdown_content = to_markdown(
+                            {
+                                "id": "root",
+                                "type": "RootNode",
+                                "value": hub.title,
+                                "children": buffer.content,
+                            }
+                        )
+
+                        async def send_generated(message: dict[str, Any]):
+                            await send_frame(
+                                websocket, subscriber.codec.encode(message)
+                            )
+
+                        async def persist_generated(
+                            index: int, contents: list[NoteContent]
+                        ):
+                            await buffer.insert_contents(index, contents)
+                            await session_cache.wrote(session_token)
+                            # The session already received the blocks while
+                            # generating.
+                            hub.broadcast(
+                                subscriber,
+                                {
+                                    "type": "insert contents",
+                                    "payload": {"index": index, "contents": contents},
+                                },
+                            )
+
+                        await handle_note_generation(
+                            send=send_generated,
+                            persist=persist_generated,
+                            transcripts=transcripts,
+                            usernote=markdown_content,
+                            index=index,
+                        )
+                    finally:
+                        generation_limiter.release(user_id)
+
+            if version is not None:
+                # Relayed to the other sessions and workers in the client's format.
+                hub.accepted(subscriber, version, msgspec.to_builtins(message))
+                await session_cache.wrote(
+                    session_token, delay=settings.NOTE_WRITE_MAX_DELAY_SECONDS
                 )
-            case _:
-                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
@@ -1,8 +1,9 @@
 from datetime import datetime
-from typing import Optional
-from uuid import UUID
+from typing import Any, Optional
+from uuid import UUID, uuid4
 
-from sqlalchemy import func, types
+from sqlalchemy import Index, func, types
+from sqlalchemy.dialects import mysql
 from sqlmodel import Field, SQLModel
 
 from notice_api.notes.note_content import DEFAULT_NOTE_CONTENT, NoteContent
@@ -18,11 +19,28 @@ class Note(NoteBase, table=True):
     """A note for the associated user."""
 
     __tablename__ = "note"  # pyright: ignore[reportGeneralTypeIssues]
+    __table_args__ = (
+        # The pages of `get_notes`, sorted by each of the sort columns.
+        Index(
+            "ix_note_bookshelf_id_user_id_created_at_id",
+            "bookshelf_id",
+            "user_id",
+            "created_at",
+            "id",
+        ),
+        Index(
+            "ix_note_bookshelf_id_user_id_title_id",
+            "bookshelf_id",
+            "user_id",
+            "title",
+            "id",
+        ),
+    )
 
     id: Optional[UUID] = Field(
         default=None,
         primary_key=True,
-        sa_column_kwargs={"default": func.uuid()},
+        sa_column_kwargs={"default": uuid4},
     )
     title: str
     content: NoteContent = Field(
@@ -35,6 +53,102 @@ class Note(NoteBase, table=True):
     )
     bookshelf_id: UUID = Field(foreign_key="bookshelf.id", index=True)
     user_id: str = Field(foreign_key="user.id", index=True)
+    deleted_at: Optional[datetime] = Field(default=None, index=True)
+    """When the note was deleted, its rows are removed later by the reaper.
+
+    See `notice_api.notes.reaper`.
+    """
+
+
+class NoteBlock(SQLModel, table=True):
+    """A single node of a note's content tree.
+
+    Used by the block storage engine instead of the `note.content` JSON column.
+    Each node is stored as its own row, linked to its parent by `parent_id` and
+    ordered among its siblings by the fractional `position` key, so an edit at
+    any depth only touches the rows of the edited nodes.
+    """
+
+    __tablename__ = "note_block"  # pyright: ignore[reportGeneralTypeIssues]
+    __table_args__ = (
+        Index(
+            "ix_note_block_note_id_parent_id_position",
+            "note_id",
+            "parent_id",
+            "position",
+        ),
+    )
+
+    note_id: UUID = Field(foreign_key="note.id", primary_key=True)
+    id: str = Field(primary_key=True, sa_type=types.String(64))
+    parent_id: Optional[str] = Field(default=None, sa_type=types.String(64))
+    position: str = Field(
+        sa_type=types.String(255).with_variant(
+            mysql.VARCHAR(255, collation="utf8mb4_bin"), "mysql"
+        )
+    )
+    """Compared byte by byte, since the keys mix upper and lower case digits."""
+    type: str = Field(sa_type=types.String(32))
+    value: str = Field(default="", sa_type=types.Text())
+    attributes: Optional[dict[str, Any]] = Field(
+        default=None,
+        sa_type=types.JSON(none_as_null=True),
+    )
+
+
+class NoteContentBlob(SQLModel, table=True):
+    """The content of a note, used by the compressed storage engine.
+
+    Replaces the `note.content` JSON column, see `notice_api.notes.compression`.
+    """
+
+    __tablename__ = "note_content_blob"  # pyright: ignore[reportGeneralTypeIssues]
+
+    note_id: UUID = Field(foreign_key="note.id", primary_key=True)
+    encoding: str = Field(sa_type=types.String(16))
+    """How `data` is encoded, `json` or `zstd`."""
+    data: bytes = Field(
+        sa_type=types.LargeBinary().with_variant(mysql.LONGBLOB(), "mysql")
+    )
+    size: int
+    """The size of the content as JSON, in bytes."""
+
+
+class NoteVersion(SQLModel, table=True):
+    """A version of a note's content, see `notice_api.notes.history`.
+
+    A version is either a snapshot of the whole content, or a delta which is
+    applied to the previous version. `base` is the snapshot a version is rebuilt
+    from, which is the version itself for snapshots.
+    """
+
+    __tablename__ = "note_version"  # pyright: ignore[reportGeneralTypeIssues]
+
+    note_id: UUID = Field(foreign_key="note.id", primary_key=True)
+    version: int = Field(primary_key=True)
+    base: int
+    base_size: int
+    """The size of the data of the `base` snapshot, in bytes."""
+    chain_size: int
+    """The size of the data of the deltas since the `base` snapshot, in bytes."""
+    data: str = Field(sa_type=types.Text().with_variant(mysql.LONGTEXT(), "mysql"))
+    """The JSON encoded snapshot or delta."""
+    created_at: Optional[datetime] = Field(
+        default=None, sa_column_kwargs={"server_default": func.now()}
+    )
+
+
+class NoteVersionRead(SQLModel):
+    """Model for reading a version of a note."""
+
+    version: int
+    created_at: datetime
+
+
+class NoteVersionContentRead(NoteVersionRead):
+    """Model for reading a version of a note with its content."""
+
+    content: list[dict[str, Any]]
 
 
 class NoteRead(NoteBase):
@@ -0,0 +1,137 @@
+"""In-place operations on a note's content tree, addressing nodes by id."""
+
+from typing import Optional
+
+from notice_api.notes.note_content import NoteContent
+
+ROOT_NODE_ID = "root"
+"""The id of the root node of every note, see `DEFAULT_NOTE_CONTENT`."""
+
+
+def find_node(
+    children: list[NoteContent], node_id: str
+) -> Optional[tuple[list[NoteContent], int]]:
+    """Find a node in a content tree.
+
+    Returns the list which contains the node and its index in that list, or
+    None if the node does not exist.
+    """
+
+    for index, child in enumerate(children):
+        if child["id"] == node_id:
+            return children, index
+        if (found := find_node(child.get("children", []), node_id)) is not None:
+            return found
+    return None
+
+
+def children_of(
+    children: list[NoteContent], parent_id: str
+) -> Optional[list[NoteContent]]:
+    """Return the children of `parent_id`, or None if the parent does not exist."""
+
+    if parent_id == ROOT_NODE_ID:
+        return children
+    if (found := find_node(children, parent_id)) is None:
+        return None
+    siblings, index = found
+    return siblings[index]["children"]
+
+
+def _index_after(siblings: list[NoteContent], after_id: Optional[str]) -> Optional[int]:
+    if after_id is None:
+        return 0
+    ids = [sibling["id"] for sibling in siblings]
+    if after_id not in ids:
+        return None
+    return ids.index(after_id) + 1
+
+
+def replace_top_level(children: list[NoteContent], index: int, content: NoteContent):
+    """Replace the top-level node at `index`, appending past the end."""
+
+    if index < len(children):
+        children[index] = content
+    else:
+        children.append(content)
+
+
+def insert_top_level(
+    children: list[NoteContent], index: int, contents: list[NoteContent]
+):
+    """Insert top-level nodes at `index`, appending past the end."""
+
+    children[index:index] = contents
+
+
+def update_node(children: list[NoteContent], content: NoteContent) -> bool:
+    """Update the fields of a node, keeping its children."""
+
+    if (found := find_node(children, content["id"])) is None:
+        return False
+    siblings, index = found
+    siblings[index] = {**content, "children": siblings[index]["children"]}
+    return True
+
+
+def insert_node(
+    children: list[NoteContent],
+    parent_id: str,
+    after_id: Optional[str],
+    content: NoteContent,
+) -> bool:
+    """Insert a subtree under `parent_id`, right after the sibling `after_id`."""
+
+    if (siblings := children_of(children, parent_id)) is None:
+        return False
+    if (index := _index_after(siblings, after_id)) is None:
+        return False
+    siblings.insert(index, content)
+    return True
+
+
+def move_node(
+    children: list[NoteContent],
+    node_id: str,
+    parent_id: str,
+    after_id: Optional[str],
+) -> bool:
+    """Move a subtree under `parent_id`, right after the sibling `after_id`.
+
+    The tree is left untouched if the move is not possible.
+    """
+
+    if (found := find_node(children, node_id)) is None:
+        return False
+    siblings, index = found
+    node = siblings[index]
+    if parent_id == node_id or find_node(node["children"], parent_id) is not None:
+        return False
+
+    del siblings[index]
+    new_siblings = children_of(children, parent_id)
+    new_index = None if new_siblings is None else _index_after(new_siblings, after_id)
+    if new_siblings is None or new_index is None:
+        siblings.insert(index, node)
+        return False
+
+    new_siblings.insert(new_index, node)
+    return True
+
+
+def delete_node(children: list[NoteContent], node_id: str) -> bool:
+    """Delete a node and all of its descendants."""
+
+    if (found := find_node(children, node_id)) is None:
+        return False
+    siblings, index = found
+    del siblings[index]
+    return True
+
+
+def copy_tree(children: list[NoteContent]) -> list[NoteContent]:
+    """Copy the nodes and child lists of a tree, sharing the field values."""
+
+    return [
+        {**node, "children": copy_tree(node.get("children", []))} for node in children
+    ]
@@ -0,0 +1,370 @@
+"""Coalesce the content updates of a note before writing them to the database.
+
+A user typing in `take_note` sends an `update` message for every few keystrokes.
+Instead of running one transaction per message, the updates are applied to an
+in-memory copy of the note and persisted in a single transaction once the note
+has been idle for a short while, at the latest after a maximum delay, and when
+the session ends.
+
+The buffer also keeps the last persisted version of the content tree, so a flush
+only writes the nodes which differ from it (see `notice_api.notes.diff`).
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Optional
+from uuid import UUID
+
+import structlog
+
+from notice_api.core.config import settings
+from notice_api.notes import tree
+from notice_api.notes.cache import NoteContentCache
+from notice_api.notes.diff import diff_content
+from notice_api.notes.history import NoteHistory
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import NoteRepository
+
+OnPersisted = Callable[[int], Awaitable[None]]
+"""Callback invoked with the latest version that has been persisted."""
+Operation = Callable[[list[NoteContent]], bool]
+"""An in-place change of a content tree, returning whether it applied."""
+
+
+class NoteWriteBuffer:
+    """Merge successive writes to a note and persist them in batches.
+
+    Every accepted write gets the next version number and is applied to the
+    working copy of the content tree right away. A flush diffs the working copy
+    against the persisted copy and writes only the changed nodes.
+
+    Args:
+        repo: The repository used to persist the writes.
+        note_id: The note the writes belong to.
+        content: The children of the root node, as currently persisted.
+        on_persisted: Called with the latest persisted version after a flush.
+        cache: Updated with the content after every flush.
+        history: Records a version of the content with every flush.
+        debounce: Flush once no write has been received for this many seconds.
+        max_delay: Flush at the latest this many seconds after the first
+            pending write, even if writes keep arriving.
+    """
+
+    def __init__(
+        self,
+        repo: NoteRepository,
+        note_id: UUID,
+        content: list[NoteContent],
+        on_persisted: Optional[OnPersisted] = None,
+        cache: Optional[NoteContentCache] = None,
+        history: Optional[NoteHistory] = None,
+        debounce: float = settings.NOTE_WRITE_DEBOUNCE_SECONDS,
+        max_delay: float = settings.NOTE_WRITE_MAX_DELAY_SECONDS,
+    ):
+        self.repo = repo
+        self.note_id = note_id
+        self.on_persisted = on_persisted
+        self.cache = cache
+        self.history = history
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self.version = 0
+        """The version of the latest accepted write."""
+        self.persisted_version = 0
+        """The version of the latest write which has been persisted."""
+        self.persisted_content = content
+        """The children of the root node, as currently persisted."""
+
+        self._working: Optional[list[NoteContent]] = None
+        self._flushing: Optional[list[NoteContent]] = None
+        self._title: Optional[str] = None
+        self._replay: list[Operation] = []
+        self._discarded = False
+
+        self._lock = asyncio.Lock()
+        self._first_pending_at: Optional[float] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task[None]] = None
+        self._logger = structlog.get_logger("note_write_buffer", note_id=str(note_id))
+
+    @property
+    def pending(self) -> bool:
+        """Whether there are writes which have not been persisted yet."""
+
+        return self._working is not None or self._title is not None
+
+    @property
+    def content(self) -> list[NoteContent]:
+        """The children of the root node, including the pending writes."""
+
+        if self._working is not None:
+            return self._working
+        if self._flushing is not None:
+            return self._flushing
+        return self.persisted_content
+
+    def _edit(self) -> list[NoteContent]:
+        # The persisted copy and a copy being flushed must not change, so the
+        # first write after a flush starts a new working copy.
+        if self._working is None:
+            self._working = tree.copy_tree(self.content)
+        return self._working
+
+    def update(self, index: int, content: NoteContent) -> int:
+        """Replace the top-level node at `index`."""
+
+        tree.replace_top_level(self._edit(), index, content)
+        return self._accept()
+
+    def update_all(self, children: list[NoteContent]) -> int:
+        """Replace all top-level nodes."""
+
+        self._working = children
+        return self._accept()
+
+    def update_node(self, content: NoteContent) -> Optional[int]:
+        """Update the fields of a single node at any depth.
+
+        Returns None if the node does not exist.
+        """
+
+        if not tree.update_node(self._edit(), content):
+            return None
+        return self._accept()
+
+    def insert_node(
+        self, parent_id: str, after_id: Optional[str], content: NoteContent
+    ) -> Optional[int]:
+        """Insert a subtree under `parent_id`, right after the sibling `after_id`.
+
+        Returns None if the parent or the sibling does not exist.
+        """
+
+        if not tree.insert_node(self._edit(), parent_id, after_id, content):
+            return None
+        return self._accept()
+
+    def move_node(
+        self, node_id: str, parent_id: str, after_id: Optional[str]
+    ) -> Optional[int]:
+        """Move a subtree under `parent_id`, right after the sibling `after_id`.
+
+        Returns None if the move is not possible.
+        """
+
+        if not tree.move_node(self._edit(), node_id, parent_id, after_id):
+            return None
+        return self._accept()
+
+    def delete_node(self, node_id: str) -> Optional[int]:
+        """Delete a node and all of its descendants.
+
+        Returns None if the node does not exist.
+        """
+
+        if not tree.delete_node(self._edit(), node_id):
+            return None
+        return self._accept()
+
+    def update_title(self, title: str) -> int:
+        """Replace the title of the note."""
+
+        self._title = title
+        return self._accept()
+
+    async def insert_contents(self, index: int, contents: list[NoteContent]):
+        """Insert top-level nodes at `index` and persist them right away.
+
+        The pending writes are persisted first, so `index` refers to the current
+        content, and the nodes are then inserted with a single statement.
+        """
+
+        self._cancel_timer()
+        async with self._lock:
+            if self._discarded:
+                return
+            await self._flush_pending()
+
+            old = self.persisted_content
+            new = list(old)
+            tree.insert_top_level(new, index, tree.copy_tree(contents))
+            async with self.repo.transaction():
+                await self.repo.insert_note_contents(self.note_id, index, contents)
+                if self.history is not None:
+                    await self.history.record(
+                        self.note_id, old, new, diff_content(old, new)
+                    )
+
+            # Writes of other workers may have been applied while inserting.
+            if self.persisted_content is not old:
+                new = list(self.persisted_content)
+                tree.insert_top_level(new, index, tree.copy_tree(contents))
+            self.persisted_content = new
+            if self._working is not None:
+                tree.insert_top_level(self._working, index, tree.copy_tree(contents))
+            if self.cache is not None:
+                await self.cache.store(self.note_id, new)
+            self._logger.info(
+                "Inserted note contents", index=index, count=len(contents)
+            )
+
+    def apply_remote(self, operation: Operation) -> bool:
+        """Apply a write which was accepted and is persisted by another worker.
+
+        The write is applied to the persisted copy as well as to the working
+        copy, so it is never written again by this buffer.
+
+        Returns False if the write does not apply to the content.
+        """
+
+        persisted = tree.copy_tree(self.persisted_content)
+        if not operation(persisted):
+            return False
+        self.persisted_content = persisted
+
+        if self._flushing is not None:
+            # The flushed copy becomes the persisted copy once the flush ends.
+            self._replay.append(operation)
+            if self._working is None:
+                self._working = tree.copy_tree(self._flushing)
+        if self._working is not None:
+            operation(self._working)
+        return True
+
+    async def reload(self, load: Callable[[], Awaitable[list[NoteContent]]]) -> bool:
+        """Replace the persisted copy with `load()` if it differs.
+
+        The pending writes are persisted first, since they were made on the
+        previous content, and the content is loaded again if writes are
+        accepted while loading.
+
+        Returns whether the content changed.
+        """
+
+        if await load() == self.persisted_content:
+            return False
+
+        self._cancel_timer()
+        async with self._lock:
+            while True:
+                await self._flush_pending()
+                version = self.version
+                content = await load()
+                if self.version == version:
+                    break
+            self.persisted_content = content
+        return True
+
+    async def flush(self):
+        """Persist all pending writes in a single transaction."""
+
+        self._cancel_timer()
+        async with self._lock:
+            await self._flush_pending()
+
+    def discard(self):
+        """Drop the pending writes and stop persisting any, e.g. once the note
+        was deleted."""
+
+        self._cancel_timer()
+        self._discarded = True
+        self._working, self._title = None, None
+        self._first_pending_at = None
+
+    async def close(self):
+        """Persist the pending writes and stop the scheduled flush."""
+
+        await self.flush()
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+
+    def _accept(self) -> int:
+        self.version += 1
+        if not self._discarded:
+            self._schedule()
+        return self.version
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._first_pending_at is None:
+            self._first_pending_at = now
+
+        deadline = min(now + self.debounce, self._first_pending_at + self.max_delay)
+        self._cancel_timer()
+        self._timer = loop.call_at(deadline, self._start_flush)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _start_flush(self):
+        self._timer = None
+        self._flush_task = asyncio.create_task(self._scheduled_flush())
+
+    async def _scheduled_flush(self):
+        try:
+            async with self._lock:
+                await self._flush_pending()
+        except Exception:
+            self._logger.exception("Failed to flush note writes, retrying later")
+            if self.pending:
+                self._schedule()
+
+    async def _flush_pending(self):
+        if self._discarded or not self.pending:
+            return
+
+        version = self.version
+        content, title = self._working, self._title
+        self._working, self._title = None, None
+        self._flushing = content
+        self._first_pending_at = None
+
+        try:
+            diff = None
+            async with self.repo.transaction():
+                if content is not None:
+                    diff = diff_content(self.persisted_content, content)
+                    if diff is None:
+                        # Nodes can't be matched by id, rewrite the whole tree.
+                        await self.repo.update_note_content(self.note_id, content)
+                    else:
+                        await self.repo.apply_note_diff(self.note_id, diff, content)
+                    if self.history is not None:
+                        await self.history.record(
+                            self.note_id, self.persisted_content, content, diff
+                        )
+                if title is not None:
+                    await self.repo.update_note_title(self.note_id, title)
+        except Exception:
+            # Put the writes back, unless newer writes already replaced them.
+            if self._working is None:
+                self._working = content
+            if self._title is None:
+                self._title = title
+            raise
+        finally:
+            self._flushing = None
+            replay, self._replay = self._replay, []
+
+        if content is not None:
+            for operation in replay:
+                operation(content)
+            self.persisted_content = content
+            if self.cache is not None:
+                await self.cache.store(self.note_id, content)
+        self._logger.info(
+            "Flushed note writes",
+            version=version,
+            changed=len(diff.changes) if diff is not None else None,
+            removed=len(diff.removed) if diff is not None else None,
+            title=title is not None,
+        )
+        await self._persisted(version)
+
+    async def _persisted(self, version: int):
+        self.persisted_version = version
+        if self.on_persisted is not None:
+            await self.on_persisted(version)
@@ -46,7 +46,7 @@ class AudioSaver(BinaryIO):
 
     def write(self, data: bytes | bytearray) -> int:  # pyright: ignore[reportIncompatibleMethodOverride]
         logger = structlog.get_logger("audio_saver")
-        logger.info("Writing data to file", length=len(data), file=self.temp_path)
+        logger.debug("Writing data to file", length=len(data), file=self.temp_path)
         return self.writer.write(data)
 
     def close(self):
@@ -0,0 +1,22 @@
+"""The messages sent by the clients of `handle_live_transcription`.
+
+After `init`, the client sends `start`, then the audio as binary frames, and
+finally `stop`. Binary frames are always audio, so these messages are JSON.
+"""
+
+from typing import Union
+
+import msgspec
+
+
+class Start(msgspec.Struct, tag="start", tag_field="type"):
+    """Start recording the audio of the note."""
+
+
+class Stop(msgspec.Struct, tag="stop", tag_field="type"):
+    """Stop recording and end the session."""
+
+
+TranscriptionMessage = Union[Start, Stop]
+
+transcription_message_decoder = msgspec.json.Decoder(TranscriptionMessage)
@@ -1,63 +1,106 @@
-import json
 from datetime import datetime
-from typing import Annotated
 from uuid import UUID
 
+import msgspec
 import structlog
-from fastapi import APIRouter, Depends, WebSocket, status
+from fastapi import APIRouter, WebSocket, status
+from sqlalchemy import update
+from sqlmodel import col
 
-from notice_api.auth.deps import get_current_user
-from notice_api.db import AsyncSession, get_async_session
-from notice_api.notes.deps import get_current_note
+from notice_api.db import AsyncSession, AsyncSessionFactory, release_connection
+from notice_api.notes.deps import resolve_note_session
+from notice_api.notes.schema import Note
 from notice_api.transcript.audio_saver import (
     AudioSaver,
 )
+from notice_api.transcript.messages import (
+    Start,
+    Stop,
+    TranscriptionMessage,
+    transcription_message_decoder,
+)
 from notice_api.transcript.transcript_saver import (
     get_live_transciber,
     get_transcript_result_saver,
 )
+from notice_api.utils.ratelimit import (
+    client_host,
+    client_key,
+    request_limiter,
+    websocket_limiter,
+)
+from notice_api.utils.websocket import Init, receive_frame
 
 router = APIRouter(tags=["transcription"])
 
+init_decoder = msgspec.json.Decoder(Init)
+
+
+def decode_message(text: str) -> TranscriptionMessage | None:
+    try:
+        return transcription_message_decoder.decode(text)
+    except msgspec.DecodeError:
+        return None
+
 
 @router.websocket("/bookshelves/{bookshelf_id}/notes/{note_id}/transcription/ws")
 async def handle_live_transcription(
     ws: WebSocket,
     bookshelf_id: UUID,
     note_id: UUID,
-    db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
     logger = structlog.get_logger("live_transcription.route")
     await ws.accept()
 
-    message = await ws.receive_json()
-    match message:
-        case {"type": "init", "payload": session_token}:
-            logger.info("Received init message", session_token=session_token)
-            user = await get_current_user(db, session_token=session_token)
-        case _:
-            await ws.close(code=status.WS_1003_UNSUPPORTED_DATA)
-            return
+    try:
+        init = init_decoder.decode(await ws.receive_text())
+    except msgspec.DecodeError:
+        await ws.close(code=status.WS_1003_UNSUPPORTED_DATA)
+        return
+    logger.info("Received init message")
+    if request_limiter.take(client_key(init.payload, client_host(ws))) is not None:
+        logger.warning("Rejected transcription over the request rate")
+        await ws.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    # The session lasts for a whole lecture, so it only holds a connection of
+    # the pool while it writes, instead of for the whole session.
+    async with AsyncSessionFactory() as db:
+        user, note = await resolve_note_session(
+            db,
+            session_token=init.payload,
+            bookshelf_id=bookshelf_id,
+            note_id=note_id,
+        )
+    # Every transcription holds a connection to Deepgram.
+    if not websocket_limiter.acquire(user.id):
+        logger.warning("Rejected transcription over the open websockets")
+        await ws.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    try:
+        async with AsyncSessionFactory() as db:
+            await receive_transcription(ws, db, note)
+    finally:
+        websocket_limiter.release(user.id)
 
-    note = await get_current_note(
-        bookshelf_id=bookshelf_id,
-        note_id=note_id,
-        user=user,
-        db=db,
-    )
+
+async def receive_transcription(ws: WebSocket, db: AsyncSession, note: Note):
+    logger = structlog.get_logger("live_transcription.route")
+    note_id = note.id
 
     audio_saver: AudioSaver | None = None
     while True:
-        message = await ws.receive_json()
-        match message:
-            case {"type": "start"}:
+        match decode_message(await ws.receive_text()):
+            case Start():
                 filename = f"{note_id}_{datetime.now():%Y-%M-%d-%H:%M:%S}.mp3"
                 logger.info("Received start message", filename=filename)
                 conn = await db.connection()
-                await conn.exec_driver_sql(
-                    "UPDATE note SET transcript_audio_filename = %s WHERE id = %s",
-                    (filename, note_id),
+                await conn.execute(
+                    update(Note)
+                    .where(col(Note.id) == note_id)
+                    .values(transcript_audio_filename=filename)
                 )
+                await release_connection(db)
                 audio_saver = AudioSaver(filename=filename)
                 break
             case _:
@@ -67,16 +110,16 @@ async def handle_live_transcription(
         transcript_saver = get_transcript_result_saver(db, note)
         async with get_live_transciber(transcript_saver) as deepgram_live:
             while True:
-                message = await ws.receive()
-                if (b := message.get("bytes")) is not None:
-                    logger.info("Received audio bytes", length=len(b))
-                    audio_saver.write(b)
-                    deepgram_live.send(b)
-                    logger.info("Sent audio bytes to deepgram")
+                frame = await receive_frame(ws)
+                if isinstance(frame, bytes):
+                    logger.debug("Received audio bytes", length=len(frame))
+                    audio_saver.write(frame)
+                    deepgram_live.send(frame)
+                    logger.debug("Sent audio bytes to deepgram")
                     continue
 
-                match json.loads(message["text"]):
-                    case {"type": "stop"}:
+                match decode_message(frame):
+                    case Stop():
                         logger.info("Received stop message")
                         return
                     case _:
@@ -14,6 +14,6 @@ class Transcript(SQLModel, table=True):
         primary_key=True,
         sa_column_kwargs={"autoincrement": True},
     )
-    note_id: Optional[UUID] = Field(primary_key=True, foreign_key="note.id", index=True)
+    note_id: Optional[UUID] = Field(foreign_key="note.id", index=True, nullable=False)
     timestamp: datetime.timedelta = Field()
     text: str
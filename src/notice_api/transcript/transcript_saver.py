@@ -50,11 +50,12 @@ class DatabaseTranscriptResultSaver:
 
         try:
             self.db.add(new_transcript)
+            # Committing releases the connection until the next transcript.
             await self.db.commit()
-            await self.db.refresh(new_transcript)
             logger.info("Transcript saved successfully.")
         except Exception as e:
             logger.error(f"Failed to save transcript. Error: {e}")
+            await self.db.rollback()
 
 
 def get_transcript_result_saver(
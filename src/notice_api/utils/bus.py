@@ -0,0 +1,225 @@
+"""A small message bus to notify the other worker processes of the server.
+
+The server runs several worker processes (see the `start` script), each with its
+own in-memory state. Messages published on the bus are delivered to the
+subscribers of the channel in every *other* worker, e.g. to invalidate cached
+data which was changed by this worker.
+
+Available transports (`MESSAGE_BUS` setting):
+    - `local`: single process, messages are not delivered anywhere.
+    - `unix`: Unix datagram sockets in `MESSAGE_BUS_DIRECTORY`, one per worker,
+      for several workers on the same host.
+
+A worker can miss messages, e.g. when its socket is full. The publisher then
+sends it a message on `RESYNC_CHANNEL` as soon as it can, and the subscribers of
+that channel drop whatever they learned from the bus, such as cached notes and
+sessions, and reload it from the database.
+
+Running several workers requires the `unix` transport: with `local`, the note
+cache, the note hubs and the session cache of a worker never hear of the
+changes made by the others. `gunicorn.conf.py` defaults to `unix`, so
+`pdm run start` uses it unless `MESSAGE_BUS` is set in the environment.
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import socket
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import structlog
+
+from notice_api.core.config import settings
+
+RESYNC_CHANNEL = "resync"
+"""Sent to a worker which missed messages, with an empty message."""
+
+Message = dict[str, Any]
+Handler = Callable[[Message], Union[Awaitable[None], None]]
+
+
+class MessageTooLargeError(Exception):
+    """The message can't be sent in a single datagram."""
+
+
+class MessageBus:
+    """Base class of the transports, which also keeps track of the subscribers.
+
+    Subclasses implement `publish` and call `dispatch` for every message they
+    receive from another worker.
+    """
+
+    max_message_size: Optional[int] = None
+    """The maximum size of an encoded message in bytes, if limited."""
+
+    def __init__(self):
+        self._handlers: defaultdict[str, list[Handler]] = defaultdict(list)
+        self._logger = structlog.get_logger("message_bus")
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Call `handler` with every message published on `channel` by another worker."""
+
+        self._handlers[channel].append(handler)
+
+    async def start(self):
+        """Start receiving messages."""
+
+    async def stop(self):
+        """Stop receiving messages."""
+
+    async def publish(self, channel: str, message: Message):
+        """Deliver `message` to the subscribers of `channel` in the other workers."""
+
+        raise NotImplementedError
+
+    async def dispatch(self, channel: str, message: Message):
+        for handler in self._handlers.get(channel, []):
+            try:
+                result = handler(message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                self._logger.exception("Message handler failed", channel=channel)
+
+
+class LocalMessageBus(MessageBus):
+    """Transport for a single worker process, where there is nobody to notify."""
+
+    async def publish(self, channel: str, message: Message):
+        pass
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bus: "UnixSocketMessageBus"):
+        self.bus = bus
+
+    def datagram_received(self, data: bytes, addr: Any):
+        self.bus.received(data)
+
+
+class UnixSocketMessageBus(MessageBus):
+    """Transport between the workers of a single host.
+
+    Every worker binds a datagram socket named after its process id in a shared
+    directory, and publishing sends the message to every other socket found
+    there. Sockets of workers which are gone are removed on the first failed
+    send. Workers whose socket is full are sent a message on `RESYNC_CHANNEL`
+    once it has room again, see `_send_resyncs`.
+    """
+
+    max_message_size = 64 * 1024
+    resync_retry_interval = 0.1
+    """How often a resync is retried while the socket of the worker is full."""
+
+    def __init__(self, directory: Union[str, Path]):
+        super().__init__()
+        self.directory = Path(directory)
+        self.path = self.directory / f"{os.getpid()}.sock"
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._socket: Optional[socket.socket] = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._missed: set[Path] = set()
+        """The sockets of the workers which missed messages."""
+        self._resync_task: Optional[asyncio.Task[None]] = None
+
+    async def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(str(self.path))
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), sock=sock
+        )
+
+        # Sending uses a separate socket, so a full peer can't block receiving.
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._logger.info("Message bus started", path=str(self.path))
+
+    async def stop(self):
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+            self._resync_task = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self.path.unlink(missing_ok=True)
+
+    async def publish(self, channel: str, message: Message):
+        if self._socket is None:
+            return
+
+        data = json.dumps({"channel": channel, "message": message}).encode()
+        if self.max_message_size is not None and len(data) > self.max_message_size:
+            raise MessageTooLargeError(f"{len(data)} bytes on channel {channel}")
+
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            if not self._send(data, peer):
+                self._logger.warning("Dropped message, peer is busy", peer=peer.name)
+                self._missed.add(peer)
+
+        if self._missed and self._resync_task is None:
+            self._resync_task = asyncio.create_task(self._send_resyncs())
+
+    def _send(self, data: bytes, peer: Path) -> bool:
+        """Send a datagram to a worker, returning False if its socket is full."""
+
+        assert self._socket is not None
+        try:
+            self._socket.sendto(data, str(peer))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # The worker which owned the socket has exited.
+            peer.unlink(missing_ok=True)
+            self._missed.discard(peer)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def _send_resyncs(self):
+        """Send a resync to the workers which missed messages, once they can
+        receive it, so they stop relying on what they missed."""
+
+        data = json.dumps({"channel": RESYNC_CHANNEL, "message": {}}).encode()
+        try:
+            while self._missed and self._socket is not None:
+                await asyncio.sleep(self.resync_retry_interval)
+                for peer in list(self._missed):
+                    if self._send(data, peer):
+                        self._missed.discard(peer)
+                        self._logger.info("Sent resync", peer=peer.name)
+        finally:
+            self._resync_task = None
+
+    def received(self, data: bytes):
+        try:
+            envelope = json.loads(data)
+            channel, message = envelope["channel"], envelope["message"]
+        except (ValueError, KeyError, TypeError):
+            self._logger.warning("Received malformed message", length=len(data))
+            return
+        task = asyncio.create_task(self.dispatch(channel, message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def create_message_bus() -> MessageBus:
+    """Create the transport configured in the settings."""
+
+    if settings.MESSAGE_BUS == "unix":
+        return UnixSocketMessageBus(settings.MESSAGE_BUS_DIRECTORY)
+    return LocalMessageBus()
+
+
+message_bus = create_message_bus()
+"""The message bus of this worker, started in the application lifespan."""
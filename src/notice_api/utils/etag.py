@@ -0,0 +1,31 @@
+"""Strong ETags and conditional GET requests.
+
+A listing's ETag is derived from the version counter of the listing and from
+everything else its content depends on (the user and the query parameters),
+so a request can be answered with `304 Not Modified` before running the
+listing query.
+"""
+
+import hashlib
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+
+def make_etag(*parts: object) -> str:
+    """Make a strong ETag which changes whenever one of the `parts` does."""
+
+    data = "\0".join(str(part) for part in parts).encode()
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def check_not_modified(if_none_match: Optional[str], etag: str):
+    """Raise a `304 Not Modified` response if `If-None-Match` matches `etag`."""
+
+    if if_none_match is None:
+        return
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or etag in tags:
+        raise HTTPException(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
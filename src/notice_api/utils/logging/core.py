@@ -4,18 +4,29 @@ and `uvicorn` access logs.
 The tracing setup is removed from the original snippet, as we don't use
 tracing in this project.
 
+Records are rendered and written by a background thread, see
+`BackgroundQueueHandler`, and the events of busy loggers can be sampled or rate
+limited before they are processed at all, see `LogSampler`.
+
 Source: https://gist.github.com/nymous/f138c7f06062b7c43c060bf03759c29e
 """
 
 
+import atexit
+import copy
 import logging
+import queue
+import random
 import sys
+from logging.handlers import QueueHandler, QueueListener
 from types import TracebackType
-from typing import Type
+from typing import Any, Type
 
 import structlog
 from structlog.types import EventDict, Processor, WrappedLogger
 
+from notice_api.utils.ratelimit import RateLimiter
+
 
 def drop_color_message_key(
     _logger: WrappedLogger, _method: str, event_dict: EventDict
@@ -28,13 +39,116 @@ def drop_color_message_key(
     return event_dict
 
 
-def setup_logging(json_logs: bool = False, log_level: str = "INFO"):
+def capture_exc_info(
+    _logger: WrappedLogger, _method: str, event_dict: EventDict
+) -> EventDict:
+    """
+    Replace `exc_info=True`, e.g. from `logger.exception`, with the exception being
+    handled, as the renderer runs on the thread of the `QueueListener`, where no
+    exception is being handled.
+    """
+    if event_dict.get("exc_info") is True:
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+
+class LogSampler:
+    """Drop a share of the events of busy loggers, before they are processed.
+
+    Only `debug` and `info` events are dropped, warnings and errors are always
+    kept.
+
+    Args:
+        sample_rates: The fraction of the events kept, by logger name.
+        rate_limits: The maximum events per second kept, by logger name.
+    """
+
+    DROPPABLE_METHODS = frozenset({"debug", "info"})
+
+    def __init__(self, sample_rates: dict[str, float], rate_limits: dict[str, float]):
+        self.sample_rates = sample_rates
+        self.rate_limiters = {
+            name: RateLimiter(rate=limit, burst=max(limit, 1.0), max_keys=1)
+            for name, limit in rate_limits.items()
+        }
+
+    def __call__(
+        self, logger: WrappedLogger, method_name: str, event_dict: EventDict
+    ) -> EventDict:
+        if method_name not in self.DROPPABLE_METHODS:
+            return event_dict
+
+        name = getattr(logger, "name", "")
+        sample_rate = self.sample_rates.get(name)
+        if sample_rate is not None and random.random() >= sample_rate:
+            raise structlog.DropEvent
+        limiter = self.rate_limiters.get(name)
+        if limiter is not None and limiter.take("events") is not None:
+            raise structlog.DropEvent
+        return event_dict
+
+
+def snapshot(value: Any) -> Any:
+    """
+    Copy a value of an event, which the caller may change before the event is
+    rendered. Values which can't be copied are rendered with `repr` instead.
+    """
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    try:
+        return copy.deepcopy(value)
+    except (TypeError, copy.Error, RecursionError):
+        return repr(value)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Queue the records for a `QueueListener`, which renders and writes them on its
+    own thread, instead of the event loop.
+
+    Unlike `QueueHandler`, the events of structlog are queued without rendering
+    them first, as the rendering is the work taken off the event loop. Their
+    values are copied instead, see `snapshot`, as the callers may change them
+    after logging them. The records of the standard library only get their
+    message formatted, and the context variables copied into them, as the
+    listener can't read them, while structlog merged them into its events
+    already.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.msg, dict):
+            # The traceback of `exc_info` can't be copied, and doesn't change.
+            record.msg = {
+                key: value if key == "exc_info" else snapshot(value)
+                for key, value in record.msg.items()
+            }
+        else:
+            record.msg = record.getMessage()
+            record.args = None
+            for key, value in structlog.contextvars.get_contextvars().items():
+                record.__dict__.setdefault(key, value)
+        return record
+
+
+def setup_logging(
+    json_logs: bool = False,
+    log_level: str = "INFO",
+    sample_rates: dict[str, float] | None = None,
+    rate_limits: dict[str, float] | None = None,
+):
     """Setup structlog logger, integrate it with the standard library logging module,
     and configure uvicorn to use it.
 
     Args:
         json_logs (bool, optional): Whether to log in JSON format. Defaults to False.
         log_level (str, optional): The log level. Defaults to "INFO".
+        sample_rates (dict, optional): The fraction of the `debug` and `info` events
+            kept, by logger name. Defaults to keeping every event.
+        rate_limits (dict, optional): The maximum `debug` and `info` events per
+            second kept, by logger name. Defaults to no limit.
+
+    Notes:
+        The records are written by a thread started here, so this must be called
+        in the process which logs, e.g. in every worker, after the fork.
     """
 
     timestamper = structlog.processors.TimeStamper(fmt="iso")
@@ -60,7 +174,12 @@ def setup_logging(json_logs: bool = False, log_level: str = "INFO"):
 
     structlog.configure(
         processors=[
+            # Drop the events below the log level, or sampled out, before any of
+            # the work of the other processors.
+            structlog.stdlib.filter_by_level,
+            LogSampler(sample_rates or {}, rate_limits or {}),
             *shared_processors,
+            capture_exc_info,
             # Prepare event dict for `ProcessorFormatter`.
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
@@ -89,8 +208,14 @@ def setup_logging(json_logs: bool = False, log_level: str = "INFO"):
     handler = logging.StreamHandler()
     # Use OUR `ProcessorFormatter` to format all `logging` entries.
     handler.setFormatter(formatter)
+    # The records are rendered and written on the thread of the listener.
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    # Write the records still queued when the process exits.
+    atexit.register(listener.stop)
     root_logger = logging.getLogger()
-    root_logger.addHandler(handler)
+    root_logger.addHandler(BackgroundQueueHandler(log_queue))
     root_logger.setLevel(log_level.upper())
 
     for _log in ["uvicorn", "uvicorn.error"]:
@@ -0,0 +1,318 @@
+"""Prometheus metrics of the application, served at `/metrics`.
+
+- `notice_http_request_duration_seconds`: the latency of HTTP requests, by
+  method, route template and status code.
+- `notice_websockets_open`: the open websockets, by route template.
+- `notice_websocket_messages_total` and `notice_websocket_bytes_total`: the
+  websocket messages received and sent, and their size, by route template, e.g.
+  `rate(notice_websocket_messages_total[1m])` is the messages per second.
+- `notice_websocket_duration_seconds` and `notice_websocket_closes_total`: how
+  long websockets stay open, and their close codes, by route template.
+- `notice_websocket_message_duration_seconds`: the latency of the handlers of
+  the note messages, by message type.
+- `notice_db_query_duration_seconds`: the latency of database statements, by
+  kind of statement.
+- `notice_db_pool_checkout_seconds` and `notice_db_pool_checked_out`: the wait
+  for a connection of the database pools, and the connections in use.
+- `notice_event_loop_lag_seconds`: how late the event loop runs a timer, which
+  is how long callbacks blocked it.
+
+Every websocket is also logged to `api.access` once it is closed, with the
+same counters, see `MetricsMiddleware`.
+
+Every gunicorn worker is a separate process with metrics of its own. When the
+`PROMETHEUS_MULTIPROC_DIR` environment variable is set before the workers
+start, which `gunicorn.conf.py` does, the workers write their metrics to files
+in that directory, and `/metrics` adds up the files of every worker, whichever
+worker serves the scrape.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+import structlog
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    make_asgi_app,
+    multiprocess,
+)
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from notice_api.core.config import settings
+
+access_logger = structlog.get_logger("api.access")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "notice_http_request_duration_seconds",
+    "Time spent serving HTTP requests.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+WEBSOCKETS_OPEN = Gauge(
+    "notice_websockets_open",
+    "Websockets being served.",
+    ["route"],
+    multiprocess_mode="livesum",
+)
+
+WEBSOCKET_MESSAGES = Counter(
+    "notice_websocket_messages",
+    "Websocket messages received and sent.",
+    ["route", "direction"],
+)
+
+WEBSOCKET_BYTES = Counter(
+    "notice_websocket_bytes",
+    "Size of the websocket messages received and sent.",
+    ["route", "direction"],
+)
+
+WEBSOCKET_DURATION_SECONDS = Histogram(
+    "notice_websocket_duration_seconds",
+    "Time websockets stayed open.",
+    ["route"],
+    buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400),
+)
+
+WEBSOCKET_CLOSES = Counter(
+    "notice_websocket_closes",
+    "Closed websockets, by close code.",
+    ["route", "code"],
+)
+
+WEBSOCKET_MESSAGE_SECONDS = Histogram(
+    "notice_websocket_message_duration_seconds",
+    "Time spent handling the messages of the note websockets.",
+    ["type"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "notice_db_query_duration_seconds",
+    "Time spent running database statements.",
+    ["statement"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "notice_db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the database pool.",
+    buckets=LATENCY_BUCKETS,
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    "notice_db_pool_checked_out",
+    "Connections checked out of the database pools.",
+    multiprocess_mode="livesum",
+)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "notice_event_loop_lag_seconds",
+    "How late the event loop ran a timer.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def make_metrics_app() -> ASGIApp:
+    """The ASGI app of `/metrics`, with the metrics of every worker in
+    multiprocess mode."""
+
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return make_asgi_app()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return make_asgi_app(registry)
+
+
+def route_template(scope: Scope) -> str:
+    """The path template of the route of a request, e.g. `/bookshelves/{id}`.
+
+    Metrics are labelled by template instead of by path, so ids don't make a
+    new series each. Paths which match no route are all `unmatched`, and the
+    ones which only match the path of a route, answered with a `405`, get the
+    template of the route.
+    """
+
+    partial = "unmatched"
+    for route in getattr(scope.get("app"), "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+        if match == Match.PARTIAL and partial == "unmatched":
+            partial = getattr(route, "path", "unmatched")
+    return partial
+
+
+def frame_size(message: Message) -> int:
+    """The size of the frame of a websocket message, in bytes."""
+
+    if (text := message.get("text")) is not None:
+        # Most frames are ASCII JSON, whose size is its length.
+        return len(text) if text.isascii() else len(text.encode())
+    return len(message.get("bytes") or b"")
+
+
+@dataclass
+class WebSocketSession:
+    """The counters of a websocket, see `MetricsMiddleware`."""
+
+    route: str
+    received_messages: int = 0
+    received_bytes: int = 0
+    sent_messages: int = 0
+    sent_bytes: int = 0
+    close_code: Optional[int] = None
+    closed_by: Optional[Literal["client", "server"]] = None
+
+
+class MetricsMiddleware:
+    """Record the latency of HTTP requests, and the open websockets with their
+    messages.
+
+    A pure ASGI middleware, so it sees the messages of websockets, which the
+    `@app.middleware("http")` middlewares don't. This is also where websockets
+    get their access log, see `log_websocket_session`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            await self._serve_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._serve_websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _serve_http(self, scope: Scope, receive: Receive, send: Send):
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_and_record_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route_template(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
+
+    async def _serve_websocket(self, scope: Scope, receive: Receive, send: Send):
+        session = WebSocketSession(route=route_template(scope))
+        # The counters are updated as the messages come, for their rates.
+        received = WEBSOCKET_MESSAGES.labels(session.route, "received")
+        received_bytes = WEBSOCKET_BYTES.labels(session.route, "received")
+        sent = WEBSOCKET_MESSAGES.labels(session.route, "sent")
+        sent_bytes = WEBSOCKET_BYTES.labels(session.route, "sent")
+
+        async def receive_and_count() -> Message:
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                size = frame_size(message)
+                received.inc()
+                received_bytes.inc(size)
+                session.received_messages += 1
+                session.received_bytes += size
+            elif message["type"] == "websocket.disconnect" and not session.closed_by:
+                session.close_code = message.get("code", 1000)
+                session.closed_by = "client"
+            return message
+
+        async def send_and_count(message: Message):
+            if message["type"] == "websocket.send":
+                size = frame_size(message)
+                sent.inc()
+                sent_bytes.inc(size)
+                session.sent_messages += 1
+                session.sent_bytes += size
+            elif message["type"] == "websocket.close" and not session.closed_by:
+                session.close_code = message.get("code", 1000)
+                session.closed_by = "server"
+            await send(message)
+
+        start = time.perf_counter_ns()
+        try:
+            with WEBSOCKETS_OPEN.labels(session.route).track_inprogress():
+                await self.app(scope, receive_and_count, send_and_count)
+        except BaseException:
+            if session.closed_by is None:
+                # The server closes the websocket of a failed handler.
+                session.close_code = 1011
+                session.closed_by = "server"
+            raise
+        finally:
+            duration = time.perf_counter_ns() - start
+            WEBSOCKET_DURATION_SECONDS.labels(session.route).observe(duration / 1e9)
+            WEBSOCKET_CLOSES.labels(session.route, str(session.close_code)).inc()
+            log_websocket_session(scope, session, duration)
+
+
+def log_websocket_session(scope: Scope, session: WebSocketSession, duration: int):
+    """Log a closed websocket to `api.access`, like the HTTP requests are logged
+    by `install_logging_middleware`."""
+
+    client_host, client_port = scope.get("client") or (None, None)
+    path = scope["path"]
+    access_logger.info(
+        f'{client_host}:{client_port} - "WebSocket {path}" {session.close_code}',
+        websocket={
+            "path": path,
+            "route": session.route,
+            "close_code": session.close_code,
+            "closed_by": session.closed_by,
+            "received": {
+                "messages": session.received_messages,
+                "bytes": session.received_bytes,
+            },
+            "sent": {"messages": session.sent_messages, "bytes": session.sent_bytes},
+        },
+        network={"client": {"host": client_host, "port": client_port}},
+        duration=duration,
+    )
+
+
+class EventLoopMonitor:
+    """Record the lag of the event loop in `EVENT_LOOP_LAG_SECONDS`.
+
+    Sleeps for `METRICS_EVENT_LOOP_INTERVAL_SECONDS` at a time, and records how
+    long after its deadline the loop woke it up.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task[None]] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - deadline))
+
+
+event_loop_monitor = EventLoopMonitor(settings.METRICS_EVENT_LOOP_INTERVAL_SECONDS)
+"""The event loop monitor of this worker, started with the application."""
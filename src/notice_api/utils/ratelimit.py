@@ -0,0 +1,202 @@
+"""Per-worker admission control of the clients of the API.
+
+A single client must not be able to exhaust a worker, whose websockets each
+hold a database session, a speech-to-text connection or an LLM stream. Every
+client has separate budgets, checked before any of that work starts:
+
+- HTTP requests, and websocket connections, are rate limited per session, or
+  per client address for tokens which were not validated yet, see `client_key`
+  and `install_rate_limit_middleware`. Rejected requests get a
+  `429 Too Many Requests` with a `Retry-After` header.
+- Websockets are limited to a number of concurrent connections per user, see
+  `websocket_limiter`. Sockets over the limit are closed with
+  `1013 Try Again Later`.
+- Note generations are rate limited per user, and limited to a number of
+  concurrent generations per user, see `generation_rate_limiter` and
+  `generation_limiter`.
+
+Rates are token buckets: a key can spend a burst of tokens at once, and gets
+tokens back at a steady rate. The limits are per worker, and not shared over
+the message bus, so the budget of a client is multiplied by the number of
+workers it reaches.
+"""
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.requests import HTTPConnection
+
+from notice_api.auth.cache import session_cache
+from notice_api.core.config import settings
+
+
+@dataclass
+class TokenBucket:
+    tokens: float
+    updated: float
+    """The `time.monotonic()` when `tokens` was last refilled."""
+
+
+class RateLimiter:
+    """Token bucket rate limits of many keys.
+
+    Args:
+        rate: The tokens a key gets back per second.
+        burst: The maximum tokens of a key, which a new key starts with.
+        max_keys: The maximum number of keys tracked, the least recently used
+            keys are forgotten first, which refills their bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def take(self, key: str, cost: float = 1.0) -> Optional[float]:
+        """Take tokens from the bucket of the key.
+
+        Returns `None` if the key had enough tokens, else the number of seconds
+        until it will have them, and no tokens are taken.
+        """
+
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(tokens=self.burst, updated=now)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            elapsed = now - bucket.updated
+            bucket.tokens = min(self.burst, bucket.tokens + elapsed * self.rate)
+            bucket.updated = now
+            self._buckets.move_to_end(key)
+
+        if bucket.tokens < cost:
+            return (cost - bucket.tokens) / self.rate
+        bucket.tokens -= cost
+        return None
+
+
+class ConcurrencyLimiter:
+    """Limit the number of concurrent operations of every key.
+
+    Args:
+        limit: The maximum number of operations of a key at once.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active: dict[str, int] = {}
+
+    def acquire(self, key: str) -> bool:
+        """Start an operation of the key, unless it is at the limit.
+
+        Every successful `acquire` must be followed by a `release`.
+        """
+
+        active = self._active.get(key, 0)
+        if active >= self.limit:
+            return False
+        self._active[key] = active + 1
+        return True
+
+    def release(self, key: str):
+        """End an operation of the key."""
+
+        self._active[key] -= 1
+        if not self._active[key]:
+            del self._active[key]
+
+
+def client_host(connection: HTTPConnection) -> Optional[str]:
+    """The address of the client, behind the `RATE_LIMIT_TRUSTED_PROXIES`."""
+
+    host = connection.client.host if connection.client is not None else None
+    if host not in settings.RATE_LIMIT_TRUSTED_PROXIES:
+        return host
+    # Every proxy appends the address it received the request from, so the
+    # client is the last address which is not one of the trusted proxies.
+    forwarded = connection.headers.get("x-forwarded-for", "").split(",")
+    for address in reversed([address.strip() for address in forwarded]):
+        if address and address not in settings.RATE_LIMIT_TRUSTED_PROXIES:
+            return address
+    return host
+
+
+def client_key(session_token: Optional[str], client_host: Optional[str]) -> str:
+    """The key of the request budget of a client.
+
+    A session token is only used once `get_current_user` validated it, which
+    caches it, so made-up tokens share the budget of their client address
+    instead of each getting a budget of its own. Session tokens are keyed by a
+    digest, so they are not kept in memory.
+    """
+
+    if session_token is not None and (
+        (cached := session_cache.get(session_token)) is not None
+        and cached.user is not None
+    ):
+        digest = hashlib.blake2b(session_token.encode(), digest_size=16).hexdigest()
+        return f"session:{digest}"
+    return f"host:{client_host}"
+
+
+request_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_REQUESTS_PER_SECOND,
+    burst=settings.RATE_LIMIT_REQUESTS_BURST,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+)
+"""The HTTP requests and websocket connections of every client."""
+
+websocket_limiter = ConcurrencyLimiter(limit=settings.RATE_LIMIT_WEBSOCKETS_PER_USER)
+"""The open websockets of every user."""
+
+generation_rate_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_GENERATIONS_PER_MINUTE / 60,
+    burst=settings.RATE_LIMIT_GENERATIONS_BURST,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+)
+"""The note generations started by every user."""
+
+generation_limiter = ConcurrencyLimiter(
+    limit=settings.RATE_LIMIT_CONCURRENT_GENERATIONS
+)
+"""The running note generations of every user."""
+
+
+def too_many_requests(retry_after: float) -> Response:
+    return JSONResponse(
+        {"detail": "Too many requests."},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def install_rate_limit_middleware(app: FastAPI) -> FastAPI:
+    """Install a middleware which rejects the HTTP requests of a client over its
+    budget of `request_limiter` with `429 Too Many Requests`.
+
+    Notes:
+        Websockets send their session token in their first message, after the
+        handshake, so the routes take their connections from the same budget.
+    """
+
+    @app.middleware("http")
+    async def limit_request_rate(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        key = client_key(request.headers.get("x-session-token"), client_host(request))
+        if (retry_after := request_limiter.take(key)) is not None:
+            return too_many_requests(retry_after)
+        return await call_next(request)
+
+    return app
@@ -0,0 +1,87 @@
+"""Encoding of the messages exchanged over the websockets.
+
+Messages are decoded with msgspec into typed schemas, which validates them
+before they reach the handlers. A text frame holds a JSON message and a binary
+frame holds a MessagePack message.
+
+The server sends JSON text frames, unless the client asks for MessagePack in the
+`format` of its `init` message, which is smaller and cheaper to encode and
+decode for large note trees.
+"""
+
+from typing import Any, Generic, Literal, TypeVar, Union
+
+import msgspec
+from fastapi import WebSocket, WebSocketDisconnect, status
+
+WireFormat = Literal["json", "msgpack"]
+Frame = Union[str, bytes]
+"""A websocket frame, `str` for text frames and `bytes` for binary frames."""
+
+T = TypeVar("T")
+
+
+class Init(msgspec.Struct, tag="init", tag_field="type"):
+    """The first message of a websocket session, authenticating the user."""
+
+    payload: str
+    """The session token of the user."""
+    format: WireFormat = "json"
+    """The format of the frames sent by the server."""
+
+
+class Codec:
+    """Encode the messages sent to a client in a wire format."""
+
+    def __init__(self, format: WireFormat):
+        self.format = format
+        self._json = msgspec.json.Encoder()
+        self._msgpack = msgspec.msgpack.Encoder()
+
+    def encode(self, message: Any) -> Frame:
+        if self.format == "msgpack":
+            return self._msgpack.encode(message)
+        return self._json.encode(message).decode()
+
+
+CODECS: dict[WireFormat, Codec] = {
+    "json": Codec("json"),
+    "msgpack": Codec("msgpack"),
+}
+
+
+class MessageDecoder(Generic[T]):
+    """Decode and validate the frames received from a client as `type`.
+
+    Raises `msgspec.DecodeError`, or its subclass `msgspec.ValidationError`,
+    for frames which are not a valid message.
+    """
+
+    def __init__(self, type: Any):
+        self._json = msgspec.json.Decoder(type)
+        self._msgpack = msgspec.msgpack.Decoder(type)
+
+    def decode(self, frame: Frame) -> T:
+        if isinstance(frame, bytes):
+            return self._msgpack.decode(frame)
+        return self._json.decode(frame)
+
+
+async def receive_frame(websocket: WebSocket) -> Frame:
+    """Receive the next text or binary frame from a websocket."""
+
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(
+            message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason")
+        )
+    if (text := message.get("text")) is not None:
+        return text
+    return message["bytes"]
+
+
+async def send_frame(websocket: WebSocket, frame: Frame):
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
@@ -0,0 +1,46 @@
+"""The tests run against a temporary SQLite database, see `DATABASE_URL`."""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+from uuid import UUID, uuid4
+
+import pytest
+
+# Set before `notice_api.core.config` reads the settings.
+os.environ["DATABASE_URL"] = (
+    f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='notice-api-')}/test.db"
+)
+
+from notice_api.auth.schema import User
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.db import AsyncSessionFactory, engine, migrate_database
+from notice_api.notes.schema import Note
+
+
+async def create_note() -> UUID:
+    await migrate_database()
+    async with AsyncSessionFactory() as db:
+        user = User(
+            id=f"test-{uuid4()}",
+            email="test@example.com",
+            email_verified=datetime.now(),
+        )
+        bookshelf_id, note_id = uuid4(), uuid4()
+        bookshelf = Bookshelf(id=bookshelf_id, title="test", user_id=user.id)
+        note = Note(
+            id=note_id, title="test", bookshelf_id=bookshelf_id, user_id=user.id
+        )
+        db.add_all([user, bookshelf, note])
+        await db.commit()
+    # Every test runs its own event loop, which the pooled connections belong to.
+    await engine.dispose()
+    return note_id
+
+
+@pytest.fixture
+def note_id() -> UUID:
+    """A new note, with the default content."""
+
+    return asyncio.run(create_note())
@@ -0,0 +1,35 @@
+import logging
+import queue
+import threading
+from typing import Any, cast
+
+from notice_api.utils.logging.core import BackgroundQueueHandler
+
+
+def make_record(msg: object, *args: object) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_events_are_copied_before_they_are_queued():
+    items = ["a"]
+    lock = threading.Lock()
+    handler = BackgroundQueueHandler(queue.SimpleQueue())
+
+    record = handler.prepare(
+        make_record({"event": "test", "items": items, "lock": lock})
+    )
+    items.append("b")
+
+    event = cast(dict[str, Any], record.msg)
+    assert event["items"] == ["a"]
+    assert event["lock"] == repr(lock)
+
+
+def test_messages_are_formatted_before_they_are_queued():
+    items = ["a"]
+    handler = BackgroundQueueHandler(queue.SimpleQueue())
+
+    record = handler.prepare(make_record("items %s", items))
+    items.append("b")
+
+    assert record.getMessage() == "items ['a']"
@@ -0,0 +1,41 @@
+import asyncio
+from pathlib import Path
+from uuid import uuid4
+
+from notice_api.notes.cache import NoteContentCache
+from notice_api.utils.bus import RESYNC_CHANNEL, UnixSocketMessageBus
+
+
+def create_bus(directory: Path, name: str) -> UnixSocketMessageBus:
+    bus = UnixSocketMessageBus(directory)
+    bus.path = directory / f"{name}.sock"
+    return bus
+
+
+async def overflow_peer(directory: Path) -> tuple[bool, bool]:
+    sender, receiver = create_bus(directory, "a"), create_bus(directory, "b")
+    cache = NoteContentCache(bus=receiver, max_entries=10)
+    resynced = asyncio.Event()
+    receiver.subscribe(RESYNC_CHANNEL, lambda message: resynced.set())
+    await sender.start()
+    await receiver.start()
+
+    note_id = uuid4()
+    await cache.get_or_load(note_id, lambda: asyncio.sleep(0, []))
+    # Publish without yielding, so the receiver cannot drain its socket.
+    for _ in range(1000):
+        await sender.publish("test", {})
+    dropped = bool(sender._missed)
+
+    await asyncio.wait_for(resynced.wait(), timeout=5)
+    cached = cache.get(note_id) is not None
+    await sender.stop()
+    await receiver.stop()
+    return dropped, cached
+
+
+def test_resync_after_dropped_messages(tmp_path: Path):
+    dropped, cached = asyncio.run(overflow_peer(tmp_path))
+
+    assert dropped
+    assert not cached
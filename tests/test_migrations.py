@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect, text
+
+import notice_api.db  # noqa: F401
+from notice_api.migrations import MIGRATIONS, applied_versions, run_migrations
+
+
+def test_sqlite_transcript_primary_key_is_rebuilt(tmp_path: Path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.connect() as conn:
+        # The table as created before `id` became the whole primary key.
+        conn.execute(
+            text(
+                "CREATE TABLE transcript (id INTEGER NOT NULL, "
+                "note_id CHAR(32) NOT NULL, timestamp DATETIME NOT NULL, "
+                "text VARCHAR NOT NULL, PRIMARY KEY (id, note_id))"
+            )
+        )
+        conn.execute(text("CREATE INDEX ix_transcript_note_id ON transcript (note_id)"))
+        conn.execute(
+            text("INSERT INTO transcript VALUES (7, 'a', '1970-01-01 00:00:05', 'hi')")
+        )
+        conn.commit()
+
+        run_migrations(conn)
+
+        inspector = inspect(conn)
+        primary_key = inspector.get_pk_constraint("transcript")
+        indexes = [index["name"] for index in inspector.get_indexes("transcript")]
+        assert primary_key["constrained_columns"] == ["id"]
+        assert indexes == ["ix_transcript_note_id"]
+        assert "transcript_rebuilt" not in inspector.get_table_names()
+        assert applied_versions(conn) == set(range(1, len(MIGRATIONS) + 1))
+
+        # `id` autoincrements now, after the copied rows.
+        conn.execute(
+            text(
+                "INSERT INTO transcript (note_id, timestamp, text) "
+                "VALUES ('a', '1970-01-01 00:00:06', 'there')"
+            )
+        )
+        result = conn.execute(text("SELECT id, text FROM transcript ORDER BY id"))
+        assert list(result.tuples()) == [(7, "hi"), (8, "there")]
+    engine.dispose()
@@ -0,0 +1,69 @@
+import asyncio
+from uuid import UUID
+
+import pytest
+
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.diff import diff_content
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import (
+    BlockNoteRepository,
+    CompressedNoteRepository,
+    NoteRepository,
+)
+
+
+def make_node(node_id: str, children: list[NoteContent]) -> NoteContent:
+    return {
+        "id": node_id,
+        "type": "ListItemNode",
+        "value": node_id,
+        "children": children,
+    }
+
+
+def make_tree(tree: dict[str, list[str]]) -> list[NoteContent]:
+    """Top-level nodes and the ids of their children, in order."""
+
+    return [
+        make_node(node_id, [make_node(child, []) for child in children])
+        for node_id, children in tree.items()
+    ]
+
+
+# The last child of `a` moves to the end of `b`.
+OLD = make_tree({"a": ["a1", "a2"], "b": ["b1"]})
+NEW = make_tree({"a": ["a1"], "b": ["b1", "a2"]})
+
+
+def test_move_across_subtrees_marks_both_subtrees_dirty():
+    diff = diff_content(OLD, NEW)
+
+    assert diff is not None
+    assert not diff.root_reordered
+    assert diff.removed == []
+    assert diff.dirty_top_level == {0, 1}
+
+
+async def persist_diff(
+    note_id: UUID, repository_class: type[NoteRepository]
+) -> list[NoteContent]:
+    async with AsyncSessionFactory() as db:
+        repo = repository_class(db)
+        await repo.update_note_content(note_id, OLD)
+        diff = diff_content(await repo.get_note_content(note_id), NEW)
+        assert diff is not None
+        await repo.apply_note_diff(note_id, diff, NEW)
+        content = await repository_class(db).get_note_content(note_id)
+    await engine.dispose()
+    return content
+
+
+@pytest.mark.parametrize(
+    "repository_class",
+    [NoteRepository, BlockNoteRepository, CompressedNoteRepository],
+)
+def test_move_across_subtrees_persists_new_content(
+    note_id: UUID, repository_class: type[NoteRepository]
+):
+    assert asyncio.run(persist_diff(note_id, repository_class)) == NEW
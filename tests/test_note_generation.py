@@ -0,0 +1,76 @@
+import asyncio
+from collections.abc import AsyncIterator, Sequence
+from typing import Any
+from uuid import UUID
+
+import pytest
+
+from notice_api.core.config import settings
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes import routes
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import BlockNoteRepository
+from notice_api.notes.write_buffer import NoteWriteBuffer
+
+GENERATED = ["# Topic\n", "- first\n", "    - detail\n", "- second\n", "- third\n"]
+
+
+async def generate(
+    transcript: str | Sequence[str], usernote: str
+) -> AsyncIterator[str]:
+    for line in GENERATED:
+        yield line
+
+
+def shape(children: list[NoteContent]) -> list[Any]:
+    """The values of a content tree, without the generated ids."""
+
+    return [(node["value"], shape(node["children"])) for node in children]
+
+
+async def generate_into_note(
+    note_id: UUID,
+) -> tuple[int, list[tuple[int, list[Any]]], list[NoteContent]]:
+    sent: list[dict[str, Any]] = []
+    batches: list[tuple[int, list[Any]]] = []
+
+    async def send(message: dict[str, Any]):
+        sent.append(message)
+
+    async with AsyncSessionFactory() as db:
+        repo = BlockNoteRepository(db)
+        buffer = NoteWriteBuffer(repo=repo, note_id=note_id, content=[])
+
+        async def persist(index: int, contents: list[NoteContent]):
+            batches.append((index, shape(contents)))
+            await buffer.insert_contents(index, contents)
+
+        await routes.handle_note_generation(
+            send=send, persist=persist, transcripts=[], usernote="", index=0
+        )
+    async with AsyncSessionFactory() as db:
+        persisted = await BlockNoteRepository(db).get_note_content(note_id)
+    await engine.dispose()
+    return len(sent), batches, persisted
+
+
+def test_generated_blocks_are_persisted_in_batches_of_subtrees(
+    note_id: UUID, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(routes.model, "generate_note_openai_async", generate)
+    monkeypatch.setattr(settings, "NOTE_GENERATION_BATCH_BLOCKS", 2)
+
+    sent, batches, persisted = asyncio.run(generate_into_note(note_id))
+    # Every block, then the end of the generation.
+    assert sent == len(GENERATED) + 1
+    # A batch only ends before a top-level block, so "detail" stays with "first".
+    assert batches == [
+        (0, [("Topic", []), ("first", [("detail", [])])]),
+        (2, [("second", []), ("third", [])]),
+    ]
+    assert shape(persisted) == [
+        ("Topic", []),
+        ("first", [("detail", [])]),
+        ("second", []),
+        ("third", []),
+    ]
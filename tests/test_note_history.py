@@ -0,0 +1,101 @@
+import asyncio
+from uuid import UUID
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlmodel import col
+
+from notice_api.core.config import settings
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.diff import diff_content
+from notice_api.notes.history import NoteHistory
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.schema import NoteVersion
+
+
+def make_content(value: str) -> list[NoteContent]:
+    return [{"id": "a", "type": "ParagraphNode", "value": value, "children": []}]
+
+
+def make_long_content(value: str) -> list[NoteContent]:
+    """A content whose snapshot outweighs many deltas of its first node."""
+
+    return make_content(value) + [
+        {"id": f"n{i}", "type": "ParagraphNode", "value": "text", "children": []}
+        for i in range(20)
+    ]
+
+
+async def compact_backdated(note_id: UUID) -> list[int]:
+    """Record 4 versions, backdate the first 2 past the retention, compact."""
+
+    async with AsyncSessionFactory() as db:
+        history = NoteHistory(db)
+        for value in ("1", "2", "3"):
+            old, new = make_content(value), make_content(value + "!")
+            await history.record(note_id, old, new, diff_content(old, new))
+        conn = await db.connection()
+        # The same clock and format as the `created_at` filled in by SQLite.
+        await conn.execute(
+            update(NoteVersion)
+            .where(col(NoteVersion.note_id) == note_id, col(NoteVersion.version) <= 2)
+            .values(created_at=func.datetime("now", "-365 days"))
+        )
+        await history.compact(note_id, latest=4)
+        await db.commit()
+
+        conn = await db.connection()
+        result = await conn.execute(
+            select(col(NoteVersion.version))
+            .where(col(NoteVersion.note_id) == note_id)
+            .order_by(col(NoteVersion.version))
+        )
+        versions = list(result.scalars())
+    await engine.dispose()
+    return versions
+
+
+def test_compact_deletes_versions_past_the_retention(note_id: UUID):
+    assert asyncio.run(compact_backdated(note_id)) == [3, 4]
+
+
+async def compact_rebased(note_id: UUID) -> list[tuple[int, int, int, int]]:
+    """Record 6 versions, the last one a snapshot compacting the first 3."""
+
+    async with AsyncSessionFactory() as db:
+        history = NoteHistory(db)
+        for value in range(1, 6):
+            old, new = make_long_content(str(value - 1)), make_long_content(str(value))
+            await history.record(note_id, old, new, diff_content(old, new))
+        await db.commit()
+
+        rebuilt = await history.get_content(note_id, 5)
+        assert rebuilt is not None and rebuilt[0] == make_long_content("4")
+
+        conn = await db.connection()
+        result = await conn.execute(
+            select(
+                col(NoteVersion.version),
+                col(NoteVersion.base),
+                col(NoteVersion.chain_size),
+                func.length(col(NoteVersion.data)),
+            )
+            .where(col(NoteVersion.note_id) == note_id)
+            .order_by(col(NoteVersion.version))
+        )
+        rows = [(version, base, chain, size) for version, base, chain, size in result]
+    await engine.dispose()
+    return rows
+
+
+def test_compact_rebases_the_deltas_on_the_new_snapshot(
+    note_id: UUID, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "NOTE_HISTORY_SNAPSHOT_INTERVAL", 5)
+    monkeypatch.setattr(settings, "NOTE_HISTORY_MAX_VERSIONS", 3)
+
+    rows = asyncio.run(compact_rebased(note_id))
+    assert [(version, base) for version, base, _, _ in rows] == [(4, 4), (5, 4), (6, 6)]
+    # The chain of the rebased delta only counts the deltas since version 4.
+    (_, _, snapshot_chain, _), (_, _, delta_chain, delta_size), _ = rows
+    assert (snapshot_chain, delta_chain) == (0, delta_size)
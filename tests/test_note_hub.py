@@ -0,0 +1,96 @@
+import asyncio
+from typing import Optional, cast
+from uuid import UUID
+
+from fastapi import WebSocket
+
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.hub import NoteHubs
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import get_note_repository
+from notice_api.utils.bus import LocalMessageBus
+from notice_api.utils.websocket import CODECS
+
+CONTENT: list[NoteContent] = [
+    {"id": "a", "type": "ParagraphNode", "value": "remote", "children": []},
+]
+
+
+async def relay_while_opening(note_id: UUID) -> list[NoteContent]:
+    hubs = NoteHubs(bus=LocalMessageBus())
+    acquiring = asyncio.create_task(hubs._acquire(note_id, "test"))
+    # Let `_acquire` start opening the hub, without waiting for it to open.
+    await asyncio.sleep(0)
+    assert not hubs._hubs[note_id].done()
+
+    await hubs._on_remote_updates(
+        {
+            "note_id": note_id.hex,
+            "entries": [{"type": "update all", "payload": CONTENT, "seq": 1}],
+        }
+    )
+    hub = await acquiring
+    content = hub.buffer.content
+    await hubs._release(hub)
+    await engine.dispose()
+    return content
+
+
+def test_updates_relayed_while_opening_are_applied(note_id: UUID):
+    assert asyncio.run(relay_while_opening(note_id)) == CONTENT
+
+
+async def open_after_unflushed_relay(note_id: UUID) -> list[NoteContent]:
+    # Two workers, whose relays are lost since the note is not open on `other`.
+    hubs, other = NoteHubs(bus=LocalMessageBus()), NoteHubs(bus=LocalMessageBus())
+    hub = await hubs._acquire(note_id, "test")
+    version = hub.buffer.update_all(CONTENT)
+    hub.accepted(None, version, {"type": "update all", "payload": CONTENT})
+
+    other_hub = await other._acquire(note_id, "test")
+    await hub.buffer.flush()
+    await other._on_invalidated({"note_id": note_id.hex})
+    content = other_hub.buffer.content
+    await other._release(other_hub)
+    await hubs._release(hub)
+    await engine.dispose()
+    return content
+
+
+def test_hub_opened_before_a_flush_reloads_the_note(note_id: UUID):
+    assert asyncio.run(open_after_unflushed_relay(note_id)) == CONTENT
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.close_code: Optional[int] = None
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int, reason: Optional[str] = None):
+        self.close_code = code
+
+
+async def delete_open_note(note_id: UUID) -> tuple[Optional[int], list[NoteContent]]:
+    hubs = NoteHubs(bus=LocalMessageBus())
+    hub = await hubs._acquire(note_id, "test")
+    websocket = FakeWebSocket()
+    subscriber = hub.subscribe(cast(WebSocket, websocket), CODECS["json"])
+    hub.buffer.update_all(CONTENT)
+
+    await hubs.notes_deleted([note_id])
+    # The session leaves once its socket is closed.
+    await hub.unsubscribe(subscriber)
+    await hubs._release(hub)
+    async with AsyncSessionFactory() as db:
+        content = await get_note_repository(db).get_note_content(note_id)
+    await engine.dispose()
+    return websocket.close_code, content
+
+
+def test_deleting_an_open_note_closes_its_sessions_without_writing(note_id: UUID):
+    close_code, content = asyncio.run(delete_open_note(note_id))
+
+    assert close_code == 1000
+    assert content == []
@@ -0,0 +1,82 @@
+import asyncio
+import json
+from uuid import UUID
+
+import msgspec
+import pytest
+
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.messages import InsertNode, UpdateAll, note_message_decoder
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import BlockNoteRepository
+
+NODE = {
+    "id": "a",
+    "type": "ParagraphNode",
+    "value": "one",
+    "children": [
+        {
+            "id": "a1",
+            "type": "ListItemNode",
+            "value": "two",
+            "children": [],
+            "checked": True,
+        },
+    ],
+    "color": {"text": "red"},
+}
+
+
+@pytest.mark.parametrize("wire_format", ["json", "msgpack"])
+def test_decoding_keeps_unknown_node_fields(wire_format: str):
+    message = {"type": "insert node", "payload": {"parent": "root", "after": None}}
+    message["payload"]["content"] = NODE
+    if wire_format == "json":
+        frame = json.dumps(message)
+    else:
+        frame = msgspec.msgpack.encode(message)
+
+    decoded = note_message_decoder.decode(frame)
+
+    assert isinstance(decoded, InsertNode)
+    assert decoded.payload.content == NODE
+
+
+@pytest.mark.parametrize(
+    "node",
+    [
+        {**NODE, "id": ""},
+        {**NODE, "children": [{"id": "a1", "type": "ListItemNode"}]},
+    ],
+)
+def test_decoding_rejects_invalid_nodes(node: dict):
+    frame = json.dumps({"type": "update all", "payload": [node]})
+
+    with pytest.raises(msgspec.ValidationError):
+        note_message_decoder.decode(frame)
+
+
+def test_decoding_rejects_fields_which_are_not_json():
+    frame = msgspec.msgpack.encode(
+        {"type": "update all", "payload": [{**NODE, "color": b"red"}]}
+    )
+
+    with pytest.raises(msgspec.ValidationError):
+        note_message_decoder.decode(frame)
+
+
+async def store_decoded(note_id: UUID) -> list[NoteContent]:
+    message = note_message_decoder.decode(
+        json.dumps({"type": "update all", "payload": [NODE]})
+    )
+    assert isinstance(message, UpdateAll)
+    async with AsyncSessionFactory() as db:
+        await BlockNoteRepository(db).update_note_content(note_id, message.payload)
+    async with AsyncSessionFactory() as db:
+        content = await BlockNoteRepository(db).get_note_content(note_id)
+    await engine.dispose()
+    return content
+
+
+def test_unknown_node_fields_round_trip_through_blocks(note_id: UUID):
+    assert asyncio.run(store_decoded(note_id)) == [NODE]
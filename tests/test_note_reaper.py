@@ -0,0 +1,97 @@
+import asyncio
+from datetime import timedelta
+from pathlib import Path
+from uuid import UUID
+
+import pytest
+from conftest import create_note
+from sqlalchemy import func, update
+from sqlmodel import col, select
+
+import notice_api.transcript.audio_saver
+from notice_api.core.config import settings
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.reaper import reap_batch
+from notice_api.notes.schema import Note
+from notice_api.transcript.schema import Transcript
+
+
+async def delete_notes(transcripts: int, audio_filenames: list[str]) -> list[UUID]:
+    """Create and delete a note for every audio file, the first one with
+    transcripts."""
+
+    note_ids = [await create_note() for _ in audio_filenames]
+    async with AsyncSessionFactory() as db:
+        db.add_all(
+            Transcript(note_id=note_ids[0], timestamp=timedelta(seconds=i), text="")
+            for i in range(transcripts)
+        )
+        for note_id, filename in zip(note_ids, audio_filenames, strict=True):
+            await db.execute(
+                update(Note)
+                .where(col(Note.id) == note_id)
+                .values(deleted_at=func.now(), transcript_audio_filename=filename)
+            )
+        await db.commit()
+    return note_ids
+
+
+async def reap_all() -> list[int]:
+    """Reap until there is nothing left, returning the rows of every batch."""
+
+    batches: list[int] = []
+    while True:
+        async with AsyncSessionFactory() as db:
+            removed = await reap_batch(db)
+        if not removed:
+            break
+        batches.append(removed)
+    return batches
+
+
+async def notes_left(note_ids: list[UUID]) -> int:
+    async with AsyncSessionFactory() as db:
+        result = await db.exec(select(Note.id).where(col(Note.id).in_(note_ids)))
+        left = len(result.all())
+    await engine.dispose()
+    return left
+
+
+@pytest.fixture
+def audio_directory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(notice_api.transcript.audio_saver, "AUDIO_DIRECTORY", tmp_path)
+    return tmp_path
+
+
+def test_reaper_removes_deleted_notes_in_batches(
+    audio_directory: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "NOTE_REAPER_BATCH_NOTES", 2)
+    monkeypatch.setattr(settings, "NOTE_REAPER_BATCH_TRANSCRIPTS", 2)
+
+    async def run() -> tuple[list[int], int]:
+        note_ids = await delete_notes(transcripts=3, audio_filenames=["a", "b", "c"])
+        return await reap_all(), await notes_left(note_ids)
+
+    batches, left = asyncio.run(run())
+
+    assert all(removed <= 2 for removed in batches)
+    # 3 transcripts and 3 notes.
+    assert sum(batches) == 6
+    assert left == 0
+
+
+def test_reaper_deletes_the_recordings_of_the_notes(audio_directory: Path):
+    recorded, unrelated = audio_directory / "a.mp3", audio_directory / "b.mp3"
+    recorded.touch()
+    unrelated.touch()
+
+    async def run():
+        await delete_notes(transcripts=0, audio_filenames=["a.mp3"])
+        await reap_all()
+        await engine.dispose()
+
+    asyncio.run(run())
+
+    assert not recorded.exists()
+    assert unrelated.exists()
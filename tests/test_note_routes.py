@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime
+from uuid import UUID, uuid4
+
+import httpx
+from fastapi import FastAPI
+
+from notice_api.auth.deps import get_current_user
+from notice_api.auth.schema import User
+from notice_api.bookshelves.routes import router as bookshelves_router
+from notice_api.bookshelves.schema import Bookshelf
+from notice_api.db import AsyncSessionFactory, engine, migrate_database
+from notice_api.notes.routes import router as notes_router
+
+
+async def create_user() -> tuple[User, UUID]:
+    """Create a user with an empty bookshelf."""
+
+    await migrate_database()
+    user = User(
+        id=f"test-{uuid4()}", email="test@example.com", email_verified=datetime.now()
+    )
+    bookshelf_id = uuid4()
+    async with AsyncSessionFactory() as db:
+        db.add(User.model_validate(user))
+        db.add(Bookshelf(id=bookshelf_id, title="test", user_id=user.id))
+        await db.commit()
+    return user, bookshelf_id
+
+
+def make_client(user: User) -> httpx.AsyncClient:
+    """A client of the bookshelves and notes routes, signed in as `user`."""
+
+    app = FastAPI()
+    app.include_router(bookshelves_router)
+    app.include_router(notes_router)
+    app.dependency_overrides[get_current_user] = lambda: user
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+async def note_count(client: httpx.AsyncClient) -> int:
+    """The note count of the only bookshelf of the user, as listed."""
+
+    response = await client.get("/bookshelves/")
+    (bookshelf,) = response.json()["data"]
+    return bookshelf["count"]
+
+
+async def note_counts_after_writes() -> list[int]:
+    """The note count of a bookshelf after creating 2 notes, then deleting 1."""
+
+    user, bookshelf_id = await create_user()
+    notes = f"/bookshelves/{bookshelf_id}/notes/"
+
+    counts: list[int] = []
+    async with make_client(user) as client:
+        note_ids = []
+        for title in ("first", "second"):
+            response = await client.post(notes, json={"title": title})
+            note_ids.append(response.json()["data"]["id"])
+        counts.append(await note_count(client))
+
+        response = await client.delete(f"{notes}{note_ids[0]}")
+        assert response.status_code == 204
+        counts.append(await note_count(client))
+
+        # A deleted note is not counted twice.
+        response = await client.delete(f"{notes}{note_ids[0]}")
+        assert response.status_code == 404
+        counts.append(await note_count(client))
+    await engine.dispose()
+    return counts
+
+
+def test_note_count_follows_created_and_deleted_notes():
+    assert asyncio.run(note_counts_after_writes()) == [2, 1, 1]
+
+
+async def list_notes_conditionally() -> list[int]:
+    """The statuses of listing the notes with the ETag of the previous listing."""
+
+    user, bookshelf_id = await create_user()
+    notes = f"/bookshelves/{bookshelf_id}/notes/"
+
+    statuses: list[int] = []
+    async with make_client(user) as client:
+        response = await client.get(notes)
+        etag = response.headers["ETag"]
+
+        response = await client.get(notes, headers={"If-None-Match": etag})
+        statuses.append(response.status_code)
+        assert response.headers["ETag"] == etag
+        # Weak and listed tags match as well.
+        response = await client.get(notes, headers={"If-None-Match": f'"x", W/{etag}'})
+        statuses.append(response.status_code)
+
+        await client.post(notes, json={"title": "new"})
+        response = await client.get(notes, headers={"If-None-Match": etag})
+        statuses.append(response.status_code)
+        assert response.headers["ETag"] != etag
+        assert [note["title"] for note in response.json()["data"]] == ["new"]
+    await engine.dispose()
+    return statuses
+
+
+def test_unchanged_notes_listing_is_not_modified():
+    assert asyncio.run(list_notes_conditionally()) == [304, 304, 200]
+
+
+async def batch_on_notes_of_another_user() -> tuple[int, list[int], list[str]]:
+    """Apply a batch to the notes and the bookshelf of another user.
+
+    Returns the status of a batch on the other bookshelf, the statuses of the
+    operations of a batch on the own bookshelf, and the notes of the other user.
+    """
+
+    user, bookshelf_id = await create_user()
+    other, other_bookshelf_id = await create_user()
+    notes = f"/bookshelves/{bookshelf_id}/notes/"
+    other_notes = f"/bookshelves/{other_bookshelf_id}/notes/"
+
+    async with make_client(other) as other_client:
+        response = await other_client.post(other_notes, json={"title": "theirs"})
+        other_note_id = response.json()["data"]["id"]
+
+        async with make_client(user) as client:
+            response = await client.post(notes, json={"title": "mine"})
+            note_id = response.json()["data"]["id"]
+
+            response = await client.post(
+                f"{other_notes}batch",
+                json={"operations": [{"op": "delete", "id": other_note_id}]},
+            )
+            bookshelf_status = response.status_code
+
+            response = await client.post(
+                f"{notes}batch",
+                json={
+                    "operations": [
+                        {"op": "rename", "id": other_note_id, "title": "stolen"},
+                        {"op": "delete", "id": other_note_id},
+                        {
+                            "op": "move",
+                            "id": note_id,
+                            "bookshelf_id": str(other_bookshelf_id),
+                        },
+                        {"op": "rename", "id": note_id, "title": "renamed"},
+                    ]
+                },
+            )
+            statuses = [result["status"] for result in response.json()["data"]]
+
+        response = await other_client.get(other_notes)
+        other_titles = [note["title"] for note in response.json()["data"]]
+    await engine.dispose()
+    return bookshelf_status, statuses, other_titles
+
+
+def test_batch_rejects_the_notes_and_bookshelves_of_other_users():
+    bookshelf_status, statuses, other_titles = asyncio.run(
+        batch_on_notes_of_another_user()
+    )
+
+    assert bookshelf_status == 404
+    # The operations on the user's own note still apply.
+    assert statuses == [404, 404, 404, 200]
+    assert other_titles == ["theirs"]
@@ -0,0 +1,61 @@
+import asyncio
+from uuid import UUID
+
+import pytest
+
+from notice_api.db import AsyncSessionFactory, engine
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import (
+    BlockNoteRepository,
+    CompressedNoteRepository,
+    NoteRepository,
+)
+
+CONTENT: list[NoteContent] = [
+    {
+        "id": "a",
+        "type": "HeadingNode",
+        "value": "Lecture",
+        "children": [
+            {"id": "a1", "type": "ListItemNode", "value": "one", "children": []},
+        ],
+    },
+    {"id": "b", "type": "ParagraphNode", "value": "two", "children": []},
+]
+
+
+async def migrate_note(
+    note_id: UUID, repository_class: type[NoteRepository]
+) -> tuple[list[NoteContent], list[NoteContent], list[NoteContent]]:
+    """Write the note with the json engine, then read it with another engine.
+
+    Returns what a second session of the engine reads, and what the json engine
+    reads before and after the migration.
+    """
+
+    async with AsyncSessionFactory() as db:
+        await NoteRepository(db).update_note_content(note_id, CONTENT)
+        await repository_class(db).get_note_content(note_id)
+    async with AsyncSessionFactory() as db:
+        migrated = await repository_class(db).get_note_content(note_id)
+        json_copy = await NoteRepository(db).get_note_content(note_id)
+        await repository_class(db).update_note_content(note_id, [])
+        stale_json_copy = await NoteRepository(db).get_note_content(note_id)
+    await engine.dispose()
+    return migrated, json_copy, stale_json_copy
+
+
+@pytest.mark.parametrize(
+    "repository_class", [BlockNoteRepository, CompressedNoteRepository]
+)
+def test_migration_keeps_json_copy(
+    note_id: UUID, repository_class: type[NoteRepository]
+):
+    migrated, json_copy, stale_json_copy = asyncio.run(
+        migrate_note(note_id, repository_class)
+    )
+
+    assert migrated == CONTENT
+    # The switch is one-way: later edits are not written to the json copy.
+    assert json_copy == CONTENT
+    assert stale_json_copy == CONTENT
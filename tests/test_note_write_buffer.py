@@ -0,0 +1,210 @@
+import asyncio
+from typing import Optional
+from uuid import UUID
+
+import pytest
+
+from notice_api.db import AsyncSession, AsyncSessionFactory, engine
+from notice_api.notes import tree
+from notice_api.notes.diff import NoteDiff
+from notice_api.notes.history import NoteHistory
+from notice_api.notes.note_content import NoteContent
+from notice_api.notes.repository import (
+    BlockNoteRepository,
+    CompressedNoteRepository,
+    NoteRepository,
+)
+from notice_api.notes.write_buffer import NoteWriteBuffer
+
+CONTENT: list[NoteContent] = [
+    {"id": "a", "type": "ParagraphNode", "value": "typed", "children": []},
+]
+
+
+def paragraph(node_id: str, value: str) -> NoteContent:
+    return {"id": node_id, "type": "ParagraphNode", "value": value, "children": []}
+
+
+class FailingHistory(NoteHistory):
+    """Fails to record the first version, which rolls the flush back."""
+
+    failed = False
+
+    async def record(
+        self,
+        note_id: UUID,
+        old: list[NoteContent],
+        new: list[NoteContent],
+        diff: Optional[NoteDiff],
+    ) -> Optional[int]:
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("record failed")
+        return await super().record(note_id, old, new, diff)
+
+
+async def flush_after_rollback(
+    note_id: UUID, repository_class: type[NoteRepository]
+) -> list[NoteContent]:
+    async with AsyncSessionFactory() as db:
+        content = await NoteRepository(db).get_note_content(note_id)
+        buffer = NoteWriteBuffer(
+            repo=repository_class(db),
+            note_id=note_id,
+            content=content,
+            history=FailingHistory(db),
+        )
+        buffer.update_all(CONTENT)
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        # The writes were put back, and are persisted by the retry.
+        assert buffer.pending
+        await buffer.flush()
+    async with AsyncSessionFactory() as db:
+        persisted = await repository_class(db).get_note_content(note_id)
+    await engine.dispose()
+    return persisted
+
+
+@pytest.mark.parametrize(
+    "repository_class", [BlockNoteRepository, CompressedNoteRepository]
+)
+def test_migration_rolled_back_with_the_first_flush_is_retried(
+    note_id: UUID, repository_class: type[NoteRepository]
+):
+    assert asyncio.run(flush_after_rollback(note_id, repository_class)) == CONTENT
+
+
+async def flushed_versions(
+    note_id: UUID, writes: int, interval: float, debounce: float, max_delay: float
+) -> list[tuple[int, int]]:
+    """Write every `interval` seconds, returning `(write, version)` per flush."""
+
+    flushed: list[tuple[int, int]] = []
+    written = 0
+
+    async def on_persisted(version: int):
+        flushed.append((written, version))
+
+    async with AsyncSessionFactory() as db:
+        buffer = NoteWriteBuffer(
+            repo=BlockNoteRepository(db),
+            note_id=note_id,
+            content=[],
+            on_persisted=on_persisted,
+            debounce=debounce,
+            max_delay=max_delay,
+        )
+        for written in range(1, writes + 1):
+            buffer.update_all([paragraph("a", str(written))])
+            await asyncio.sleep(interval)
+        await asyncio.sleep(debounce * 2)
+        await buffer.close()
+    async with AsyncSessionFactory() as db:
+        persisted = await BlockNoteRepository(db).get_note_content(note_id)
+    await engine.dispose()
+    assert persisted == [paragraph("a", str(writes))]
+    return flushed
+
+
+def test_writes_are_flushed_once_idle(note_id: UUID):
+    flushed = asyncio.run(
+        flushed_versions(note_id, 5, interval=0.02, debounce=0.2, max_delay=10)
+    )
+    assert flushed == [(5, 5)]
+
+
+def test_writes_are_flushed_after_the_max_delay_while_writing(note_id: UUID):
+    flushed = asyncio.run(
+        flushed_versions(note_id, 10, interval=0.05, debounce=0.2, max_delay=0.12)
+    )
+    # Flushed while the writes kept arriving faster than the debounce.
+    assert len(flushed) > 1
+    assert flushed[0][0] < 10
+    assert flushed[-1][1] == 10
+
+
+async def scheduled_flush_after_rollback(note_id: UUID) -> list[int]:
+    flushed: list[int] = []
+
+    async def on_persisted(version: int):
+        flushed.append(version)
+
+    async with AsyncSessionFactory() as db:
+        buffer = NoteWriteBuffer(
+            repo=BlockNoteRepository(db),
+            note_id=note_id,
+            content=[],
+            on_persisted=on_persisted,
+            history=FailingHistory(db),
+            debounce=0.05,
+        )
+        buffer.update_all(CONTENT)
+        # The failed flush puts the writes back and schedules another one.
+        await asyncio.sleep(0.3)
+        assert not buffer.pending
+    async with AsyncSessionFactory() as db:
+        persisted = await BlockNoteRepository(db).get_note_content(note_id)
+    await engine.dispose()
+    assert persisted == CONTENT
+    return flushed
+
+
+def test_failed_scheduled_flush_is_retried(note_id: UUID):
+    assert asyncio.run(scheduled_flush_after_rollback(note_id)) == [1]
+
+
+class GatedHistory(NoteHistory):
+    """Holds every flush until `release` is set."""
+
+    def __init__(self, db: AsyncSession):
+        super().__init__(db)
+        self.recording = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def record(
+        self,
+        note_id: UUID,
+        old: list[NoteContent],
+        new: list[NoteContent],
+        diff: Optional[NoteDiff],
+    ) -> Optional[int]:
+        self.recording.set()
+        await self.release.wait()
+        return await super().record(note_id, old, new, diff)
+
+
+async def remote_write_during_flush(note_id: UUID) -> list[list[NoteContent]]:
+    async with AsyncSessionFactory() as db:
+        history = GatedHistory(db)
+        history.release.set()
+        buffer = NoteWriteBuffer(
+            repo=BlockNoteRepository(db),
+            note_id=note_id,
+            content=[],
+            history=history,
+        )
+        buffer.update_all([paragraph("a", "local"), paragraph("b", "remote")])
+        await buffer.flush()
+
+        history.recording.clear()
+        history.release.clear()
+        buffer.update_node(paragraph("a", "typed"))
+        flush = asyncio.create_task(buffer.flush())
+        await history.recording.wait()
+        # Persisted by another worker while this buffer flushes its own write.
+        assert buffer.apply_remote(
+            lambda children: tree.update_node(children, paragraph("b", "edited"))
+        )
+        history.release.set()
+        await flush
+
+        await buffer.close()
+        contents = [buffer.persisted_content, buffer.content]
+    await engine.dispose()
+    return contents
+
+
+def test_remote_write_is_replayed_on_the_flushed_content(note_id: UUID):
+    expected = [paragraph("a", "typed"), paragraph("b", "edited")]
+    assert asyncio.run(remote_write_during_flush(note_id)) == [expected, expected]
@@ -0,0 +1,73 @@
+"""The pagination queries are served by their index, without sorting the rows.
+
+SQLite runs the same queries as MySQL, whose plans are checked against seeded
+tables by `benchmarks/query_plans.py`.
+"""
+
+import asyncio
+import itertools
+from datetime import datetime
+from typing import Any, Literal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import text
+
+from notice_api.bookshelves.routes import BookshelfCursor, select_bookshelves_page
+from notice_api.db import engine, migrate_database
+from notice_api.notes.routes import NoteCursor, select_notes_page
+
+Sort = Literal["title", "created_at"]
+Order = Literal["asc", "desc"]
+
+INDEXES = {
+    "bookshelf": {
+        "created_at": "ix_bookshelf_user_id_created_at_id",
+        "title": "ix_bookshelf_user_id_title_id",
+    },
+    "note": {
+        "created_at": "ix_note_bookshelf_id_user_id_created_at_id",
+        "title": "ix_note_bookshelf_id_user_id_title_id",
+    },
+}
+
+PAGES = list(itertools.product(["title", "created_at"], ["asc", "desc"], [False, True]))
+
+
+async def explain(statement: Any) -> list[str]:
+    await migrate_database()
+    async with engine.connect() as conn:
+        sql = statement.compile(
+            dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+        )
+        result = await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        plan = [row.detail for row in result]
+    await engine.dispose()
+    return plan
+
+
+def position() -> dict[str, Any]:
+    return {"id": uuid4(), "title": "test", "created_at": datetime.now()}
+
+
+@pytest.mark.parametrize(("sort", "order", "paged"), PAGES)
+def test_bookshelf_pages_use_their_index(sort: Sort, order: Order, paged: bool):
+    cursor = BookshelfCursor.model_validate(position()) if paged else None
+    statement = select_bookshelves_page("user", 10, order, sort, cursor)
+
+    plan = asyncio.run(explain(statement))
+
+    assert len(plan) == 1
+    assert f"USING INDEX {INDEXES['bookshelf'][sort]} " in plan[0]
+
+
+@pytest.mark.parametrize(("sort", "order", "paged"), PAGES)
+def test_note_pages_use_their_index(sort: Sort, order: Order, paged: bool):
+    cursor = NoteCursor.model_validate(position()) if paged else None
+    statement = select_notes_page("user", uuid4(), 10, order, sort, cursor)
+
+    plan = asyncio.run(explain(statement))
+
+    # A single search of the index, without a `TEMP B-TREE` to sort the rows.
+    assert len(plan) == 1
+    assert f"USING INDEX {INDEXES['note'][sort]} " in plan[0]
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from starlette.requests import Request
+
+import notice_api.utils.ratelimit
+from notice_api.auth.cache import session_cache
+from notice_api.auth.schema import User
+from notice_api.core.config import settings
+from notice_api.utils.ratelimit import (
+    RateLimiter,
+    client_host,
+    client_key,
+    install_rate_limit_middleware,
+)
+
+
+def make_request(host: str, forwarded_for: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "client": (host, 1234),
+            "headers": [(b"x-forwarded-for", forwarded_for.encode())],
+        }
+    )
+
+
+def test_unknown_tokens_share_the_budget_of_their_address():
+    assert client_key("made-up", "1.2.3.4") == "host:1.2.3.4"
+    assert client_key("other", "1.2.3.4") == "host:1.2.3.4"
+
+
+def test_validated_sessions_have_their_own_budget():
+    user = User(id="test", email="test@example.com", email_verified=datetime.now())
+    session_cache.put("valid", user, session_cache.generation)
+
+    assert client_key("valid", "1.2.3.4").startswith("session:")
+
+
+def test_forwarded_address_behind_trusted_proxies(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        settings, "RATE_LIMIT_TRUSTED_PROXIES", ["10.0.0.1", "10.0.0.2"]
+    )
+
+    # The client can send any address first, the proxies append the real one.
+    request = make_request("10.0.0.1", "6.6.6.6, 1.2.3.4, 10.0.0.2")
+
+    assert client_host(request) == "1.2.3.4"
+
+
+def test_forwarded_address_is_ignored_from_other_hosts():
+    assert client_host(make_request("1.2.3.4", "6.6.6.6")) == "1.2.3.4"
+
+
+async def send_requests(count: int) -> list[httpx.Response]:
+    app = install_rate_limit_middleware(FastAPI())
+    app.get("/")(lambda: {})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return [await client.get("/") for _ in range(count)]
+
+
+def test_requests_over_the_rate_are_rejected(monkeypatch: pytest.MonkeyPatch):
+    limiter = RateLimiter(rate=0.5, burst=2, max_keys=10)
+    monkeypatch.setattr(notice_api.utils.ratelimit, "request_limiter", limiter)
+
+    responses = asyncio.run(send_requests(3))
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert responses[2].headers["Retry-After"] == "2"
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import notice_api.db
+from notice_api.auth.cache import SessionCache, session_cache
+from notice_api.auth.deps import get_current_user, utcnow
+from notice_api.auth.schema import Session, User
+from notice_api.core.config import settings
+from notice_api.db import AsyncSessionFactory, engine, migrate_database, use_primary
+from notice_api.utils.bus import Message, MessageBus
+
+
+class PairedBus(MessageBus):
+    """Delivers the messages to the bus of one other worker."""
+
+    def __init__(self):
+        super().__init__()
+        self.peer: "PairedBus" = self
+        self.published: list[Message] = []
+
+    async def publish(self, channel: str, message: Message):
+        self.published.append(message)
+        await self.peer.dispatch(channel, message)
+
+
+@pytest.fixture
+def replica(monkeypatch: pytest.MonkeyPatch):
+    """A replica, which is another engine of the test database."""
+
+    replica = create_async_engine(settings.DATABASE_URL)
+    monkeypatch.setattr(notice_api.db, "replica_engines", [replica])
+    return replica
+
+
+def test_reads_go_to_a_replica_until_the_primary_is_used(replica):
+    session = AsyncSessionFactory().sync_session
+
+    assert session.get_bind(replica=True) is replica.sync_engine
+    assert session.get_bind() is engine.sync_engine
+    assert session.get_bind(replica=True) is engine.sync_engine
+
+
+def test_use_primary(replica):
+    db = AsyncSessionFactory()
+    use_primary(db)
+
+    assert db.sync_session.get_bind(replica=True) is engine.sync_engine
+
+
+async def create_session() -> str:
+    await migrate_database()
+    async with AsyncSessionFactory() as db:
+        user = User(
+            id=f"test-{uuid4()}",
+            email="test@example.com",
+            email_verified=datetime.now(),
+        )
+        session = Session(
+            session_token=str(uuid4()),
+            user_id=user.id,
+            expires=utcnow() + timedelta(days=1),
+        )
+        db.add_all([user, session])
+        await db.commit()
+    return session.session_token
+
+
+async def read_after_write(replica_lag: float, wait: float) -> tuple[bool, bool]:
+    """Whether the session reads from the primary before, and `wait` seconds
+    after it wrote."""
+
+    session_token = await create_session()
+    session_cache.replica_lag = replica_lag
+    try:
+        async with AsyncSessionFactory() as db:
+            await get_current_user(db, session_token)
+            before = bool(db.info.get("primary"))
+        await session_cache.wrote(session_token)
+        await asyncio.sleep(wait)
+        async with AsyncSessionFactory() as db:
+            await get_current_user(db, session_token)
+            after = bool(db.info.get("primary"))
+    finally:
+        session_cache.replica_lag = 0
+    for used_engine in [engine, *notice_api.db.replica_engines]:
+        await used_engine.dispose()
+    return before, after
+
+
+def test_session_reads_from_the_primary_after_it_wrote(replica):
+    assert asyncio.run(read_after_write(replica_lag=5, wait=0)) == (False, True)
+
+
+def test_session_reads_from_replicas_once_they_caught_up(replica):
+    assert asyncio.run(read_after_write(replica_lag=0.01, wait=0.02)) == (False, False)
+
+
+async def write_on_one_worker() -> tuple[bool, bool, int]:
+    bus, other_bus = PairedBus(), PairedBus()
+    bus.peer, other_bus.peer = other_bus, bus
+    cache = SessionCache(bus, max_entries=10, ttl=60, negative_ttl=5, replica_lag=5)
+    other = SessionCache(
+        other_bus, max_entries=10, ttl=60, negative_ttl=5, replica_lag=5
+    )
+
+    await cache.wrote("token")
+    await cache.wrote("token")
+    return (
+        cache.reads_primary("token"),
+        other.reads_primary("token"),
+        len(bus.published),
+    )
+
+
+def test_writes_are_shared_with_the_other_workers():
+    reads_primary, other_reads_primary, published = asyncio.run(write_on_one_worker())
+
+    assert reads_primary
+    assert other_reads_primary
+    # The second write is within the time already sent to the other worker.
+    assert published == 1
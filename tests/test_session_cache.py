@@ -0,0 +1,66 @@
+import asyncio
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from notice_api.auth.cache import MAX_TTL_SECONDS, SessionCache, session_cache
+from notice_api.auth.deps import get_current_user
+from notice_api.auth.schema import User
+from notice_api.db import AsyncSessionFactory, engine, migrate_database
+from notice_api.utils.bus import LocalMessageBus
+
+USER = User(id="test", email="test@example.com", email_verified=datetime.now())
+
+
+def create_cache(ttl: float = 60, negative_ttl: float = 5) -> SessionCache:
+    return SessionCache(
+        LocalMessageBus(), max_entries=10, ttl=ttl, negative_ttl=negative_ttl
+    )
+
+
+async def look_up_unknown_token() -> bool:
+    """Whether an unknown token is rejected, and cached as invalid."""
+
+    await migrate_database()
+    session_token = str(uuid4())
+    async with AsyncSessionFactory() as db:
+        with pytest.raises(HTTPException):
+            await get_current_user(db, session_token)
+    await engine.dispose()
+    cached = session_cache.get(session_token)
+    return cached is not None and cached.user is None
+
+
+def test_unknown_tokens_are_cached():
+    assert asyncio.run(look_up_unknown_token())
+
+
+def test_unknown_tokens_are_cached_for_the_negative_ttl():
+    cache = create_cache(negative_ttl=0.01)
+    cache.put("token", None, cache.generation)
+    cache.put("valid", USER, cache.generation)
+
+    time.sleep(0.02)
+
+    assert cache.get("token") is None
+    assert cache.get("valid") is not None
+
+
+def test_lookups_racing_with_an_invalidation_are_not_cached():
+    cache = create_cache()
+    generation = cache.generation
+    asyncio.run(cache.invalidate("token"))
+
+    cache.put("token", USER, generation)
+
+    assert cache.get("token") is None
+
+
+def test_ttl_is_capped():
+    cache = create_cache(ttl=3600, negative_ttl=3600)
+
+    assert cache.ttl == MAX_TTL_SECONDS
+    assert cache.negative_ttl == MAX_TTL_SECONDS